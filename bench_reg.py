@@ -0,0 +1,228 @@
+#########################################################################################
+# Description: Benchmark for gen_reg.py. Builds synthetic register workbooks and
+#              times/memory-profiles parse_excel and the Verilog generation, or the
+#              cold start of the command line with --startup.
+#########################################################################################
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import gen_reg
+
+SW_ACCESS = ['RW', 'W1P', 'W1C', 'RO']
+
+def make_workbook(filename, registers=1000, fields=4, arrays=10, var_range=64):
+    """Write a synthetic register workbook in the layout parse_excel expects.
+
+    The register sheet holds the module information in rows 1-9, the column
+    header in row 10 and then `registers` plain registers followed by `arrays`
+    array registers, every one with `fields` fields splitting the 32 bits.
+    Each array uses its own variable with range 0~var_range-1 from the
+    variable sheet. The module name is taken from the file name.
+    """
+    if not 1 <= fields <= 32:
+        raise ValueError(f"fields must be in 1..32, got {fields}")
+    module = os.path.basename(filename).split('.')[0]
+    width = 32 // fields
+    # Plain registers first, then every array in its own power of two block
+    array_block = 1 << max(2, (var_range * 4 - 1).bit_length())
+    array_base = -(-registers * 4 // array_block) * array_block
+    size = array_base + arrays * array_block
+    addr_width = max(12, (size - 1).bit_length())
+
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("reglist")
+    ws.append(["module", module])
+    ws.append(["owner", "bench"])
+    ws.append(["size", f"{-(-size // 1024)}KB"])
+    ws.append(["cfg_interface", "regbus"])
+    ws.append(["base_addr", "32'h0000"])
+    ws.append(["addr_width", addr_width])
+    ws.append(["data_width", "data_width"])
+    ws.append(["template_version", "v0p0"])
+    ws.append(["tool_version", "v0p0"])
+    ws.append(["offset", "reg_name", "bits", "field", "sw_access", "hw_access", "default", "attibute", "description"])
+
+    def append_register(offset, reg_name, n):
+        for k in range(fields):
+            msb = 31 - k * width
+            lsb = msb - width + 1 if k < fields - 1 else 0
+            bits = f"{msb}:{lsb}" if msb != lsb else f"{msb}"
+            ws.append([offset if k == 0 else None, reg_name if k == 0 else None, bits,
+                       f"{reg_name.lower()}_f{k}", SW_ACCESS[(n + k) % len(SW_ACCESS)], "RO",
+                       f"{msb - lsb + 1}'h0", None, None])
+
+    for n in range(registers):
+        append_register(f"0x{n * 4:x}", f"REG{n}", n)
+    for n in range(arrays):
+        append_register(f"0x{array_base + n * array_block:x}+v{n}*0x4", f"ARR{n}", n)
+
+    vs = wb.create_sheet("varlist")
+    vs.append(["name", "range"])
+    for n in range(arrays):
+        vs.append([f"v{n}", f"0~{var_range - 1}"])
+    wb.save(filename)
+
+def _measure(func, repeat):
+    # Best wall time of `repeat` untraced runs, then one run under tracemalloc
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+        del result
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, {"seconds": round(seconds, 4), "peak_mib": round(peak / 2**20, 2)}
+
+def run_benchmark(filename, repeat=3):
+    """Time and memory-profile parse_excel and write_verilog on filename.
+
+    Both the array and the parallel implementation are measured. The
+    generation is streamed to os.devnull as gen_reg.py does for a file.
+    """
+    results = {}
+    for mode, parallel in (("array", False), ("parallel", True)):
+        (module_info, registers), results[f"parse_{mode}"] = _measure(
+            lambda: gen_reg.parse_excel(filename, parallel=parallel), repeat)
+
+        def generate():
+            with open(os.devnull, 'w') as f:
+                gen_reg.write_verilog(f, module_info, registers, module_info['module'])
+        _, results[f"generate_{mode}"] = _measure(generate, repeat)
+    return results
+
+def run_startup(filename, repeat=5):
+    """Time the cold start of gen_reg.py as make runs it, one process per run.
+
+    startup_help is the no-op path (--help), startup_cache_hit a rerun of a
+    workbook whose outputs are already in the build cache. The best of
+    `repeat` runs is kept, memory is not measured.
+    """
+    script = os.path.abspath(gen_reg.__file__)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cached = [filename, "-d", os.path.join(tmp_dir, "out"), "-r", "--cache-dir", os.path.join(tmp_dir, "cache")]
+        subprocess.run([sys.executable, script] + cached, check=True, stdout=subprocess.DEVNULL)
+        results = {}
+        for stage, args in (("startup_help", ["--help"]), ("startup_cache_hit", cached)):
+            seconds = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, script] + args, check=True, stdout=subprocess.DEVNULL)
+                elapsed = time.perf_counter() - start
+                seconds = elapsed if seconds is None else min(seconds, elapsed)
+            results[stage] = {"seconds": round(seconds, 4)}
+    return results
+
+def compare(current, baseline, tolerance):
+    """Return the regressions of current against baseline as messages.
+
+    A stage regresses when its time or peak memory exceeds the baseline by
+    more than tolerance (a fraction, 0.2 = 20%).
+    """
+    if current["config"] != baseline["config"]:
+        raise ValueError(f"Baseline config {baseline['config']} does not match {current['config']}")
+    regressions = []
+    for stage, row in current["results"].items():
+        for metric in ("seconds", "peak_mib"):
+            new = row.get(metric)
+            old = baseline["results"].get(stage, {}).get(metric)
+            if new is not None and old and new > old * (1 + tolerance):
+                regressions.append(f"{stage} {metric}: {new} > baseline {old} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+def print_results(report, baseline=None):
+    print(f"{'stage':<20}{'seconds':>10}{'peak MiB':>10}" + (f"{'base s':>10}{'base MiB':>10}" if baseline else ""))
+    def cells(row):
+        peak = row.get('peak_mib')
+        return f"{row.get('seconds', 0):>10.3f}" + (f"{peak:>10.2f}" if peak is not None else f"{'-':>10}")
+    for stage, row in report["results"].items():
+        line = f"{stage:<20}" + cells(row)
+        if baseline:
+            line += cells(baseline["results"].get(stage, {}))
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark gen_reg.py on a synthetic register map')
+    parser.add_argument('--registers', type=int, default=1000, help='Number of plain registers. Default by 1000')
+    parser.add_argument('--fields', type=int, default=4, help='Fields per register. Default by 4')
+    parser.add_argument('--arrays', type=int, default=10, help='Number of array registers. Default by 10')
+    parser.add_argument('--var-range', type=int, default=64, help='Elements per array register. Default by 64')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage, the best one is kept. Default by 3')
+    parser.add_argument('--workbook', help='Keep the synthetic workbook at this path. Default by a temporary file')
+    parser.add_argument('-o', '--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against this results JSON, exit with 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown/growth against the baseline. Default by 0.2 (20%%)')
+    parser.add_argument('--startup', action='store_true', help='Time the cold start of gen_reg.py (--help and a cache hit) instead')
+    parser.add_argument('--startup-budget', type=float, default=None, help='With --startup, exit with 1 if a run takes longer than this many milliseconds')
+    args = parser.parse_args()
+    if args.startup_budget is not None and not args.startup:
+        parser.error('--startup-budget needs --startup')
+
+    shape = {"registers": args.registers, "fields": args.fields, "arrays": args.arrays, "var_range": args.var_range}
+    # Startup results only compare against startup baselines
+    config = dict(shape, startup=True) if args.startup else shape
+    baseline = None
+    if args.baseline:
+        # Checked before the benchmark runs, a mismatch can not be compared
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"can not read baseline {args.baseline}: {e}")
+        if baseline.get("config") != config:
+            parser.error(f"baseline {args.baseline} was measured with {baseline.get('config')}, this run uses {config}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workbook = args.workbook or os.path.join(tmp_dir, "bench_reg.xlsx")
+        start = time.perf_counter()
+        make_workbook(workbook, **shape)
+        print(f"Built {workbook} in {time.perf_counter() - start:.2f}s")
+        # parse_excel prints warnings per workbook, keep the table readable
+        stdout, sys.stdout = sys.stdout, io.StringIO()
+        try:
+            if args.startup:
+                results = run_startup(workbook, repeat=max(args.repeat, 5))
+            else:
+                results = run_benchmark(workbook, repeat=args.repeat)
+        finally:
+            sys.stdout = stdout
+
+    import openpyxl
+    report = {"config": config, "version": gen_reg.GEN_REG_VERSION,
+              "python": platform.python_version(), "openpyxl": openpyxl.__version__, "results": results}
+    print_results(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"PERFORMANCE REGRESSION against {args.baseline}:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+    if args.startup_budget is not None:
+        over = [f"{stage}: {row['seconds'] * 1000:.1f} ms" for stage, row in results.items()
+                if row['seconds'] * 1000 > args.startup_budget]
+        if over:
+            print(f"STARTUP OVER BUDGET of {args.startup_budget:g} ms:")
+            for message in over:
+                print(f"  {message}")
+            sys.exit(1)
+        print(f"Startup within budget of {args.startup_budget:g} ms")
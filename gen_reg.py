@@ -5,12 +5,28 @@
 # Description: This script is used to generate Verilog register files from an Excel file.
 #########################################################################################
 
-import openpyxl
 import re
-from datetime import datetime
-import argparse
-def extract_offset_components(expression):
-    pattern = r'''
+import collections
+import contextlib
+import heapq
+import io
+import itertools
+import json
+import math
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+GEN_REG_VERSION = "1.1"
+DEFAULT_BASE_ADDR = "32'h0000"
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Offset expression of the register sheet: base address, optionally + variable * step
+OFFSET_EXPRESSION = re.compile(r'''
         ^\s*
         (0[Xx][0-9a-fA-F]+)        # Base address (group 1)
         (?:                      # Optional variable-step section
@@ -20,9 +36,10 @@ def extract_offset_components(expression):
             (0[Xx][0-9a-fA-F]+)     # Step value (group 3)
         )?
         \s*$
-    '''
-    
-    match = re.match(pattern, expression, re.VERBOSE)
+    ''', re.VERBOSE)
+
+def extract_offset_components(expression):
+    match = OFFSET_EXPRESSION.match(expression)
     if not match:
         raise ValueError(f"Invalid expression: {expression}")
 
@@ -33,33 +50,236 @@ def extract_offset_components(expression):
     return base_addr, variable, step_value
 
 class Register:
+    # offset and var_step are byte addresses as int, var_val the last array index
+    __slots__ = ("offset", "var", "var_step", "reg_name", "var_val", "fields", "wr")
+
     def __init__(self):
-        self.offset = ""
-        self.var = ""
-        self.var_step = ""
+        self.offset = 0
+        self.var = None
+        self.var_step = None
         self.reg_name = ""
-        self.var_val= ""
+        self.var_val = None
         self.fields = []
         self.wr = ""
 
+    def count(self):
+        # Number of instances once the array is expanded
+        return 1 if self.var is None else self.var_val + 1
+
+    def instances(self):
+        # Array elements are built on demand, a plain register is its own instance
+        if self.var is None:
+            yield self
+        else:
+            for i in range(self.var_val + 1):
+                yield RegisterInstance(self, i)
+
 class Field:
+    __slots__ = ("bits", "bits_size", "name", "sw_access", "default")
+
     def __init__(self):
         self.bits = ""
-        self.bits_size = ""
+        self.bits_size = 0
         self.name = ""
         self.sw_access = ""
         self.default = ""
 
-def parse_excel_var(sheet):
+class RegisterInstance:
+    """Element `index` of an array register, looks like a plain Register."""
+    __slots__ = ("offset", "reg_name", "wr", "reg", "index", "prefix", "_fields")
+    var = None
+    var_step = None
+    var_val = None
+
+    def __init__(self, reg, index):
+        self.index = index
+        self.prefix = f"{reg.var}{index}_"
+        self.offset = reg.offset + index * reg.var_step
+        self.reg_name = self.prefix + reg.reg_name
+        self.wr = reg.wr
+        self.reg = reg
+        self._fields = None
+
+    @property
+    def fields(self):
+        # Only built when a caller looks at the fields
+        if self._fields is None:
+            prefix = self.prefix
+            self._fields = [FieldInstance(field.bits, field.bits_size, prefix + field.name,
+                                          field.sw_access, field.default) for field in self.reg.fields]
+        return self._fields
+
+# Field of a RegisterInstance, the name carries the array prefix
+FieldInstance = collections.namedtuple("FieldInstance", Field.__slots__)
+
+class ExpandedRegisters:
+    """Offset sorted view of registers with every array expanded.
+
+    Only the distinct registers are stored; instances are created while
+    iterating, so memory does not grow with the array ranges.
+    """
+    __slots__ = ("registers", "interleaved")
+
+    def __init__(self, registers):
+        self.registers = sorted(registers, key=_offset_key)
+        # Arrays whose address ranges interleave need a merge, otherwise the
+        # instances can simply be chained in base offset order
+        self.interleaved = any(prev.offset + (prev.count() - 1) * (prev.var_step or 0) >= reg.offset
+                               for prev, reg in zip(self.registers, self.registers[1:]))
+
+    def __len__(self):
+        return sum(reg.count() for reg in self.registers)
+
+    def __iter__(self):
+        instances = (reg.instances() for reg in self.registers)
+        if self.interleaved:
+            # Each register yields ascending offsets, merge is stable like list.sort
+            return heapq.merge(*instances, key=_offset_key)
+        return itertools.chain.from_iterable(instances)
+
+def _offset_key(reg):
+    return reg.offset
+
+class NullProfiler:
+    """Stand-in for Profiler when profiling is off, every call is a no-op."""
+    enabled = False
+
+    def start(self, name):
+        pass
+
+    def stop(self):
+        pass
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def count(self, name, value):
+        pass
+
+_NULL_STAGE = contextlib.nullcontext()
+
+def peak_rss():
+    # Peak resident set size of the process in bytes, None where unsupported
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class Profiler:
+    """Wall time, peak memory and counters per stage, see --profile.
+
+    Stages nest, a stage started inside another one is named parent.child.
+    By default memory is the peak RSS of the process when the stage ends,
+    which costs nothing to read. With trace_memory it is the peak traced by
+    tracemalloc while the stage runs, exact per stage but several times slower.
+    """
+    enabled = True
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.counts = {}
+        self._stack = []  # [name, start time, peak bytes] of the running stages
+
+    def start(self, name):
+        if self._stack:
+            name = f"{self._stack[-1][0]}.{name}"
+        if self.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # Keep the parent's peak so far, then measure this stage on its own
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        # Registered on start so that parents are listed before their children
+        self.stages.setdefault(name, {"seconds": 0.0, "peak_mib": 0.0, "calls": 0})
+        self._stack.append([name, time.perf_counter(), 0])
+
+    def stop(self):
+        name, start, peak = self._stack.pop()
+        seconds = time.perf_counter() - start
+        if self.trace_memory:
+            import tracemalloc
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if self._stack:
+                self._stack[-1][2] = max(self._stack[-1][2], peak)
+        else:
+            peak = peak_rss() or 0
+        stage = self.stages[name]
+        stage["seconds"] += seconds
+        stage["peak_mib"] = max(stage["peak_mib"], peak / 2**20)
+        stage["calls"] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def report(self):
+        stages = {name: {"seconds": round(s["seconds"], 6), "peak_mib": round(s["peak_mib"], 3), "calls": s["calls"]}
+                  for name, s in self.stages.items()}
+        memory = "tracemalloc" if self.trace_memory else "process_peak_rss"
+        return {"memory": memory, "stages": stages, "counts": dict(self.counts)}
+
+    def format_table(self):
+        # Without trace_memory the column is the peak of the whole process so
+        # far, not of the stage
+        memory = "peak MiB" if self.trace_memory else "proc peak MiB"
+        lines = [f"{'stage':<32}{'seconds':>10}{memory:>15}"]
+        for name, stage in self.stages.items():
+            label = "  " * name.count('.') + name.rsplit('.', 1)[-1]
+            peak = f"{stage['peak_mib']:>15.2f}" if stage['peak_mib'] else f"{'-':>15}"
+            lines.append(f"{label:<32}{stage['seconds']:>10.3f}{peak}")
+        lines.append("")
+        lines.append(f"{'count':<32}{'value':>10}")
+        for name, value in self.counts.items():
+            lines.append(f"{name:<32}{value:>10}")
+        return "\n".join(lines)
+
+# Profiler used by parse_excel, write_verilog and gen_reg_file, see enable_profiling
+PROFILE = NullProfiler()
+
+def enable_profiling(trace_memory=False):
+    global PROFILE
+    PROFILE = Profiler(trace_memory)
+    return PROFILE
+
+def _pad_row(row, width):
+    # Read-only worksheets may return short rows when trailing cells are empty
+    if len(row) < width:
+        return tuple(row) + (None,) * (width - len(row))
+    return row
+
+def parse_excel_var(sheet, diagnostics=None):
+    return parse_var_rows(sheet.iter_rows(min_row=2, values_only=True), diagnostics, sheet.title)
+
+def parse_var_rows(rows, diagnostics=None, sheet=None, first_row=2):
+    # diagnostics collects bad ranges instead of raising, see Diagnostics;
+    # first_row None reports them without a row
     result = {}
-    for row in sheet.iter_rows(min_row=2, values_only=True):
+    for row_idx, row in enumerate(rows, start=first_row or 0):
+        row = _pad_row(row, 2)
         # Stop at first empty row
         if not row[0]:  
             break
             
         name = row[0]
         range_str = row[1]
-        ___, max_val = map(int, range_str.split('~'))
+        try:
+            ___, max_val = map(int, range_str.split('~'))
+        except (AttributeError, ValueError):
+            if diagnostics is None:
+                raise ValueError(f"Invalid range '{range_str}' of variable '{name}', expected <first>~<last>")
+            diagnostics.error(f"Invalid range '{range_str}' of variable '{name}', expected <first>~<last>",
+                              sheet, row_idx if first_row is not None else None, 'B')
+            continue
         result[name] = max_val
     return result
 
@@ -77,409 +297,2365 @@ def calculate_bit_width(bit_str):
             
     raise ValueError("format bits error: %s" % bit_str)
 
-def parse_excel(filename,parallel=False):
-    wb = openpyxl.load_workbook(filename)
-    module_info = {}
-    registers = []
-    
-    ws = wb.worksheets[1]
-    var_ranges = parse_excel_var(ws)
-
-    # Parse module information
-    ws = wb.worksheets[0]
-
-    for row in ws.iter_rows(max_row=9, values_only=True):   # Only read the first 10 rows
-        if row[0] == "module":
-            module_info["module"] = row[1]
-            if module_info["module"] not in filename:
-                print(f"Warning: Module name '{module_info['module']}' does not match filename '{filename}'. Changing module name to match filename.")
-                module_info["module"] = filename.split('.')[0]  # Use filename as module name
-        elif row[0] in ["owner", "size", "base_addr", "addr_width", "data_width", "cfg_interface"]:
-            module_info[row[0]] = row[1]
-    
-    # Parse registers
-    current_reg = None
-    check_file = False
+def bit_range(bit_str):
+    # Return (msb, lsb) of a field bits string like "27:25" or "24"
+    parts = [int(part) for part in str(bit_str).split(':')]
+    return max(parts), min(parts)
+
+def _first_common_address(a, s, b, t, lo, hi):
+    """Return the lowest address in [lo, hi] that is both a + s*i and b + t*j.
+
+    A step of 0 stands for a single address.
+    """
+    if s == 0 or t == 0:
+        x, base, step = (a, b, t) if s == 0 else (b, a, s)
+        if lo <= x <= hi and (x == base if step == 0 else (x - base) % step == 0):
+            return x
+        return None
+    g = math.gcd(s, t)
+    if (b - a) % g:
+        return None
+    # Solve a + s*k == b (mod t) for k, then step by lcm(s, t) into [lo, hi]
+    t_g = t // g
+    k = (b - a) // g * pow(s // g, -1, t_g) % t_g if t_g > 1 else 0
+    x = a + s * k
+    lcm = s * t_g
+    x += -(-(lo - x) // lcm) * lcm
+    return x if x <= hi else None
+
+def _element_name(reg, addr):
+    if reg.var is None:
+        return reg.reg_name
+    return f"{reg.reg_name}[{(addr - reg.offset) // reg.var_step}]"
+
+def validate_registers(registers, data_width=32):
+    """Return a list of every address and bit-field conflict in registers.
+
+    Array registers are checked as address progressions on a sorted interval
+    index, so the array elements are never materialized. Two registers
+    conflict when they decode a common address; a field conflicts when its
+    bits leave the data width or overlap another field of the register.
+    """
+    return [message for _, _, message in register_conflicts(registers, data_width)]
+
+def register_conflicts(registers, data_width=32):
+    # validate_registers with the register and field (None for an address
+    # conflict) each conflict is reported on, as (reg, field, message)
+    conflicts = []
+
+    # Sweep the [first, last] address intervals in order of their first address,
+    # active holds the intervals still open, ordered by their last address
+    intervals = sorted(((reg.offset, reg.offset + (reg.count() - 1) * (reg.var_step or 0), n, reg)
+                        for n, reg in enumerate(registers)), key=lambda iv: iv[0])
+    active = []
+    for first, last, n, reg in intervals:
+        while active and active[0][0] < first:
+            heapq.heappop(active)
+        for other_last, _, other in active:
+            addr = _first_common_address(other.offset, other.var_step or 0, reg.offset, reg.var_step or 0,
+                                         first, min(last, other_last))
+            if addr is not None:
+                conflicts.append((reg, None, f"Address conflict at 0x{addr:x}: '{_element_name(other, addr)}' "
+                                             f"and '{_element_name(reg, addr)}'"))
+        heapq.heappush(active, (last, n, reg))
+
+    # One bitmask per register, a field conflicts with the bits already taken
+    for reg in registers:
+        used = 0
+        taken = []
+        for field in reg.fields:
+            msb, lsb = bit_range(field.bits)
+            if msb >= data_width:
+                conflicts.append((reg, field, f"Field '{field.name}' bits [{field.bits}] exceed the {data_width} bit register '{reg.reg_name}'"))
+                continue
+            mask = ((1 << (msb - lsb + 1)) - 1) << lsb
+            if used & mask:
+                owners = ", ".join(f"'{other.name}'" for other_mask, other in taken if other_mask & mask)
+                conflicts.append((reg, field, f"Field '{field.name}' bits [{field.bits}] overlap {owners} in register '{reg.reg_name}'"))
+            used |= mask
+            taken.append((mask, field))
+    return conflicts
+
+def parse_module_size(module_size_str):
     # Convert module_size to bytes if it is given as a string like "4KB"
-    module_size_str = module_info.get("size", "0")
+    module_size_str = str(module_size_str)
     if module_size_str.endswith("KB"):
-        module_size = int(module_size_str[:-2]) * 1024
+        return int(module_size_str[:-2]) * 1024
     elif module_size_str.endswith("B"):
-        module_size = int(module_size_str[:-1])
+        return int(module_size_str[:-1])
     else:
-        module_size = int(module_size_str, 16)  # Assume it is in hexadecimal if no unit is specified
+        return int(module_size_str, 16)  # Assume it is in hexadecimal if no unit is specified
+
+# Register sheet columns, as letters for the diagnostics
+REG_SHEET_COLUMNS = {"offset": 'A', "reg_name": 'B', "bits": 'C', "field": 'D', "sw_access": 'E', "default": 'G'}
+# Columns every field row needs, with their row index
+REQUIRED_FIELD_COLUMNS = (("bits", 2), ("field", 3), ("sw_access", 4), ("default", 6))
+
+Diagnostic = collections.namedtuple("Diagnostic", ("severity", "file", "sheet", "row", "column", "message"))
+
+class Diagnostics:
+    """Problems of a register description, collected instead of raised.
+
+    The parsers take an optional Diagnostics: without one they raise
+    ValueError on the first error and print the warnings, with one they add
+    every error and warning with its sheet, row and column and carry on, so
+    a single pass reports the whole map.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.items = []
+
+    def error(self, message, sheet=None, row=None, column=None):
+        self.items.append(Diagnostic("error", self.filename, sheet, row, column, message))
+
+    def warning(self, message, sheet=None, row=None, column=None):
+        self.items.append(Diagnostic("warning", self.filename, sheet, row, column, message))
+
+    @property
+    def errors(self):
+        return [item for item in self.items if item.severity == "error"]
+
+def format_diagnostic(item):
+    # file:sheet!C14: error: message, like a compiler message
+    location = item.file
+    if item.sheet:
+        location += f":{item.sheet}"
+    if item.row is not None:
+        location += f"{'!' if item.sheet else ':'}{item.column or ''}{item.row}"
+    return f"{location}: {item.severity}: {item.message}"
+
+def parse_excel_rows(rows, var_ranges, filename, diagnostics=None, sheet=None, check_module_name=True):
+    """Parse the register sheet from a single forward pass over its rows.
+
+    Rows 1-9 hold the module information, row 10 the column header and the
+    remaining rows the registers. Register and Field objects are built as the
+    rows arrive, so the sheet never has to be held in memory.
+    With diagnostics (a Diagnostics), registers and fields with an error are
+    reported on the sheet and left out instead of raising. check_module_name
+    renames a module that does not match filename, a workbook with several
+    modules keeps the names of its sheets.
+    """
+    module_info = {}
+    registers = []
+    current_reg = None
+    current_ok = True   # False while the rows of a rejected register are read
+    check_file = False
+    module_size = 0
 
-    offset_set = set()
     reg_name_set = set()
     field_name_set = set()
+    # Sheet row of every register and field, to locate the conflicts
+    reg_rows = {} if diagnostics is not None else None
+    field_rows = {} if diagnostics is not None else None
 
-    for row in ws.iter_rows(min_row=10, values_only=True):
+    def report(message, row, column=None, warning=False):
+        if diagnostics is None:
+            if not warning:
+                raise ValueError(message)
+            print(f"Warning: {message}")
+        elif warning:
+            diagnostics.warning(message, sheet, row, column)
+        else:
+            diagnostics.error(message, sheet, row, column)
 
+    row_idx = 0
+    for row_idx, row in enumerate(rows, start=1):
+        row = _pad_row(row, 7)
+
+        # Parse module information
+        if row_idx < 10:   # Only read the first 9 rows
+            if row[0] == "module":
+                module_info["module"] = row[1]
+                if check_module_name and module_info["module"] not in filename:
+                    report(f"Module name '{module_info['module']}' does not match filename '{filename}'. Changing module name to match filename.",
+                           row_idx, 'B', warning=True)
+                    module_info["module"] = os.path.basename(filename).split('.')[0]  # Use filename as module name
+            elif row[0] in ["owner", "size", "base_addr", "addr_width", "data_width", "cfg_interface"]:
+                module_info[row[0]] = row[1]
+                if diagnostics is not None:
+                    check_module_info(row[0], row[1], lambda message: report(message, row_idx, 'B'))
+            continue
+
+        # Parse registers
         if check_file == False:
             if row[0] != "offset":
-                raise ValueError("Invalid register description file format. 'offset' column not found.")
+                report("Invalid register description file format. 'offset' column not found.", row_idx, 'A')
+                return module_info, registers
             else:
                 check_file = True
+                try:
+                    module_size = parse_module_size(module_info.get("size", "0"))
+                except ValueError:
+                    if diagnostics is None:
+                        raise
+                    module_size = math.inf  # reported with the module information
                 continue
 
         if row[0]:  # New register
-            offset, var, var_step = extract_offset_components(row[0])
-            if int(offset, 16) > module_size:
-                print(f"Warning: Offset '{offset}' is greater than module size: {module_size}B. Skipping register.")
-                continue  # Skip parsing if offset is greater than module size
-
-            if offset in offset_set:
-                raise ValueError(f"Duplicate offset found: {offset}")
-            offset_set.add(offset)
-
-            if current_reg:
+            if current_reg and current_ok:
                 # Check if all fields are RO before adding to registers
                 all_ro = all(field.sw_access == 'RO' for field in current_reg.fields)
                 current_reg.wr = 'r' if all_ro else 'w'
                 registers.append(current_reg)
+            current_reg = None
+            current_ok = False
+            try:
+                offset, var, var_step = extract_offset_components(row[0])
+            except ValueError as e:
+                report(str(e), row_idx, 'A')
+                continue
+            if int(offset, 16) > module_size:
+                report(f"Offset '{offset}' is greater than module size: {module_size}B. Skipping register.",
+                       row_idx, 'A', warning=True)
+                continue  # Skip parsing if offset is greater than module size
 
             current_reg = Register()
-            current_reg.offset = offset[2:]
-            current_reg.var_step = var_step[2:] if var_step else None
+            current_ok = True
+            current_reg.offset = int(offset, 16)
+            current_reg.var_step = int(var_step, 16) if var_step else None
             current_reg.var = var
+            if reg_rows is not None:
+                reg_rows[id(current_reg)] = row_idx
 
             if current_reg.var is not None:
                 if current_reg.var in var_ranges:
                     current_reg.var_val = var_ranges[current_reg.var]
                 else:
-                    raise ValueError(f"Variable '{current_reg.var}' not found in variable ranges")
+                    report(f"Variable '{current_reg.var}' not found in variable ranges", row_idx, 'A')
+                    current_ok = False
             if row[1] is None:
-                raise ValueError("Register name not found")
-            if row[1] in reg_name_set:
-                raise ValueError(f"Duplicate register name found: {row[1]}")
+                report("Register name not found", row_idx, 'B')
+                current_ok = False
+            elif row[1] in reg_name_set:
+                report(f"Duplicate register name found: {row[1]}", row_idx, 'B')
+                current_ok = False
             reg_name_set.add(row[1])
             current_reg.reg_name = row[1]
 
-        if row[2]:  # Field
-            required_columns = [2, 3, 4, 6]
-            if any(row[i] is None for i in required_columns):
-                raise ValueError("One or more required fields are missing in the '{required_columns(i)}' row")
+        if row[2] is not None:  # Field, bits may be the number 0
+            # Every check runs so that lint reports all errors of the row, a
+            # field with an error is dropped after them
+            missing = [name for name, i in REQUIRED_FIELD_COLUMNS if row[i] is None]
+            if missing:
+                report(f"Required column(s) {', '.join(missing)} missing in row {row_idx}",
+                       row_idx, REG_SHEET_COLUMNS[missing[0]])
+            if current_reg is None:
+                if current_ok:
+                    report(f"Field '{row[3]}' has no register", row_idx, 'D')
+                continue
+            field_ok = not missing
             field = Field()
-            field.bits = row[2]
-            field.bits_size = calculate_bit_width(row[2])
+            field.bits = str(row[2])  # a number from a workbook cell or JSON/YAML
+            msb = None
+            try:
+                field.bits_size = calculate_bit_width(row[2])
+                msb = bit_range(row[2])[0]
+            except ValueError:
+                report(f"format bits error: {row[2]}", row_idx, 'C')
+                field_ok = False
             field.name = row[3]
-            if field.name in field_name_set:
-                raise ValueError(f"Duplicate field name found: {field.name}")
-            field_name_set.add(field.name)
-            field.sw_access = row[4].upper()  # Convert to uppercase
-            if field.sw_access not in ['RW', 'W1P', 'W1C', 'RO']:
-                raise ValueError(f"Invalid sw_access value: {field.sw_access}")
+            if field.name is not None:
+                if field.name in field_name_set:
+                    report(f"Duplicate field name found: {field.name}", row_idx, 'D')
+                    field_ok = False
+                field_name_set.add(field.name)
+            field.sw_access = str(row[4]).upper()  # Convert to uppercase
+            if row[4] is not None and field.sw_access not in ['RW', 'W1P', 'W1C', 'RO']:
+                report(f"Invalid sw_access value: {field.sw_access}", row_idx, 'E')
+                field_ok = False
+            if not field_ok:
+                # register_conflicts only checks the fields kept
+                if msb is not None and msb >= 32:
+                    report(f"Field '{field.name}' bits [{field.bits}] exceed the 32 bit register '{current_reg.reg_name}'",
+                           row_idx, 'C')
+                continue
             field.default = row[6]
             current_reg.fields.append(field)
+            if field_rows is not None:
+                field_rows[id(field)] = row_idx
 
-    if current_reg:
+    if current_reg and current_ok:
         # Check if all fields are RO before adding to registers
         all_ro = all(field.sw_access == 'RO' for field in current_reg.fields)
         current_reg.wr = 'r' if all_ro else 'w'
         registers.append(current_reg)
-    
-    if parallel == True:
-        expanded_registers = []
-        for reg in registers:
-            if reg.var is not None:
-                for i in range(reg.var_val + 1):
-                    new_reg = Register()
-                    new_reg.offset = hex(int(reg.offset, 16) + i * int(reg.var_step, 16))[2:]
-                    new_reg.var_step = None
-                    new_reg.var = None
-                    new_reg.var_val = None
-                    new_reg.reg_name = f"{reg.var}{i}_{reg.reg_name}"
-                    new_reg.wr = reg.wr
-                    for field in reg.fields:
-                        new_field = Field()
-                        new_field.bits = field.bits
-                        new_field.bits_size = field.bits_size
-                        new_field.name = f"{reg.var}{i}_{field.name}"
-                        new_field.sw_access = field.sw_access
-                        new_field.default = field.default
-                        new_reg.fields.append(new_field)
-                    expanded_registers.append(new_reg)
+    if not check_file and diagnostics is not None:
+        diagnostics.error("Invalid register description file format. 'offset' column not found.", sheet)
+
+    PROFILE.count("rows read", row_idx)
+    PROFILE.count("registers", len(registers))
+    PROFILE.count("fields", sum(len(reg.fields) for reg in registers) if PROFILE.enabled else 0)
+
+    with PROFILE.stage("validate"):
+        conflicts = register_conflicts(registers)
+    if diagnostics is not None:
+        for reg, field, message in conflicts:
+            if field is None:
+                diagnostics.error(message, sheet, reg_rows[id(reg)], 'A')
             else:
-                expanded_registers.append(reg)
-        expanded_registers.sort(key=lambda reg: int(reg.offset, 16))
-        registers = expanded_registers
+                diagnostics.error(message, sheet, field_rows[id(field)], 'C')
+    elif conflicts:
+        raise ValueError(f"Found {len(conflicts)} conflict(s) in the register map:\n  " +
+                         "\n  ".join(message for _, _, message in conflicts))
 
     return module_info, registers
 
-def generate_verilog(module_info, registers, filename):
-    now = datetime.now()
-    code = []
-    
-    _addr_width = int(module_info.get('addr_width', '12'))
-    # Header
-    code.append(f"// Filename          : {filename}.v")
-    code.append(f"// Author            : {module_info.get('owner', 'unknown')}")
-    code.append(f"// Created           : {now.strftime('%Y-%m-%d %H:%M:%S')}")
-    code.append( "// Description       : This file is auto generated by gen_reg.py script. Not edit by hand")
-    code.append(f"//                   : addr_width = {_addr_width}")
-    code.append(f"//                   : bus_type   = {module_info.get('cfg_interface', 'regbus')}")
-    code.append(f"//                   : base_addr  = {module_info.get('base_addr', '32\'h0000')}\n")
-    
-    # Module declaration
-    code.append(f"module {module_info['module']} (")
-    code.append( "input               clk,")
-    code.append( "input               rst_n,")
-    code.append(f"input       [{_addr_width-1}:0]  reg_addr,")
-    code.append( "input               wr_en,")
-    code.append( "input               rd_en,")
-    code.append( "input       [3 :0]  wr_msk,")
-    code.append( "input       [31:0]  wr_data,")
-    code.append( "output reg  [31:0]  rd_data,")
-    
-    # Signals
+def check_module_info(key, value, error):
+    # Module information that only fails later, during the generation
+    if key == "size":
+        try:
+            parse_module_size(value)
+        except ValueError:
+            error(f"Invalid module size '{value}', expected e.g. 4KB, 256B or hex bytes")
+    elif key == "addr_width":
+        try:
+            int(value)
+        except (TypeError, ValueError):
+            error(f"Invalid addr_width '{value}', expected an integer")
+    elif key == "cfg_interface":
+        try:
+            bus_interface({key: value}, strict=True)
+        except ValueError as e:
+            error(str(e))
+
+def expand_registers(registers):
+    return ExpandedRegisters(registers)
+
+def parse_excel(filename,parallel=False,read_only=True,diagnostics=None):
+    # read_only streams the sheets with values only; the full (edit mode) load
+    # keeps every cell and style in memory and is several times slower.
+    # diagnostics collects the problems instead of raising, see Diagnostics
+    modules = parse_excel_modules(filename, parallel=parallel, read_only=read_only, diagnostics=diagnostics)
+    if len(modules) != 1:
+        names = ", ".join(module_info.get('module', '?') for module_info, _ in modules)
+        raise ValueError(f"'{filename}' describes {len(modules)} modules ({names}), only the generation "
+                         f"and --lint take several modules (parse_excel_modules)")
+    return modules[0]
+
+def workbook_layout(wb):
+    """Pair the register sheets of a workbook with their variable sheets.
+
+    A register sheet has the 'offset' column header in row 10. A sheet named
+    <register sheet>_var holds the variables of that register sheet only;
+    every other sheet with a 'name' header in A1 is a shared variable sheet
+    used by all register sheets. A workbook with one register sheet in front
+    is the classic layout: its second sheet is the variable sheet, whatever
+    it looks like. Returns [(register sheet, [variable sheets])], the own
+    variable sheet last so it overrides the shared ones.
+    """
+    sheets = wb.worksheets
+    heads = {}
+    register_sheets = []
+    for sheet in sheets:
+        heads[sheet.title] = list(sheet.iter_rows(max_row=10, values_only=True))
+        head = heads[sheet.title]
+        if len(head) >= 10 and head[9] and head[9][0] == "offset":
+            register_sheets.append(sheet)
+    if not register_sheets or register_sheets == sheets[:1]:
+        # Classic layout, also when nothing matches so that the parse reports it
+        return [(sheets[0], sheets[1:2])]
+    own = {f"{sheet.title}_var": sheet for sheet in register_sheets}
+    shared = [sheet for sheet in sheets if sheet not in register_sheets and sheet.title not in own
+              and heads[sheet.title] and heads[sheet.title][0] and heads[sheet.title][0][0] == "name"]
+    by_title = {sheet.title: sheet for sheet in sheets}
+    return [(sheet, shared + ([by_title[f"{sheet.title}_var"]] if f"{sheet.title}_var" in by_title else []))
+            for sheet in register_sheets]
+
+def parse_excel_modules(filename, parallel=False, read_only=True, diagnostics=None):
+    """Parse every module of a workbook from one load, see workbook_layout.
+
+    Returns [(module_info, registers)], one per register sheet in sheet
+    order. With several modules the module names come from the sheets (the
+    sheet title if a sheet has no 'module' row) and must be unique.
+    """
+    with PROFILE.stage("load"):
+        import openpyxl  # only workbooks need it, the other front-ends start faster
+        # Both loads read the values cached for formula cells, a formula
+        # itself is no register data
+        wb = openpyxl.load_workbook(filename, read_only=read_only, data_only=True)
+    modules = []
+    try:
+        with PROFILE.stage("layout"):
+            layout = workbook_layout(wb)
+        for reg_sheet, var_sheets in layout:
+            with PROFILE.stage("variables"):
+                var_ranges = {}
+                for var_sheet in var_sheets:
+                    var_ranges.update(parse_excel_var(var_sheet, diagnostics))
+            with PROFILE.stage("rows"):
+                module_info, registers = parse_excel_rows(
+                    reg_sheet.iter_rows(values_only=True), var_ranges, filename, diagnostics,
+                    reg_sheet.title, check_module_name=len(layout) == 1)
+            if len(layout) > 1:
+                module_info.setdefault("module", reg_sheet.title)
+            modules.append((module_info, registers))
+    finally:
+        if read_only:
+            wb.close()  # read-only workbooks keep the archive open until closed
+
+    seen = {}
+    for (module_info, _), (reg_sheet, _) in zip(modules, layout):
+        if module_info.get("module") in seen:
+            message = f"Module '{module_info['module']}' of sheet '{reg_sheet.title}' is already described by sheet '{seen[module_info['module']]}'"
+            if diagnostics is None:
+                raise ValueError(message)
+            diagnostics.error(message, reg_sheet.title)
+        seen.setdefault(module_info.get("module"), reg_sheet.title)
+
+    if parallel == True:
+        with PROFILE.stage("expand"):
+            modules = [(module_info, expand_registers(registers)) for module_info, registers in modules]
+        PROFILE.count("expanded instances", sum(len(registers) for _, registers in modules))
+
+    return modules
+
+# Front-ends besides the xlsx workbook, all of them end in parse_excel_rows
+CSV_SUFFIXES = ('.csv', '.tsv')
+DESCRIPTION_SUFFIXES = ('.json', '.yaml', '.yml')
+COMPILED_SUFFIX = '.regc.json'
+COMPILED_FORMAT = "gen_reg-compiled"
+COMPILED_VERSION = 1
+REG_SHEET_HEADER = ("offset", "reg_name", "bits", "field", "sw_access", "hw_access", "default", "attibute", "description")
+
+def csv_var_file(filename):
+    # sys_reg.csv pairs with sys_reg.var.csv, sys_reg.tsv with sys_reg.var.tsv
+    stem, suffix = os.path.splitext(filename)
+    return f"{stem}.var{suffix}"
+
+def _read_csv(filename):
+    import csv
+    delimiter = '\t' if filename.lower().endswith('.tsv') else ','
+    with open(filename, newline='', encoding='utf-8-sig') as f:
+        # Empty cells read as None like openpyxl does
+        return [tuple(cell if cell.strip() else None for cell in row)
+                for row in csv.reader(f, delimiter=delimiter)]
+
+def parse_csv(filename, parallel=False, diagnostics=None):
+    """Parse a CSV/TSV export of the two workbook sheets.
+
+    filename holds the register sheet, the variable sheet is read from the
+    file next to it named by csv_var_file (optional if no arrays are used).
+    """
+    var_file = csv_var_file(filename)
+    var_ranges = {}
+    if os.path.exists(var_file):
+        var_ranges = parse_var_rows(_read_csv(var_file)[1:], diagnostics, os.path.basename(var_file))
+    with PROFILE.stage("rows"):
+        module_info, registers = parse_excel_rows(_read_csv(filename), var_ranges, filename, diagnostics)
+    return module_info, expand_registers(registers) if parallel else registers
+
+def _load_description(filename):
+    with open(filename, encoding='utf-8') as f:
+        if filename.lower().endswith('.json'):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("PyYAML is needed for YAML register descriptions, run pip install pyyaml")
+        return yaml.safe_load(f)
+
+def description_rows(desc):
+    """Turn a JSON/YAML register description into register sheet rows.
+
+    The description is {"module": {"module": ..., "size": ..., ...},
+    "registers": [{"offset": ..., "reg_name": ..., "fields": [{"bits": ...,
+    "field": ..., "sw_access": ..., "default": ...}, ...]}, ...]}, the keys
+    are the column names of the register sheet.
+    """
+    # A number size is bytes, in the sheet a plain number would be hex
+    header = [(key, f"{value}B" if key == "size" and isinstance(value, int) else value)
+              for key, value in desc.get("module", {}).items()]
+    if len(header) > 9:
+        raise ValueError("The module description supports at most 9 entries")
+    rows = header + [(None,)] * (9 - len(header))
+    rows.append(REG_SHEET_HEADER)
+    for reg in desc.get("registers", []):
+        offset = reg.get("offset")
+        if isinstance(offset, int):
+            offset = hex(offset)
+        for n, field in enumerate(reg.get("fields") or [{}]):
+            rows.append((offset if n == 0 else None, reg.get("reg_name") if n == 0 else None,
+                         field.get("bits"), field.get("field", field.get("name")), field.get("sw_access"),
+                         field.get("hw_access"), field.get("default"), field.get("attibute", field.get("attribute")),
+                         field.get("description")))
+    return rows
+
+def parse_description(filename, parallel=False, diagnostics=None):
+    """Parse a JSON or YAML register description, see description_rows.
+
+    The rows of the diagnostics are the rows of the equivalent register
+    sheet (9 module information rows, the header, one row per field).
+    """
+    desc = _load_description(filename)
+    var_ranges = {}
+    for name, value in desc.get("variables", {}).items():
+        # Either the last index or a range string like the variable sheet
+        var_ranges.update({name: value} if isinstance(value, int)
+                          else parse_var_rows([(name, value)], diagnostics, "variables", None))
+    with PROFILE.stage("rows"):
+        module_info, registers = parse_excel_rows(description_rows(desc), var_ranges, filename, diagnostics)
+    return module_info, expand_registers(registers) if parallel else registers
+
+def save_compiled(filename, module_info, registers):
+    """Write the parsed, validated register map to a compiled .regc.json file.
+
+    registers must be the array representation (parallel=False). Offsets are
+    stored as numbers and every register as a flat list, so load_compiled
+    needs neither openpyxl nor any parsing or validation.
+    """
+    data = {"format": COMPILED_FORMAT, "version": COMPILED_VERSION, "module_info": module_info,
+            "registers": [[reg.offset, reg.var, reg.var_step, reg.var_val, reg.reg_name, reg.wr,
+                           [[field.bits, field.bits_size, field.name, field.sw_access, field.default]
+                            for field in reg.fields]] for reg in registers]}
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+
+def load_compiled(filename, parallel=False):
+    with open(filename, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get("format") != COMPILED_FORMAT or data.get("version") != COMPILED_VERSION:
+        raise ValueError(f"'{filename}' is not a version {COMPILED_VERSION} compiled register map")
+    registers = []
+    for offset, var, var_step, var_val, reg_name, wr, fields in data["registers"]:
+        reg = Register()
+        reg.offset, reg.var, reg.var_step, reg.var_val, reg.reg_name, reg.wr = offset, var, var_step, var_val, reg_name, wr
+        for bits, bits_size, name, sw_access, default in fields:
+            field = Field()
+            field.bits, field.bits_size, field.name, field.sw_access, field.default = bits, bits_size, name, sw_access, default
+            reg.fields.append(field)
+        registers.append(reg)
+    return data["module_info"], expand_registers(registers) if parallel else registers
+
+def input_files(filename):
+    # Every file a parse of filename reads, for the build cache key
+    if filename.lower().endswith(CSV_SUFFIXES) and os.path.exists(csv_var_file(filename)):
+        return [filename, csv_var_file(filename)]
+    return [filename]
+
+def parse_input(filename, parallel=False, read_only=True, diagnostics=None):
+    """Parse any supported register description, dispatched by file suffix.
+
+    .xlsx workbooks go to parse_excel, .csv/.tsv to parse_csv, .regc.json to
+    load_compiled and .json/.yaml/.yml to parse_description. A compiled map
+    was validated when it was written, it has no diagnostics.
+    """
+    name = filename.lower()
+    if name.endswith(COMPILED_SUFFIX):
+        return load_compiled(filename, parallel=parallel)
+    if name.endswith(CSV_SUFFIXES):
+        return parse_csv(filename, parallel=parallel, diagnostics=diagnostics)
+    if name.endswith(DESCRIPTION_SUFFIXES):
+        return parse_description(filename, parallel=parallel, diagnostics=diagnostics)
+    return parse_excel(filename, parallel=parallel, read_only=read_only, diagnostics=diagnostics)
+
+def parse_input_modules(filename, parallel=False, read_only=True, diagnostics=None):
+    # Every module of filename as [(module_info, registers)]; only workbooks
+    # describe more than one, see parse_excel_modules
+    if filename.lower().endswith(CSV_SUFFIXES + DESCRIPTION_SUFFIXES):  # .regc.json included
+        return [parse_input(filename, parallel=parallel, read_only=read_only, diagnostics=diagnostics)]
+    return parse_excel_modules(filename, parallel=parallel, read_only=read_only, diagnostics=diagnostics)
+
+def lint_input(filename, read_only=True):
+    """Check a register description in one pass without generating anything.
+
+    Returns a Diagnostics with every error and warning. Problems that stop
+    the parse, like an unreadable file, are reported as one error.
+    """
+    diagnostics = Diagnostics(filename)
+    try:
+        parse_input_modules(filename, read_only=read_only, diagnostics=diagnostics)
+    except Exception as e:
+        diagnostics.error(str(e) or type(e).__name__)
+    # Sheet by sheet in reading order, the conflicts found last go to their rows
+    sheets = {}
+    for item in diagnostics.items:
+        sheets.setdefault(item.sheet, len(sheets))
+    diagnostics.items.sort(key=lambda item: (sheets[item.sheet], item.row or 0))
+    return diagnostics
+
+def array_index_decode(reg, addr_width):
+    """Return (shift, idx_width, last_offset) for index decoding an array register.
+
+    The element index is (reg_addr - offset) >> shift, which needs a power of
+    two step.
+    """
+    step = reg.var_step
+    if step <= 0 or step & (step - 1):
+        raise ValueError(f"Register '{reg.reg_name}' step 0x{reg.var_step:x} is not a power of two, can not use index decode")
+    shift = step.bit_length() - 1
+    idx_width = max(1, reg.var_val.bit_length())
+    last_offset = reg.offset + step * reg.var_val
+    if last_offset >= 1 << addr_width:
+        raise ValueError(f"Register '{reg.reg_name}' last element 0x{last_offset:x} exceeds addr_width {addr_width}")
+    return shift, idx_width, f"{last_offset:x}"
+
+class VerilogWriter:
+    """Line sink of write_verilog and the other backend writers.
+
+    Lines are joined with newlines like "\\n".join(lines) and written to the
+    file in chunks. The last line is held back so it can still be edited, see
+    rstrip_last.
+    """
+    __slots__ = ("f", "chunk", "started", "written")
+    CHUNK_LINES = 4096
+
+    def __init__(self, f):
+        self.f = f
+        self.chunk = []
+        self.started = False
+        self.written = 0
+
+    def __call__(self, line):
+        chunk = self.chunk
+        chunk.append(line)
+        if len(chunk) > self.CHUNK_LINES:
+            self.chunk = [chunk.pop()]
+            self._flush(chunk)
+
+    def extend(self, lines):
+        for line in lines:
+            self(line)
+
+    def rstrip_last(self, chars):
+        self.chunk[-1] = self.chunk[-1].rstrip(chars)
+
+    @property
+    def lines(self):
+        return self.written + len(self.chunk)
+
+    def _flush(self, lines):
+        if self.started:
+            self.f.write("\n")
+        self.f.write("\n".join(lines))
+        self.started = True
+        self.written += len(lines)
+
+    def close(self):
+        if self.chunk:
+            self._flush(self.chunk)
+            self.chunk = []
+
+def plan_read_pipeline(registers, stages, bank_size):
+    """Split the read mux for a banked, pipelined read path.
+
+    Scalar registers are split into address-contiguous banks of at most
+    bank_size registers, each with its own case mux. Stage 1 registers the bank
+    and array read data, stages 2..stages OR them together in a balanced tree
+    and rd_data/rd_valid follow one cycle later, giving a read latency of
+    stages + 1 cycles. Returns (banks, levels) where levels[k] lists the groups
+    of sources OR-ed into each register of stage k + 1.
+    """
+    scalar_regs = sorted((reg for reg in registers if reg.var is None), key=_offset_key)
+    banks = [scalar_regs[i:i + bank_size] for i in range(0, len(scalar_regs), bank_size)] or [[]]
+    sources = [f"rd_data_nxt_b{k}" for k in range(len(banks))]
+    sources += [f"rd_data_nxt_{reg.reg_name}" for reg in registers if reg.var is not None]
+    fan_in = max(2, math.ceil(len(sources) ** (1 / stages)))
+
+    levels = []
+    for stage in range(1, stages + 1):
+        if stage == 1:
+            groups = [[src] for src in sources]
+        else:
+            groups = [sources[i:i + fan_in] for i in range(0, len(sources), fan_in)]
+        levels.append(groups)
+        sources = [f"rd_data_s{stage}_{n}" for n in range(len(groups))]
+    return banks, levels
+
+def read_pipeline_decl(plan):
+    banks, levels = plan
+    decl = [f"reg  [31:0]    rd_data_nxt_b{k};" for k in range(len(banks))]
+    for stage, groups in enumerate(levels, start=1):
+        decl += [f"reg  [31:0]    rd_data_s{stage}_{n};" for n in range(len(groups))]
+        decl.append(f"reg            rd_vld_s{stage};")
+    return decl
+
+def write_read_pipeline(emit, plan, addr_width, addr="reg_addr"):
+    # addr is the read address signal, rd_addr with a split read address
+    banks, levels = plan
+    for k, bank in enumerate(banks):
+        emit("//============================================================================")
+        if bank:
+            emit(f"// next read data bank {k}: {addr_width}'h{bank[0].offset:x} - {addr_width}'h{bank[-1].offset:x}")
+        else:
+            emit(f"// next read data bank {k}")
+        emit("//============================================================================")
+        emit("always @(*) begin")
+        emit(f"    rd_data_nxt_b{k}[31:0] = 32'h0;")
+        emit(f"    case({addr}[{addr_width-1}:0])")
+        for reg in bank:
+            emit(f"    {addr_width}'h{reg.offset:x}: begin")
+            for field in reg.fields:
+                if field.sw_access == "W1P":
+                    emit(f"        rd_data_nxt_b{k}[{field.bits}] = {field.bits_size}'h0;")
+                elif field.bits_size == 1:
+                    emit(f"        rd_data_nxt_b{k}[{field.bits}] = {field.name};")
+                else:
+                    emit(f"        rd_data_nxt_b{k}[{field.bits}] = {field.name}[{field.bits_size-1}:0];")
+            emit("    end")
+        emit("    default:")
+        emit(f"        rd_data_nxt_b{k} = 32'h0;")
+        emit("    endcase")
+        emit("end\n")
+
+    # Pipeline stages, every stage is enabled by the valid of the previous one
+    emit("//============================================================================")
+    emit(f"// read data pipeline, latency {len(levels) + 1}")
+    emit("//============================================================================")
+    valid = "rd_en"
+    for stage, groups in enumerate(levels, start=1):
+        outputs = [f"rd_data_s{stage}_{n}" for n in range(len(groups))]
+        emit("always @(posedge clk or negedge rst_n) begin")
+        emit("    if (!rst_n) begin")
+        for out in outputs:
+            emit(f"        {out}[31:0] <= 32'h0;")
+        emit("    end")
+        emit(f"    else if({valid}) begin")
+        for out, group in zip(outputs, groups):
+            emit(f"        {out}[31:0] <= {' | '.join(group)};")
+        emit("    end")
+        emit("end\n")
+        emit("always @(posedge clk or negedge rst_n) begin")
+        emit("    if (!rst_n)")
+        emit(f"        rd_vld_s{stage} <= 1'b0;")
+        emit("    else")
+        emit(f"        rd_vld_s{stage} <= {valid};")
+        emit("end\n")
+        valid = f"rd_vld_s{stage}"
+
+    emit("//============================================================================")
+    emit("// read data")
+    emit("//============================================================================")
+    emit("always @(posedge clk or negedge rst_n) begin")
+    emit("    if (!rst_n)")
+    emit("        rd_data[31:0] <= 32'h0; ")
+    emit(f"    else if({valid})")
+    emit(f"        rd_data[31:0] <= {' | '.join(outputs)};")
+    emit("end\n")
+    emit("always @(posedge clk or negedge rst_n) begin")
+    emit("    if (!rst_n)")
+    emit("        rd_valid <= 1'b0;")
+    emit("    else")
+    emit(f"        rd_valid <= {valid};")
+    emit("end\n")
+
+# cfg_interface spellings (lower case, without '-' and '_') -> bus front-end.
+# regbus_split is the regbus with a separate read address rd_addr, the core of
+# the AXI4-Lite front-end and of partitioned AXI4-Lite sub-modules.
+BUS_INTERFACES = {"regbus": "regbus", "regbussplit": "regbus_split",
+                  "apb": "apb", "apb3": "apb", "apb4": "apb",
+                  "axi": "axi4lite", "axilite": "axi4lite", "axi4lite": "axi4lite", "axi4l": "axi4lite"}
+
+def bus_interface(module_info, strict=False):
+    """Return the bus front-end selected by cfg_interface.
+
+    One of regbus (the default), regbus_split, apb or axi4lite. An unknown
+    value only names the bus in the header and gets the regbus ports, like
+    before the front-ends existed, with a warning; strict raises ValueError.
+    """
+    value = module_info.get('cfg_interface') or 'regbus'
+    key = str(value).strip().lower().replace('-', '').replace('_', '')
+    if key not in BUS_INTERFACES:
+        message = f"Unknown cfg_interface '{value}', expected regbus, apb or axi4lite"
+        if strict:
+            raise ValueError(message)
+        print(f"Warning: {message}. Generating the regbus interface.")
+        return "regbus"
+    return BUS_INTERFACES[key]
+
+def _port(direction, width, name):
+    # Aligned port declaration line, width is 1 or the vector width
+    vector = "" if width == 1 else f"[{width-1:<2}:0]" if width < 10 else f"[{width-1}:0]"
+    return f"{direction:<12}{vector:<8}{name},"
+
+def bus_port_declarations(bus, addr_width, rd_stages=0):
+    # Bus port declarations of the module, each line ends with a comma
+    yield "input               clk,"
+    yield "input               rst_n,"
+    if bus in ("regbus", "regbus_split"):
+        yield f"input       [{addr_width-1}:0]  reg_addr,"
+        if bus == "regbus_split":
+            yield f"input       [{addr_width-1}:0]  rd_addr,"
+        yield "input               wr_en,"
+        yield "input               rd_en,"
+        yield "input       [3 :0]  wr_msk,"
+        yield "input       [31:0]  wr_data,"
+        yield "output reg  [31:0]  rd_data,"
+        if rd_stages:
+            yield "output reg          rd_valid,"
+    elif bus == "apb":
+        ports = [("input", addr_width, "paddr"), ("input", 1, "psel"), ("input", 1, "penable"),
+                 ("input", 1, "pwrite"), ("input", 4, "pstrb"), ("input", 32, "pwdata"),
+                 ("output", 32, "prdata"), ("output", 1, "pready"), ("output", 1, "pslverr")]
+        yield from (_port(*port) for port in ports)
+    else:
+        ports = [("input", addr_width, "awaddr"), ("input", 3, "awprot"), ("input", 1, "awvalid"),
+                 ("output", 1, "awready"),
+                 ("input", 32, "wdata"), ("input", 4, "wstrb"), ("input", 1, "wvalid"), ("output", 1, "wready"),
+                 ("output", 2, "bresp"), ("output reg", 1, "bvalid"), ("input", 1, "bready"),
+                 ("input", addr_width, "araddr"), ("input", 3, "arprot"), ("input", 1, "arvalid"),
+                 ("output", 1, "arready"),
+                 ("output", 32, "rdata"), ("output", 2, "rresp"), ("output", 1, "rvalid"), ("input", 1, "rready")]
+        yield from (_port(*port) for port in ports)
+
+def _decl(kind, width, name):
+    # Aligned reg/wire declaration line
+    vector = "" if width == 1 else f"[{width-1:<2}:0]" if width < 10 else f"[{width-1}:0]"
+    return f"{f'{kind} {vector}':<15}{name};"
+
+def _axi_read_fifo(rd_stages):
+    # Depth, pointer width and count width of the AXI4-Lite read data buffer.
+    # Reads in flight plus buffered data must fit: with a read latency L and
+    # one read per cycle that is L + 1, one more keeps arready registered.
+    depth = rd_stages + 3
+    return depth, max(1, (depth - 1).bit_length()), depth.bit_length()
+
+def bus_signal_declarations(bus, addr_width, rd_stages=0):
+    # Declarations of the regbus signals driven by an APB/AXI4-Lite front-end
+    if bus in ("regbus", "regbus_split"):
+        return
+    yield _decl("wire", addr_width, "reg_addr")
+    if bus == "axi4lite":
+        yield _decl("wire", addr_width, "rd_addr")
+    yield _decl("wire", 1, "wr_en")
+    yield _decl("wire", 1, "rd_en")
+    yield _decl("wire", 4, "wr_msk")
+    yield _decl("wire", 32, "wr_data")
+    yield _decl("reg ", 32, "rd_data")
+    if rd_stages or bus == "axi4lite":
+        yield _decl("reg ", 1, "rd_valid")
+    if bus == "axi4lite":
+        yield _decl("reg ", 1, "aw_full")
+        yield _decl("reg ", addr_width, "aw_addr_q")
+        yield _decl("reg ", 1, "w_full")
+        yield _decl("reg ", 32, "w_data_q")
+        yield _decl("reg ", 4, "w_strb_q")
+        depth, ptr_width, cnt_width = _axi_read_fifo(rd_stages)
+        yield f"reg  [31:0]    rd_fifo [0:{depth-1}];"
+        yield _decl("reg ", ptr_width, "rd_fifo_wptr")
+        yield _decl("reg ", ptr_width, "rd_fifo_rptr")
+        yield _decl("reg ", cnt_width, "rd_fifo_cnt")
+        yield _decl("reg ", cnt_width, "rd_pending")
+        yield _decl("wire", 1, "rd_pop")
+
+def write_bus_frontend(emit, bus, addr_width, rd_stages=0):
+    """Emit the APB or AXI4-Lite slave logic driving the regbus signals.
+
+    APB: the read is issued in the setup phase, so with the plain read path
+    the data is there in the access phase and pready is never low; a
+    pipelined read path (rd_stages) holds pready low until rd_valid. Writes
+    complete without wait states.
+    AXI4-Lite: the write and read channels are independent, both sustain one
+    transfer per cycle. AW and W are each buffered in one register so they
+    may arrive in any order; a write is done when both are present and the B
+    channel is free. The read data goes through a small buffer and reads are
+    issued while it has room, so arready and the R channel only depend on
+    registers, never combinationally on rready. Responses
+    are always OKAY, like the regbus unmapped addresses read as 0 and ignore
+    writes.
+    """
+    if bus in ("regbus", "regbus_split"):
+        return
+    emit("//============================================================================")
+    emit(f"// {'APB' if bus == 'apb' else 'AXI4-Lite'} slave")
+    emit("//============================================================================")
+    if bus == "apb":
+        emit("assign reg_addr = paddr;")
+        emit("assign wr_en    = psel & penable & pwrite;")
+        emit("assign rd_en    = psel & ~penable & ~pwrite;")
+        emit("assign wr_msk   = pstrb;")
+        emit("assign wr_data  = pwdata;")
+        emit("assign prdata   = rd_data;")
+        emit("assign pready   = pwrite | rd_valid;" if rd_stages else "assign pready   = 1'b1;")
+        emit("assign pslverr  = 1'b0;\n")
+        return
+
+    # Write channel
+    emit("assign awready  = ~aw_full;")
+    emit("assign wready   = ~w_full;")
+    emit("assign wr_en    = (aw_full | awvalid) & (w_full | wvalid) & (~bvalid | bready);")
+    emit("assign reg_addr = aw_full ? aw_addr_q : awaddr;")
+    emit("assign wr_data  = w_full ? w_data_q : wdata;")
+    emit("assign wr_msk   = w_full ? w_strb_q : wstrb;")
+    emit("assign bresp    = 2'b00;\n")
+    emit("always @(posedge clk or negedge rst_n) begin")
+    emit("    if (!rst_n) begin")
+    emit("        aw_full <= 1'b0;")
+    emit(f"        aw_addr_q <= {addr_width}'h0;")
+    emit("        w_full <= 1'b0;")
+    emit("        w_data_q <= 32'h0;")
+    emit("        w_strb_q <= 4'h0;")
+    emit("        bvalid <= 1'b0;")
+    emit("    end")
+    emit("    else begin")
+    emit("        aw_full <= (aw_full | awvalid) & ~wr_en;")
+    emit("        w_full <= (w_full | wvalid) & ~wr_en;")
+    emit("        if (awvalid & ~aw_full)")
+    emit("            aw_addr_q <= awaddr;")
+    emit("        if (wvalid & ~w_full) begin")
+    emit("            w_data_q <= wdata;")
+    emit("            w_strb_q <= wstrb;")
+    emit("        end")
+    emit("        if (wr_en)")
+    emit("            bvalid <= 1'b1;")
+    emit("        else if (bready)")
+    emit("            bvalid <= 1'b0;")
+    emit("    end")
+    emit("end\n")
+
+    # Read channel
+    emit("assign rd_addr  = araddr;")
+    emit("assign rd_en    = arvalid & arready;")
+    emit("assign rresp    = 2'b00;")
+    if not rd_stages:
+        # The plain read path has no rd_valid, rd_data is new the cycle after rd_en
+        emit("always @(posedge clk or negedge rst_n) begin")
+        emit("    if (!rst_n)")
+        emit("        rd_valid <= 1'b0;")
+        emit("    else")
+        emit("        rd_valid <= rd_en;")
+        emit("end\n")
+    depth, ptr_width, cnt_width = _axi_read_fifo(rd_stages)
+    emit(f"assign arready  = (rd_pending + rd_fifo_cnt) < {cnt_width}'d{depth};")
+    emit(f"assign rvalid   = (rd_fifo_cnt != {cnt_width}'d0);")
+    emit("assign rdata    = rd_fifo[rd_fifo_rptr];")
+    emit("assign rd_pop   = rvalid & rready;\n")
+    emit("always @(posedge clk or negedge rst_n) begin")
+    emit("    if (!rst_n) begin")
+    emit(f"        rd_pending <= {cnt_width}'d0;")
+    emit(f"        rd_fifo_cnt <= {cnt_width}'d0;")
+    emit(f"        rd_fifo_wptr <= {ptr_width}'d0;")
+    emit(f"        rd_fifo_rptr <= {ptr_width}'d0;")
+    emit("    end")
+    emit("    else begin")
+    emit("        rd_pending <= rd_pending + rd_en - rd_valid;")
+    emit("        rd_fifo_cnt <= rd_fifo_cnt + rd_valid - rd_pop;")
+    emit("        if (rd_valid)")
+    emit(f"            rd_fifo_wptr <= (rd_fifo_wptr == {ptr_width}'d{depth-1}) ? {ptr_width}'d0 : rd_fifo_wptr + 1'b1;")
+    emit("        if (rd_pop)")
+    emit(f"            rd_fifo_rptr <= (rd_fifo_rptr == {ptr_width}'d{depth-1}) ? {ptr_width}'d0 : rd_fifo_rptr + 1'b1;")
+    emit("    end")
+    emit("end\n")
+    emit("always @(posedge clk) begin")
+    emit("    if (rd_valid)")
+    emit("        rd_fifo[rd_fifo_wptr] <= rd_data;")
+    emit("end\n")
+
+def field_port_declarations(registers):
+    # Port declarations of the fields, each line ends with a comma
     for reg in registers:
         if reg.var is not None:# Variable registers
             for field in reg.fields:
                 if field.sw_access == "RW" or field.sw_access == "W1P": 
                     if field.bits_size == 1:
-                        code.append(f"output reg          {field.name}[{reg.var_val}:0],")
+                        yield f"output reg          {field.name}[{reg.var_val}:0],"
                     else:
-                        code.append(f"output reg  [{field.bits_size-1:02}:0]  {field.name}[{reg.var_val}:0],")
+                        yield f"output reg  [{field.bits_size-1:02}:0]  {field.name}[{reg.var_val}:0],"
                 elif field.sw_access == "W1C":
                     if field.bits_size == 1:
-                        code.append(f"input               {field.name}_hw_en[{reg.var_val}:0],")
-                        code.append(f"input               {field.name}_hw_val[{reg.var_val}:0],")
-                        code.append(f"output reg          {field.name},")
+                        yield f"input               {field.name}_hw_en[{reg.var_val}:0],"
+                        yield f"input               {field.name}_hw_val[{reg.var_val}:0],"
+                        yield f"output reg          {field.name},"
                     else:
-                        code.append(f"input               {field.name}_hw_en[{reg.var_val}:0],")
-                        code.append(f"input       [{field.bits_size-1:02}:0]  {field.name}_hw_val[{reg.var_val}:0],")
-                        code.append(f"output reg  [{field.bits_size-1:02}:0]  {field.name}[{reg.var_val}:0],")
+                        yield f"input               {field.name}_hw_en[{reg.var_val}:0],"
+                        yield f"input       [{field.bits_size-1:02}:0]  {field.name}_hw_val[{reg.var_val}:0],"
+                        yield f"output reg  [{field.bits_size-1:02}:0]  {field.name}[{reg.var_val}:0],"
                 elif field.sw_access == "RO":
                     if field.bits_size == 1:
-                        code.append(f"input               {field.name}[{reg.var_val}:0],")
+                        yield f"input               {field.name}[{reg.var_val}:0],"
                     else:
-                        code.append(f"input       [{field.bits_size-1:02}:0]  {field.name}[{reg.var_val}:0],")
+                        yield f"input       [{field.bits_size-1:02}:0]  {field.name}[{reg.var_val}:0],"
         else:# Non-variable registers                        
             for field in reg.fields:
                 if field.sw_access == "RW" or field.sw_access == "W1P": 
                     if field.bits_size == 1:
-                        code.append(f"output reg          {field.name},")
+                        yield f"output reg          {field.name},"
                     else:
-                        code.append(f"output reg  [{field.bits_size-1:02d}:0]  {field.name},")
+                        yield f"output reg  [{field.bits_size-1:02d}:0]  {field.name},"
                 elif field.sw_access == "W1C":
                     if field.bits_size == 1:
-                        code.append(f"input               {field.name}_hw_en,")
-                        code.append(f"input               {field.name}_hw_val,")
-                        code.append(f"output reg          {field.name},")
+                        yield f"input               {field.name}_hw_en,"
+                        yield f"input               {field.name}_hw_val,"
+                        yield f"output reg          {field.name},"
                     else:
-                        code.append(f"input               {field.name}_hw_en,")
-                        code.append(f"input       [{field.bits_size-1:02}:0]  {field.name}_hw_val,")
-                        code.append(f"output reg  [{field.bits_size-1:02}:0]  {field.name},")
+                        yield f"input               {field.name}_hw_en,"
+                        yield f"input       [{field.bits_size-1:02}:0]  {field.name}_hw_val,"
+                        yield f"output reg  [{field.bits_size-1:02}:0]  {field.name},"
                 elif field.sw_access == "RO":
                     if field.bits_size == 1:
-                        code.append(f"input               {field.name},")
+                        yield f"input               {field.name},"
                     else:
-                        code.append(f"input       [{field.bits_size-1:02}:0]  {field.name},")
+                        yield f"input       [{field.bits_size-1:02}:0]  {field.name},"
+
+def array_decode_addrs(reg, split_addr):
+    # (signal prefix, address) of the index decodes of an array register: one
+    # shared by write and read, or with a split read address one for the
+    # writes and one rd_ prefixed for the reads
+    if not split_addr:
+        return [("", "reg_addr")]
+    return ([("", "reg_addr")] if reg.wr == 'w' else []) + [("rd_", "rd_addr")]
+
+def header_filename(filename):
+    # Base name of the output file, without the directory so that the header
+    # does not change with -d; a bare module name gets the .v extension
+    name = os.path.basename(filename)
+    return name if name.endswith('.v') else f"{name}.v"
+
+def write_verilog(f, module_info, registers, filename, created=None, index_decode=False,
+                  rd_stages=0, rd_bank_size=32):
+    """Write the Verilog module for registers to the text file f.
+
+    Sections are streamed to f through a VerilogWriter, the module is never
+    built as a whole in memory.
+    """
+    # created replaces the time stamp in the header, used for reproducible output
+    # index_decode decodes array registers by range check and index extraction
+    # instead of one address comparator per element
+    # rd_stages > 0 pipelines the read mux, see plan_read_pipeline
+    if created is None:
+        created = time.strftime(TIMESTAMP_FORMAT)
+    emit = VerilogWriter(f)
+
+    PROFILE.start("precompute")
+    _addr_width = int(module_info.get('addr_width', '12'))
+    bus = bus_interface(module_info)
+    # Reads decode rd_addr when the bus has a separate read address, so a read
+    # and a write can be done in the same cycle
+    split_addr = bus in ("regbus_split", "axi4lite")
+    rd_addr = "rd_addr" if split_addr else "reg_addr"
+    # The sections below walk the registers several times. A lazy
+    # ExpandedRegisters view restarts on every pass and is not expanded, only a
+    # one-shot iterator is kept as a list
+    if iter(registers) is registers:
+        registers = list(registers)
+
+    # Precompute everything the sections need in one pass over the registers
+    max_lhs_length = 0      # width of the aligned wr_en assign statements
+    array_decode = {}       # reg_name -> array_index_decode() of array registers
+    array_rd_signals = []   # rd_data_nxt_* of array registers, OR-ed in the read mux
+    for reg in registers:
+        if reg.var is not None:
+            array_rd_signals.append(f"rd_data_nxt_{reg.reg_name}")
+            if index_decode:
+                array_decode[reg.reg_name] = array_index_decode(reg, _addr_width)
+        if reg.wr == 'w':
+            if reg.var is not None:
+                lhs_length = len(f"wr_en_{reg.reg_name}[{reg.var_val}]")
+            else:
+                lhs_length = len(f"wr_en_{reg.reg_name}")
+            if lhs_length > max_lhs_length:
+                max_lhs_length = lhs_length
+    all_var_none = not array_rd_signals
+    if rd_stages:
+        rd_pipe = plan_read_pipeline(registers, rd_stages, rd_bank_size)
+    PROFILE.stop()
+
+    PROFILE.start("ports")
+    # Header
+    emit(f"// Filename          : {header_filename(filename)}")
+    emit(f"// Author            : {module_info.get('owner', 'unknown')}")
+    emit(f"// Created           : {created}")
+    emit( "// Description       : This file is auto generated by gen_reg.py script. Not edit by hand")
+    emit(f"//                   : addr_width = {_addr_width}")
+    emit(f"//                   : bus_type   = {module_info.get('cfg_interface', 'regbus')}")
+    emit(f"//                   : base_addr  = {module_info.get('base_addr', DEFAULT_BASE_ADDR)}\n")
     
-    code[-1] = code[-1].rstrip(',')  # Remove last comma
-    code.append(");\n")
+    # Module declaration
+    emit(f"module {module_info['module']} (")
+    emit.extend(bus_port_declarations(bus, _addr_width, rd_stages))
     
+    # Signals
+    emit.extend(field_port_declarations(registers))
+
+    emit.rstrip_last(',')  # Remove last comma
+    emit(");\n")
+    
+    PROFILE.stop()
+
+    PROFILE.start("declarations")
     # Register and wire declarations
-    code.append("//============================================================================")
-    code.append("// reg and wire declaration")
-    code.append("//============================================================================")
-    code.append("reg  [31:0]    rd_data_nxt ;")
-    code.append("wire [31:0]    msk;")
+    emit("//============================================================================")
+    emit("// reg and wire declaration")
+    emit("//============================================================================")
+    emit.extend(bus_signal_declarations(bus, _addr_width, rd_stages))
+    if rd_stages:
+        emit.extend(read_pipeline_decl(rd_pipe))
+    else:
+        emit("reg  [31:0]    rd_data_nxt ;")
+    emit("wire [31:0]    msk;")
     
     # Address decode wires
     for reg in registers:
         if reg.var is not None:    
             if reg.wr == 'r':
-                code.append(f"reg  [31:0]    rd_data_nxt_{reg.reg_name};")
+                emit(f"reg  [31:0]    rd_data_nxt_{reg.reg_name};")
             else:
-                code.append(f"reg  [31:0]    rd_data_nxt_{reg.reg_name};")
-                code.append(f"wire           wr_en_{reg.reg_name}[{reg.var_val}:0];")
+                emit(f"reg  [31:0]    rd_data_nxt_{reg.reg_name};")
+                emit(f"wire           wr_en_{reg.reg_name}[{reg.var_val}:0];")
+            if index_decode:
+                _shift, _idx_width, _ = array_decode[reg.reg_name]
+                for _prefix, _ in array_decode_addrs(reg, split_addr):
+                    emit(f"{f'wire [{_addr_width-1}:0]':<15}{_prefix}addr_off_{reg.reg_name};")
+                    emit(f"wire           {_prefix}addr_hit_{reg.reg_name};")
+                    emit(f"{f'wire [{_idx_width-1}:0]':<15}{_prefix}addr_idx_{reg.reg_name};")
         else:
             if reg.wr == 'w':
-                code.append(f"wire           wr_en_{reg.reg_name};")
+                emit(f"wire           wr_en_{reg.reg_name};")
+
+    PROFILE.stop()
+
+    write_bus_frontend(emit, bus, _addr_width, rd_stages)
 
+    PROFILE.start("wr_en")
     # Main code
-    code.append("//============================================================================")
-    code.append("//main code")
-    code.append("//============================================================================")
-    code.append("assign msk = {{8{wr_msk[3]}},{8{wr_msk[2]}},{8{wr_msk[1]}},{8{wr_msk[0]}}};\n")
+    emit("//============================================================================")
+    emit("//main code")
+    emit("//============================================================================")
+    emit("assign msk = {{8{wr_msk[3]}},{8{wr_msk[2]}},{8{wr_msk[1]}},{8{wr_msk[0]}}};\n")
     
     # Address decoding
-    code.append("//============================================================================")
-    code.append("// reg wr_en/rd_en assignment")
-    code.append("//============================================================================")
+    emit("//============================================================================")
+    emit("// reg wr_en/rd_en assignment")
+    emit("//============================================================================")
 
     gvar_i_declared = False
     ginter_j_declared = False
-    # Calculate the maximum length of the left-hand side expressions
-    max_lhs_length = 0
-    for reg in registers:
-        if reg.wr == 'w':
-            if reg.var is not None:
-                lhs_length = len(f"wr_en_{reg.reg_name}[{reg.var_val}]")
-            else:
-                lhs_length = len(f"wr_en_{reg.reg_name}")
-            if lhs_length > max_lhs_length:
-                max_lhs_length = lhs_length
-
 
     # Generate the Verilog code with aligned assign statements
     for reg in registers:
-        if reg.wr == 'w':
+        if index_decode and reg.var is not None:
+            # Range check plus index extraction, shared by write enable and read
+            _shift, _idx_width, _last = array_decode[reg.reg_name]
+            for _prefix, _addr in array_decode_addrs(reg, split_addr):
+                _hit = [f"({_addr}[{_addr_width-1}:0] >= {_addr_width}'h{reg.offset:x})",
+                        f"({_addr}[{_addr_width-1}:0] <= {_addr_width}'h{_last})"]
+                if _shift > 0:
+                    _hit.append(f"({_prefix}addr_off_{reg.reg_name}[{_shift-1}:0] == {_shift}'h0)")
+                emit(f"assign {_prefix}addr_off_{reg.reg_name} = {_addr}[{_addr_width-1}:0] - {_addr_width}'h{reg.offset:x};")
+                emit(f"assign {_prefix}addr_hit_{reg.reg_name} = {' & '.join(_hit)};")
+                emit(f"assign {_prefix}addr_idx_{reg.reg_name} = {_prefix}addr_off_{reg.reg_name}[{_shift+_idx_width-1}:{_shift}];")
+            if reg.wr == 'w':
+                if not gvar_i_declared:
+                    emit("\ngenvar i;")
+                    gvar_i_declared = True
+                emit("generate")
+                emit(f"    for(i = 0; i <= {reg.var_val}; i = i + 1) begin: wr_{reg.reg_name}")
+                emit(f"        assign wr_en_{reg.reg_name}[i]= wr_en & addr_hit_{reg.reg_name} & (addr_idx_{reg.reg_name} == i);")
+                emit("    end")
+                emit("endgenerate")
+        elif reg.wr == 'w':
             if reg.var is not None:
                 if not gvar_i_declared:
-                    code.append("\ngenvar i;")
+                    emit("\ngenvar i;")
                     gvar_i_declared = True
-                code.append("generate")
-                code.append(f"    for(i = 0; i <= {reg.var_val}; i = i + 1) begin: wr_{reg.reg_name}")
-                code.append(f"        assign wr_en_{reg.reg_name}[i]= wr_en & (reg_addr[{_addr_width-1}:0] == {_addr_width}'h{reg.offset} + {_addr_width}'h{reg.var_step} * i );")
-                code.append(f"    end")
-                code.append("endgenerate")
+                emit("generate")
+                emit(f"    for(i = 0; i <= {reg.var_val}; i = i + 1) begin: wr_{reg.reg_name}")
+                emit(f"        assign wr_en_{reg.reg_name}[i]= wr_en & (reg_addr[{_addr_width-1}:0] == {_addr_width}'h{reg.offset:x} + {_addr_width}'h{reg.var_step:x} * i );")
+                emit("    end")
+                emit("endgenerate")
             else:
                 lhs = f"wr_en_{reg.reg_name}"
-                code.append(f"assign {lhs:<{max_lhs_length}} = wr_en & (reg_addr[{_addr_width-1}:0] == {_addr_width}'h{reg.offset});")
+                emit(f"assign {lhs:<{max_lhs_length}} = wr_en & (reg_addr[{_addr_width-1}:0] == {_addr_width}'h{reg.offset:x});")
     
 
 
+    PROFILE.stop()
+
+    PROFILE.start("reg_write")
     # Register writes
-    code.append("\n//============================================================================")
-    code.append(  "// reg write")
-    code.append(  "//============================================================================")
+    emit("\n//============================================================================")
+    emit(  "// reg write")
+    emit(  "//============================================================================")
     for reg in registers:
         if reg.var is not None:# Variable registers
             if reg.wr == 'w':
                 for field in reg.fields:
-                    code.append( "//============================================================================")
-                    code.append(f"// {field.name} addr:{_addr_width}'h{reg.offset} type:{field.sw_access} bits:[{field.bits}] default:{field.default}")
-                    code.append("//============================================================================")
-                    code.append("generate")
-                    code.append(f"    for(i = 0; i <= {reg.var_val}; i = i + 1) begin: wr_{field.name}")
-                    code.append(f"        always @(posedge clk or negedge rst_n) begin")
-                    code.append(f"            if (!rst_n)")
-                    code.append(f"                {field.name}[i] <= {field.default};")
-                    code.append(f"            else begin")
+                    emit( "//============================================================================")
+                    emit(f"// {field.name} addr:{_addr_width}'h{reg.offset:x} type:{field.sw_access} bits:[{field.bits}] default:{field.default}")
+                    emit("//============================================================================")
+                    emit("generate")
+                    emit(f"    for(i = 0; i <= {reg.var_val}; i = i + 1) begin: wr_{field.name}")
+                    emit("        always @(posedge clk or negedge rst_n) begin")
+                    emit("            if (!rst_n)")
+                    emit(f"                {field.name}[i] <= {field.default};")
+                    emit("            else begin")
                     if field.sw_access == "RW":
-                        code.append(f"                if (wr_en_{reg.reg_name}[i] == 1'b1)")
+                        emit(f"                if (wr_en_{reg.reg_name}[i] == 1'b1)")
                         if field.bits_size == 1:
-                            code.append(f"                    {field.name}[i] <= ({field.name}[i] & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
+                            emit(f"                    {field.name}[i] <= ({field.name}[i] & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
                         else:
-                            code.append(f"                    {field.name}[i][{field.bits_size-1}:0] <= ({field.name}[i][{field.bits_size-1}:0] & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
+                            emit(f"                    {field.name}[i][{field.bits_size-1}:0] <= ({field.name}[i][{field.bits_size-1}:0] & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
                     elif field.sw_access == "W1P":
-                        code.append(f"                if (wr_en_{reg.reg_name}[i] == 1'b1)")
-                        code.append(f"                    {field.name}[i] <= wr_data[{field.bits}] & msk[{field.bits}];")
+                        emit(f"                if (wr_en_{reg.reg_name}[i] == 1'b1)")
+                        emit(f"                    {field.name}[i] <= wr_data[{field.bits}] & msk[{field.bits}];")
                     elif field.sw_access == "W1C":
-                        code.append(f"                if ({field.name}_hw_en == 1'b1)")
-                        code.append(f"                    {field.name}[i] <= {field.name}_hw_val;")
-                        code.append(f"                else if (wr_en_{reg.reg_name}[i] == 1'b1)")
-                        code.append(f"                    {field.name}[i] <= (~wr_data[{field.bits}] | ~msk[{field.bits}]) & {field.name}[i];")
-                    code.append("            end")
-                    code.append("        end")
-                    code.append("    end")
-                    code.append("endgenerate")
+                        emit(f"                if ({field.name}_hw_en == 1'b1)")
+                        emit(f"                    {field.name}[i] <= {field.name}_hw_val;")
+                        emit(f"                else if (wr_en_{reg.reg_name}[i] == 1'b1)")
+                        emit(f"                    {field.name}[i] <= (~wr_data[{field.bits}] | ~msk[{field.bits}]) & {field.name}[i];")
+                    emit("            end")
+                    emit("        end")
+                    emit("    end")
+                    emit("endgenerate")
             # Read data logic
-            code.append( "//============================================================================")
-            code.append(f"// rd_data_nxt_{reg.reg_name}")
-            code.append("//============================================================================")
+            emit( "//============================================================================")
+            emit(f"// rd_data_nxt_{reg.reg_name}")
+            emit("//============================================================================")
+            if index_decode:
+                # Single indexed read, addr_idx is in range whenever addr_hit is set
+                _prefix = "rd_" if split_addr else ""
+                emit("always @(*) begin")
+                emit(f"    rd_data_nxt_{reg.reg_name}[31:0]  = 32'h0;")
+                emit(f"    if ({_prefix}addr_hit_{reg.reg_name}) begin")
+                for field in reg.fields:
+                    if field.bits_size == 1:
+                        emit(f"        rd_data_nxt_{reg.reg_name}[{field.bits}] = {field.name}[{_prefix}addr_idx_{reg.reg_name}];")
+                    else:
+                        emit(f"        rd_data_nxt_{reg.reg_name}[{field.bits}] = {field.name}[{_prefix}addr_idx_{reg.reg_name}][{field.bits_size -1}:0];")
+                emit("    end")
+                emit("end\n")
+                continue
             if not ginter_j_declared:
-                code.append("integer j;")
+                emit("integer j;")
                 ginter_j_declared = True
-            code.append(f"always @(*) begin")
-            code.append(f"    rd_data_nxt_{reg.reg_name}[31:0]  = 32'h0;")
-            code.append(f"    for(j = 0; j <= {reg.var_val}; j = j + 1) begin:rdata_loop_{reg.reg_name}")
-            code.append(f"        if (reg_addr[{_addr_width-1}:0] == {_addr_width}'h{reg.offset} + {_addr_width}'h{reg.var_step} * j) begin")
+            emit("always @(*) begin")
+            emit(f"    rd_data_nxt_{reg.reg_name}[31:0]  = 32'h0;")
+            emit(f"    for(j = 0; j <= {reg.var_val}; j = j + 1) begin:rdata_loop_{reg.reg_name}")
+            emit(f"        if ({rd_addr}[{_addr_width-1}:0] == {_addr_width}'h{reg.offset:x} + {_addr_width}'h{reg.var_step:x} * j) begin")
             for field in reg.fields:
                 if field.bits_size == 1:
-                    code.append(f"            rd_data_nxt_{reg.reg_name}[{field.bits}] = {field.name}[j];")
+                    emit(f"            rd_data_nxt_{reg.reg_name}[{field.bits}] = {field.name}[j];")
                 else:
-                    code.append(f"            rd_data_nxt_{reg.reg_name}[{field.bits}] = {field.name}[j][{field.bits_size -1}:0];")
-            code.append("        end")
-            code.append("    end")
-            code.append("end\n")    
+                    emit(f"            rd_data_nxt_{reg.reg_name}[{field.bits}] = {field.name}[j][{field.bits_size -1}:0];")
+            emit("        end")
+            emit("    end")
+            emit("end\n")    
         else:# Non-variable registers                  
             for field in reg.fields:
                 if field.sw_access != "RO": 
-                    code.append( "//============================================================================")
-                    code.append(f"// {field.name} addr:{_addr_width}'h{reg.offset} type:{field.sw_access} bits:[{field.bits}] default:{field.default}")
-                    code.append("//============================================================================")
-                    code.append("always @(posedge clk or negedge rst_n) begin")
-                    code.append("    if (!rst_n)")
+                    emit( "//============================================================================")
+                    emit(f"// {field.name} addr:{_addr_width}'h{reg.offset:x} type:{field.sw_access} bits:[{field.bits}] default:{field.default}")
+                    emit("//============================================================================")
+                    emit("always @(posedge clk or negedge rst_n) begin")
+                    emit("    if (!rst_n)")
                     if field.bits_size == 1:
-                        code.append(f"        {field.name} <= {field.default};")
+                        emit(f"        {field.name} <= {field.default};")
                     else:
-                        code.append(f"        {field.name}[{field.bits_size-1}:0] <= {field.default};")
-                    code.append("    else begin")
+                        emit(f"        {field.name}[{field.bits_size-1}:0] <= {field.default};")
+                    emit("    else begin")
                     if field.sw_access == "RW":
-                        code.append(f"        if (wr_en_{reg.reg_name} == 1'b1)")
+                        emit(f"        if (wr_en_{reg.reg_name} == 1'b1)")
                         if field.bits_size == 1:
-                            code.append(f"            {field.name} <= ({field.name} & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
+                            emit(f"            {field.name} <= ({field.name} & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
                         else:
-                            code.append(f"            {field.name}[{field.bits_size-1}:0] <= ({field.name}[{field.bits_size-1}:0] & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
+                            emit(f"            {field.name}[{field.bits_size-1}:0] <= ({field.name}[{field.bits_size-1}:0] & ~msk[{field.bits}]) | (wr_data[{field.bits}] & msk[{field.bits}]);")
                     elif field.sw_access == "W1P":
-                        code.append(f"        if (wr_en_{reg.reg_name} == 1'b1)")
-                        code.append(f"            {field.name} <= wr_data[{field.bits}] & msk[{field.bits}];")
-                        code.append("        else")
-                        code.append(f"            {field.name} <= 1'b0;")
+                        emit(f"        if (wr_en_{reg.reg_name} == 1'b1)")
+                        emit(f"            {field.name} <= wr_data[{field.bits}] & msk[{field.bits}];")
+                        emit("        else")
+                        emit(f"            {field.name} <= 1'b0;")
                     elif field.sw_access == "W1C":
-                        code.append(f"        if ({field.name}_hw_en == 1'b1)")
-                        code.append(f"            {field.name} <= {field.name}_hw_val;")
-                        code.append(f"        else if (wr_en_{reg.reg_name} == 1'b1)")
-                        code.append(f"            {field.name} <= (~wr_data[{field.bits}] | ~msk[{field.bits}]) & {field.name};")
+                        emit(f"        if ({field.name}_hw_en == 1'b1)")
+                        emit(f"            {field.name} <= {field.name}_hw_val;")
+                        emit(f"        else if (wr_en_{reg.reg_name} == 1'b1)")
+                        emit(f"            {field.name} <= (~wr_data[{field.bits}] | ~msk[{field.bits}]) & {field.name};")
                     
-                    code.append("    end")
-                    code.append("end\n")
-    
-    # Read data logic
-    code.append("//============================================================================")
-    code.append("// next read data")
-    code.append("//============================================================================")
-    code.append("always @(*) begin")
-    code.append("    rd_data_nxt[31:0] = 32'h0;")
-    code.append(f"    case(reg_addr[{_addr_width-1}:0])")
+                    emit("    end")
+                    emit("end\n")
     
-    for reg in registers:
-        if reg.var is None:
-            addr = reg.offset
-            code.append(f"    {_addr_width}'h{addr}: begin")
-            for field in reg.fields:
-                if field.sw_access == "W1P":
-                    code.append(f"        rd_data_nxt[{field.bits}] = {field.bits_size}'h0;")
-                else:
-                    if field.bits_size == 1:
-                        code.append(f"        rd_data_nxt[{field.bits}] = {field.name};")
-                    else:   
-                        code.append(f"        rd_data_nxt[{field.bits}] = {field.name}[{field.bits_size-1}:0];")
-            code.append("    end")
-    all_var_none = all(reg.var is None for reg in registers)
-    if all_var_none:
-        code.append("    default:")
-        code.append("        rd_data_nxt = 32'h0;")
+    PROFILE.stop()
+
+    PROFILE.start("read_mux")
+    if rd_stages:
+        write_read_pipeline(emit, rd_pipe, _addr_width, rd_addr)
     else:
-        # Default read data for variable registers
-        default_signal = []  
+        # Read data logic
+        emit("//============================================================================")
+        emit("// next read data")
+        emit("//============================================================================")
+        emit("always @(*) begin")
+        emit("    rd_data_nxt[31:0] = 32'h0;")
+        emit(f"    case({rd_addr}[{_addr_width-1}:0])")
+    
         for reg in registers:
-            if reg.var is not None:
-                default_signal.append(f"rd_data_nxt_{reg.reg_name} | ")
-        # Remove last " | "
-        default_signal = "".join(default_signal)[:-3]
-        code.append( "    default: ")
-        code.append(f"        rd_data_nxt = {default_signal};")
-    code.append("    endcase")
-    code.append("end\n")
+            if reg.var is None:
+                emit(f"    {_addr_width}'h{reg.offset:x}: begin")
+                for field in reg.fields:
+                    if field.sw_access == "W1P":
+                        emit(f"        rd_data_nxt[{field.bits}] = {field.bits_size}'h0;")
+                    else:
+                        if field.bits_size == 1:
+                            emit(f"        rd_data_nxt[{field.bits}] = {field.name};")
+                        else:   
+                            emit(f"        rd_data_nxt[{field.bits}] = {field.name}[{field.bits_size-1}:0];")
+                emit("    end")
+        if all_var_none:
+            emit("    default:")
+            emit("        rd_data_nxt = 32'h0;")
+        else:
+            # Default read data for variable registers
+            default_signal = " | ".join(array_rd_signals)
+            emit( "    default: ")
+            emit(f"        rd_data_nxt = {default_signal};")
+        emit("    endcase")
+        emit("end\n")
     
-    # Final read data register
-    code.append("//============================================================================")
-    code.append("// read data")
-    code.append("//============================================================================")
-    code.append("always @(posedge clk or negedge rst_n) begin")
-    code.append("    if (!rst_n)")
-    code.append("        rd_data[31:0] <= 32'h0; ")
-    code.append("    else if(rd_en)")
-    code.append("        rd_data[31:0] <= rd_data_nxt[31:0];")
-    code.append("end\n")
+        # Final read data register
+        emit("//============================================================================")
+        emit("// read data")
+        emit("//============================================================================")
+        emit("always @(posedge clk or negedge rst_n) begin")
+        emit("    if (!rst_n)")
+        emit("        rd_data[31:0] <= 32'h0; ")
+        emit("    else if(rd_en)")
+        emit("        rd_data[31:0] <= rd_data_nxt[31:0];")
+        emit("end\n")
     
-    code.append("endmodule")
+    emit("endmodule")
     
-    return "\n".join(code)
+    emit.close()
+    PROFILE.stop()
+    PROFILE.count("lines emitted", emit.lines)
+
+def generate_verilog(module_info, registers, filename, created=None, index_decode=False,
+                     rd_stages=0, rd_bank_size=32):
+    # Same as write_verilog, but returns the module as a string
+    f = io.StringIO()
+    write_verilog(f, module_info, registers, filename, created=created, index_decode=index_decode,
+                  rd_stages=rd_stages, rd_bank_size=rd_bank_size)
+    return f.getvalue()
+
+def verilog_literal_value(value):
+    """Return the int value of a field default such as 3'h5, 1'b0 or 12.
+
+    Returns None for values that are not a plain number, like a parameter
+    name or a literal with x/z digits.
+    """
+    if value is None or value == "":
+        return 0
+    if isinstance(value, int):
+        return value
+    match = VERILOG_LITERAL.match(str(value))
+    if not match:
+        return None
+    digits = match.group(3).replace('_', '')
+    if match.group(2) is None:
+        return int(digits, 10) if digits.isdigit() else None
+    try:
+        return int(digits, VERILOG_RADIX[match.group(2).lower()])
+    except ValueError:  # x/z digits
+        return None
+
+VERILOG_LITERAL = re.compile(r"^\s*(\d+)?\s*(?:'[sS]?([bBoOdDhH]))?\s*([0-9a-fA-F_xXzZ?]+)\s*$")
+VERILOG_RADIX = {'b': 2, 'o': 8, 'd': 10, 'h': 16}
+
+def map_registers(registers):
+    # Backends other than Verilog describe arrays once, not per element
+    return registers.registers if isinstance(registers, ExpandedRegisters) else registers
+
+def _hex_digits(module_info):
+    return max(1, -(-int(module_info.get('addr_width', '12')) // 4))
+
+def write_c_header(f, module_info, registers, filename, created=None):
+    """Write a C header with the address, offset, mask and shift macros of registers.
+
+    Every macro starts with the upper case module name. A register gets
+    _OFFSET and _ADDR (base address + offset), each field _SHIFT, _WIDTH,
+    _MASK and _RESET. Array registers get _OFFSET(i)/_ADDR(i) macros plus
+    _COUNT and _STRIDE.
+    """
+    if created is None:
+        created = time.strftime(TIMESTAMP_FORMAT)
+    emit = VerilogWriter(f)
+    module = module_info['module']
+    prefix = module.upper()
+    guard = re.sub(r'\W', '_', os.path.basename(filename)).upper()
+    digits = _hex_digits(module_info)
+    base_addr = verilog_literal_value(module_info.get('base_addr', DEFAULT_BASE_ADDR)) or 0
+
+    emit(f"// Filename          : {os.path.basename(filename)}")
+    emit(f"// Author            : {module_info.get('owner', 'unknown')}")
+    emit(f"// Created           : {created}")
+    emit(f"// Description       : Register map of {module}, auto generated by gen_reg.py script. Not edit by hand")
+    emit(f"#ifndef {guard}")
+    emit(f"#define {guard}\n")
+    emit(f"#define {prefix}_BASE_ADDR 0x{base_addr:08x}u\n")
+    for reg in map_registers(registers):
+        name = f"{prefix}_{reg.reg_name.upper()}"
+        emit(f"/* {reg.reg_name} */")
+        if reg.var is None:
+            emit(f"#define {name}_OFFSET 0x{reg.offset:0{digits}x}u")
+            emit(f"#define {name}_ADDR ({prefix}_BASE_ADDR + {name}_OFFSET)")
+        else:
+            emit(f"#define {name}_COUNT {reg.var_val + 1}u")
+            emit(f"#define {name}_STRIDE 0x{reg.var_step:x}u")
+            emit(f"#define {name}_OFFSET({reg.var}) (0x{reg.offset:0{digits}x}u + ({reg.var}) * {name}_STRIDE)")
+            emit(f"#define {name}_ADDR({reg.var}) ({prefix}_BASE_ADDR + {name}_OFFSET({reg.var}))")
+        for field in reg.fields:
+            msb, lsb = bit_range(field.bits)
+            width = msb - lsb + 1
+            field_name = f"{name}_{field.name.upper()}"
+            emit(f"#define {field_name}_SHIFT {lsb}")
+            emit(f"#define {field_name}_WIDTH {width}")
+            emit(f"#define {field_name}_MASK 0x{((1 << width) - 1) << lsb:08x}u")
+            reset = verilog_literal_value(field.default)
+            if reset is not None:
+                emit(f"#define {field_name}_RESET 0x{reset:x}u")
+        emit("")
+    emit(f"#endif /* {guard} */\n")
+    emit.close()
+
+# UVM field access per sw_access; a W1P field pulses on write and reads 0
+UVM_ACCESS = {"RW": "RW", "RO": "RO", "W1C": "W1C", "W1P": "WO"}
+
+def write_uvm_ral(f, module_info, registers, filename, created=None):
+    """Write a UVM register model of registers.
+
+    One uvm_reg class per register and a uvm_reg_block <module>_reg_block
+    holding them in its default_map at the register offsets. Array registers
+    become arrays of registers. RO and W1C fields are volatile, they change
+    from the hardware side.
+    """
+    if created is None:
+        created = time.strftime(TIMESTAMP_FORMAT)
+    emit = VerilogWriter(f)
+    module = module_info['module']
+    guard = re.sub(r'\W', '_', os.path.basename(filename)).upper()
+    addr_width = int(module_info.get('addr_width', '12'))
+    base_addr = verilog_literal_value(module_info.get('base_addr', DEFAULT_BASE_ADDR)) or 0
+    registers = map_registers(registers)
+
+    emit(f"// Filename          : {os.path.basename(filename)}")
+    emit(f"// Author            : {module_info.get('owner', 'unknown')}")
+    emit(f"// Created           : {created}")
+    emit(f"// Description       : UVM register model of {module}, auto generated by gen_reg.py script. Not edit by hand")
+    emit(f"`ifndef {guard}")
+    emit(f"`define {guard}\n")
+    for reg in registers:
+        cls = f"{module}_{reg.reg_name.lower()}"
+        emit(f"class {cls} extends uvm_reg;")
+        emit(f"    `uvm_object_utils({cls})\n")
+        for field in reg.fields:
+            emit(f"    rand uvm_reg_field {field.name};")
+        emit("")
+        emit(f"    function new(string name = \"{cls}\");")
+        emit("        super.new(name, 32, UVM_NO_COVERAGE);")
+        emit("    endfunction\n")
+        emit("    virtual function void build();")
+        for field in reg.fields:
+            msb, lsb = bit_range(field.bits)
+            reset = verilog_literal_value(field.default)
+            volatile = 1 if field.sw_access in ("RO", "W1C") else 0
+            is_rand = 1 if field.sw_access == "RW" else 0
+            emit(f"        {field.name} = uvm_reg_field::type_id::create(\"{field.name}\");")
+            emit(f"        {field.name}.configure(this, {msb - lsb + 1}, {lsb}, \"{UVM_ACCESS[field.sw_access]}\", "
+                 f"{volatile}, 'h{reset or 0:x}, {0 if reset is None else 1}, {is_rand}, 0);")
+        emit("    endfunction")
+        emit("endclass\n")
+
+    block = f"{module}_reg_block"
+    emit(f"class {block} extends uvm_reg_block;")
+    emit(f"    `uvm_object_utils({block})\n")
+    for reg in registers:
+        instance = reg.reg_name.lower()
+        array = f"[{reg.var_val + 1}]" if reg.var is not None else ""
+        emit(f"    rand {module}_{instance} {instance}{array};")
+    emit("")
+    emit(f"    function new(string name = \"{block}\");")
+    emit("        super.new(name, UVM_NO_COVERAGE);")
+    emit("    endfunction\n")
+    emit("    virtual function void build();")
+    emit(f"        default_map = create_map(\"default_map\", 'h{base_addr:x}, 4, UVM_LITTLE_ENDIAN);")
+    for reg in registers:
+        instance = reg.reg_name.lower()
+        cls = f"{module}_{instance}"
+        rights = "RO" if reg.wr == 'r' else "RW"
+        if reg.var is None:
+            emit(f"        {instance} = {cls}::type_id::create(\"{instance}\");")
+            emit(f"        {instance}.configure(this, null, \"\");")
+            emit(f"        {instance}.build();")
+            emit(f"        default_map.add_reg({instance}, {addr_width}'h{reg.offset:x}, \"{rights}\");")
+        else:
+            emit(f"        foreach ({instance}[{reg.var}]) begin")
+            emit(f"            {instance}[{reg.var}] = {cls}::type_id::create($sformatf(\"{instance}[%0d]\", {reg.var}));")
+            emit(f"            {instance}[{reg.var}].configure(this, null, \"\");")
+            emit(f"            {instance}[{reg.var}].build();")
+            emit(f"            default_map.add_reg({instance}[{reg.var}], {addr_width}'h{reg.offset:x} + {reg.var} * {addr_width}'h{reg.var_step:x}, \"{rights}\");")
+            emit("        end")
+    emit("        lock_model();")
+    emit("    endfunction")
+    emit("endclass\n")
+    emit(f"`endif // {guard}\n")
+    emit.close()
+
+def _doc_rows(module_info, registers):
+    # (offset, register, bits, field, access, reset) per field, the register
+    # columns only on its first field
+    digits = _hex_digits(module_info)
+    for reg in map_registers(registers):
+        offset = f"0x{reg.offset:0{digits}x}"
+        if reg.var is not None:
+            offset += f" + {reg.var}*0x{reg.var_step:x} ({reg.var} = 0..{reg.var_val})"
+        for k, field in enumerate(reg.fields):
+            yield (offset if k == 0 else "", reg.reg_name if k == 0 else "",
+                   f"[{field.bits}]", field.name, field.sw_access, str(field.default))
+
+DOC_COLUMNS = ("Offset", "Register", "Bits", "Field", "Access", "Reset")
+
+def _doc_summary(module_info):
+    return [("Owner", module_info.get('owner', 'unknown')),
+            ("Base address", module_info.get('base_addr', DEFAULT_BASE_ADDR)),
+            ("Address width", module_info.get('addr_width', '12')),
+            ("Bus", module_info.get('cfg_interface', 'regbus'))]
+
+def write_markdown(f, module_info, registers, filename, created=None):
+    """Write the register table of registers as Markdown."""
+    if created is None:
+        created = time.strftime(TIMESTAMP_FORMAT)
+    emit = VerilogWriter(f)
+    emit(f"# {module_info['module']} registers\n")
+    emit(f"Auto generated by gen_reg.py script ({created}). Not edit by hand.\n")
+    for key, value in _doc_summary(module_info):
+        emit(f"- {key}: `{value}`")
+    emit("")
+    emit("| " + " | ".join(DOC_COLUMNS) + " |")
+    emit("|" + "---|" * len(DOC_COLUMNS))
+    for row in _doc_rows(module_info, registers):
+        emit("| " + " | ".join(cell.replace('|', '\\|') for cell in row) + " |")
+    emit("")
+    emit.close()
+
+def write_html(f, module_info, registers, filename, created=None):
+    """Write the register table of registers as a standalone HTML page."""
+    if created is None:
+        created = time.strftime(TIMESTAMP_FORMAT)
+    emit = VerilogWriter(f)
+    import html
+    title = html.escape(f"{module_info['module']} registers")
+    emit("<!DOCTYPE html>")
+    emit(f"<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{title}</title>")
+    emit("<style>table{border-collapse:collapse}th,td{border:1px solid #999;padding:2px 6px;"
+         "font-family:monospace;text-align:left}</style>")
+    emit(f"</head>\n<body>\n<h1>{title}</h1>")
+    emit(f"<p>Auto generated by gen_reg.py script ({html.escape(created)}). Not edit by hand.</p>")
+    emit("<ul>")
+    for key, value in _doc_summary(module_info):
+        emit(f"<li>{key}: <code>{html.escape(str(value))}</code></li>")
+    emit("</ul>")
+    emit("<table>")
+    emit("<tr>" + "".join(f"<th>{column}</th>" for column in DOC_COLUMNS) + "</tr>")
+    for row in _doc_rows(module_info, registers):
+        emit("<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in row) + "</tr>")
+    emit("</table>\n</body>\n</html>\n")
+    emit.close()
+
+# name -> (output suffix, writer). A writer is called as
+# writer(f, module_info, registers, filename, created=None, **options) and
+# streams its output to the text file f; register_backend adds one.
+BACKENDS = {
+    "verilog": (".v", write_verilog),
+    "c": (".h", write_c_header),
+    "uvm": ("_ral.sv", write_uvm_ral),
+    "md": (".md", write_markdown),
+    "html": (".html", write_html),
+}
+
+def register_backend(name, suffix, writer):
+    BACKENDS[name] = (suffix, writer)
+
+def file_digest(filename):
+    import hashlib
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _generator_digest():
+    # Changes to this script invalidate the cache even without a version bump
+    global _GENERATOR_DIGEST
+    if _GENERATOR_DIGEST is None:
+        _GENERATOR_DIGEST = f"{GEN_REG_VERSION}:{file_digest(os.path.abspath(__file__))}"
+    return _GENERATOR_DIGEST
+
+_GENERATOR_DIGEST = None
+
+def cache_key(source_digest, options):
+    import hashlib
+    key = {"source": source_digest, "generator": _generator_digest(), "options": options}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def cache_load(cache_dir, key):
+    """Return the [(cached_file, output_file), ...] of a cache entry, None on a miss.
+
+    An entry is <key>.json with the output file names and <key>.0, <key>.1,
+    ... with their content.
+    """
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json")) as f:
+            output_files = json.load(f)["output_files"]
+    except (OSError, ValueError, KeyError):
+        return None
+    files = [(os.path.join(cache_dir, f"{key}.{n}"), output_file) for n, output_file in enumerate(output_files)]
+    return files if all(os.path.exists(cached) for cached, _ in files) else None
+
+def cache_store(cache_dir, key, output_files):
+    import shutil
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key)
+    tmp_suffix = f".{os.getpid()}.tmp"
+    for n, output_file in enumerate(output_files):
+        shutil.copyfile(output_file, f"{path}.{n}{tmp_suffix}")
+    with open(f"{path}.json{tmp_suffix}", 'w') as f:
+        json.dump({"output_files": output_files}, f)
+    # atomic, batch workers may race on the same key; the .json marks a complete entry
+    for n in range(len(output_files)):
+        os.replace(f"{path}.{n}{tmp_suffix}", f"{path}.{n}")
+    os.replace(f"{path}.json{tmp_suffix}", f"{path}.json")
+
+def reproducible_stamp(source_digest):
+    # Honour SOURCE_DATE_EPOCH, otherwise stamp the header with the source hash
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        return time.strftime(TIMESTAMP_FORMAT, time.gmtime(int(epoch)))
+    return f"source sha256 {source_digest[:16]}"
+
+def same_content(file_a, file_b, chunk_size=1 << 20):
+    try:
+        if os.path.getsize(file_a) != os.path.getsize(file_b):
+            return False
+        with open(file_a, 'rb') as fa, open(file_b, 'rb') as fb:
+            while True:
+                chunk = fa.read(chunk_size)
+                if chunk != fb.read(chunk_size):
+                    return False
+                if not chunk:
+                    return True
+    except OSError:
+        return False
+
+def install_if_changed(src, dst, keep_src=False):
+    """Move src to dst (copy with keep_src) unless dst has the same content.
+
+    Returns True if dst was written, an unchanged dst keeps its mtime.
+    """
+    if same_content(src, dst):
+        if not keep_src:
+            os.remove(src)
+        return False
+    if keep_src:
+        import shutil
+        shutil.copyfile(src, dst)
+    else:
+        os.replace(src, dst)
+    return True
+
+def gen_reg_file(input_file, output_file=None, parallel=False, read_only=True, out_dir=None,
+                 cache_dir=None, reproducible=False, index_decode=False, rd_stages=0, rd_bank_size=32,
+                 backends=("verilog",), partition=None, jobs=None):
+    """Parse input_file once and write the output of every backend in backends.
+
+    output_file only names the Verilog file, the other outputs are named
+    after the module, see output_paths. partition (max_registers, max_size)
+    splits the Verilog into sub-modules, see write_partitioned_verilog. With cache_dir the outputs are stored
+    under a key made of the workbook hash, the generation options and the
+    generator version; a hit skips parsing and generation. Reproducible mode
+    replaces the time stamp in the header and only rewrites an output when
+    its content changes.
+    A workbook with several modules gets the outputs of every module, see
+    write_modules. jobs limits the worker processes of the modules and
+    partitions (default CPU count), batch workers pass 1.
+    Returns (output_files, status) with status 'generated', 'cached' or 'unchanged'.
+    """
+    key = created = None
+    if cache_dir or reproducible:
+        with PROFILE.stage("hash"):
+            source_digest = ":".join(file_digest(name) for name in input_files(input_file))
+        if reproducible:
+            created = reproducible_stamp(source_digest)
+    if cache_dir:
+        options = {"parallel": parallel, "output": output_file, "out_dir": out_dir,
+                   "created": created, "index_decode": index_decode,
+                   "rd_stages": rd_stages, "rd_bank_size": rd_bank_size, "backends": list(backends),
+                   "partition": partition}
+        key = cache_key(source_digest, options)
+        entry = cache_load(cache_dir, key)
+        if entry is not None:
+            if out_dir:
+                os.makedirs(out_dir, exist_ok=True)
+            written = [install_if_changed(cached, output, keep_src=True) for cached, output in entry]
+            return [output for _, output in entry], 'cached' if any(written) else 'unchanged'
+
+    with PROFILE.stage("parse"):
+        modules = parse_input_modules(input_file, parallel=parallel, read_only=read_only)
+    staged = reproducible or key is not None
+    verilog_options = dict(partition=partition, index_decode=index_decode, rd_stages=rd_stages,
+                           rd_bank_size=rd_bank_size)
+    if len(modules) > 1:
+        if output_file:
+            raise ValueError(f"-o names one output but '{input_file}' describes {len(modules)} modules, use -d/--out-dir")
+        written = write_modules(modules, backends, out_dir, jobs=jobs, staged=staged, created=created,
+                                **verilog_options)
+    else:
+        module_info, registers = modules[0]
+        outputs = output_paths(module_info, backends, output_file, out_dir)
+        written = write_outputs(module_info, registers, outputs, staged=staged, created=created, jobs=jobs,
+                                **verilog_options)
+    output_files = list(written)
+    if key is not None:
+        cache_store(cache_dir, key, output_files)
+    return output_files, 'generated' if any(written.values()) else 'unchanged'
+
+def output_path(module_info, output_file=None, out_dir=None):
+    # Default to <module>.v, placed in out_dir (created on demand)
+    output_file = output_file if output_file else f"{module_info['module']}.v"
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        output_file = os.path.join(out_dir, output_file)
+    return output_file
+
+def output_paths(module_info, backends=("verilog",), output_file=None, out_dir=None):
+    # backend -> output file; output_file names the Verilog, the others are
+    # <module><suffix> next to it
+    outputs = {}
+    for name in backends:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown backend '{name}', choose from {', '.join(BACKENDS)}")
+        suffix = BACKENDS[name][0]
+        outputs[name] = output_path(module_info, output_file if name == "verilog" else
+                                    f"{module_info['module']}{suffix}", out_dir)
+    return outputs
+
+def write_output_file(writer, module_info, registers, output_file, staged=False, **options):
+    """Stream the output of one backend writer to output_file.
+
+    With staged the output goes to a temporary file first that only replaces
+    output_file if its content changed. options are passed on to the writer.
+    Returns True if output_file was written.
+    """
+    import threading
+    target = f"{output_file}.{os.getpid()}.{threading.get_ident()}.tmp" if staged else output_file
+    try:
+        with open(target, 'w', buffering=1 << 16) as f:
+            writer(f, module_info, registers, output_file, **options)
+        if staged:
+            return install_if_changed(target, output_file)
+    finally:
+        if staged and os.path.exists(target):
+            os.remove(target)
+    return True
+
+def write_verilog_file(module_info, registers, output_file, staged=False, **verilog_options):
+    # Only the Verilog, see write_output_file
+    with PROFILE.stage("generate"):
+        return write_output_file(write_verilog, module_info, registers, output_file,
+                                 staged=staged, **verilog_options)
+
+def write_outputs(module_info, registers, outputs, staged=False, created=None, jobs=None,
+                  partition=None, windows=None, top=True, **verilog_options):
+    """Render every backend of outputs (backend -> output file) from one parsed map.
+
+    The backends run concurrently on a thread pool and share the parsed
+    registers; verilog_options only go to the Verilog backend, which is
+    split into sub-modules with partition, see write_partitioned_verilog
+    (also for windows and top).
+    Profiling runs them one after the other, the profiler is not thread
+    safe. Returns output file -> True if it was written, for every file.
+    """
+    def render(name):
+        if name == "verilog" and partition:
+            return write_partitioned_verilog(module_info, registers, outputs[name], partition, staged=staged,
+                                             created=created, jobs=jobs, windows=windows, top=top,
+                                             **verilog_options)
+        if name == "verilog":
+            return {outputs[name]: write_verilog_file(module_info, registers, outputs[name], staged=staged,
+                                                      created=created, **verilog_options)}
+        with PROFILE.stage(f"render_{name}"):
+            return {outputs[name]: write_output_file(BACKENDS[name][1], module_info, registers, outputs[name],
+                                                     staged=staged, created=created)}
+
+    written = {}
+    if len(outputs) == 1 or PROFILE.enabled:
+        for name in outputs:
+            written.update(render(name))
+        return written
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(outputs)) as pool:
+        for result in pool.map(render, outputs):
+            written.update(result)
+    return written
+
+def _module_job(module_info, registers, outputs, options):
+    # Runs in a worker process for one module of a workbook
+    return write_outputs(module_info, registers, outputs, jobs=1, **options)
+
+def write_modules(modules, backends=("verilog",), out_dir=None, jobs=None, **options):
+    """Write the outputs of several modules parsed from one workbook.
+
+    modules are (module_info, registers), every module gets the outputs
+    named after it, see output_paths. The modules are rendered on a process
+    pool, one module per task; options go to write_outputs. Serial with one
+    job or when profiling. Returns output file -> True if it was written.
+    """
+    jobs_args = [(module_info, registers, output_paths(module_info, backends, None, out_dir), options)
+                 for module_info, registers in modules]
+    jobs = min(jobs or os.cpu_count() or 1, len(jobs_args))
+    written = {}
+    if jobs == 1 or PROFILE.enabled:
+        for args in jobs_args:
+            written.update(write_outputs(*args[:3], jobs=jobs, **args[3]))
+        return written
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        for result in pool.map(_module_job, *zip(*jobs_args)):
+            written.update(result)
+    return written
+
+def plan_partition(registers, addr_width, max_registers=None, max_size=None):
+    """Split registers into aligned address windows, one sub-module each.
+
+    The window is the largest power of two, at most max_size bytes, for which
+    no window holds more than max_registers register instances and no array
+    register crosses a window boundary. Returns (window_bits, blocks), blocks
+    being (window index, registers) in address order; empty windows are left
+    out.
+    """
+    registers = list(map_registers(registers))
+    top = addr_width
+    if max_size is not None:
+        if max_size < 4 or max_size & (max_size - 1):
+            raise ValueError(f"Partition size {max_size} is not a power of two of at least 4 bytes")
+        top = min(top, max_size.bit_length() - 1)
+    if max_registers is not None and max_registers < 1:
+        raise ValueError(f"Partition register limit must be at least 1, got {max_registers}")
+    for reg in registers:
+        # An array is never split, no window size makes it fit
+        if max_registers is not None and reg.count() > max_registers:
+            raise ValueError(f"Array register '{reg.reg_name}' has {reg.count()} elements, more than the "
+                             f"partition register limit of {max_registers}")
+    crossing = None
+    for bits in range(top, 1, -1):
+        counts = collections.Counter()
+        for reg in registers:
+            last = reg.offset + (reg.count() - 1) * (reg.var_step or 0)
+            if last >> bits != reg.offset >> bits:
+                crossing = reg
+                break
+            counts[reg.offset >> bits] += reg.count()
+        else:
+            if max_registers is None or max(counts.values(), default=0) <= max_registers:
+                blocks = {}
+                for reg in registers:
+                    blocks.setdefault(reg.offset >> bits, []).append(reg)
+                return bits, sorted(blocks.items(), key=lambda block: block[0])
+            continue
+        break  # smaller windows would split the array too
+    if crossing is not None:
+        raise ValueError(f"Array register '{crossing.reg_name}' crosses a {1 << bits} byte partition window, "
+                         f"use a larger partition size or register limit")
+    raise ValueError(f"Can not partition the map into windows of at most {max_registers} registers")
+
+def rebase_register(reg, base):
+    # Copy of reg at offset - base, the fields are shared
+    copy = Register()
+    for name in Register.__slots__:
+        setattr(copy, name, getattr(reg, name))
+    copy.offset -= base
+    return copy
+
+def _partition_job(module_info, registers, output_file, staged, options):
+    # Runs in a worker process for one sub-module
+    return write_verilog_file(module_info, registers, output_file, staged=staged, **options)
+
+def write_partitioned_verilog(module_info, registers, output_file, partition, staged=False, created=None,
+                              jobs=None, windows=None, top=True, **verilog_options):
+    """Write the map as one sub-module per address window plus a top module.
+
+    partition is (max_registers, max_size), see plan_partition. Window k
+    becomes <module>_blk<k>.v next to output_file, with its registers at
+    offsets inside the window; the sub-modules are generated on a process
+    pool. output_file gets the top module with the ports of the flat module,
+    which decodes the upper address bits, see write_partition_top. A map that
+    fits one window is written flat.
+    windows (window indices) only writes the sub-modules of those windows
+    and top=False skips the top, for watch mode; a missing file is always
+    written.
+    Returns output file -> True if it was written.
+    """
+    addr_width = int(module_info.get('addr_width', '12'))
+    with PROFILE.stage("partition"):
+        bits, blocks = plan_partition(registers, addr_width, *partition)
+    if len(blocks) < 2:
+        return {output_file: write_verilog_file(module_info, registers, output_file, staged=staged,
+                                                created=created, **verilog_options)}
+
+    module = module_info['module']
+    base_addr = verilog_literal_value(module_info.get('base_addr', DEFAULT_BASE_ADDR)) or 0
+    expand = isinstance(registers, ExpandedRegisters)
+    # The bus front-end is in the top, the sub-modules are on the regbus
+    bus = bus_interface(module_info)
+    block_bus = "regbus_split" if bus in ("regbus_split", "axi4lite") else "regbus"
+    jobs_args = []
+    for k, block in blocks:
+        base = k << bits
+        block_info = dict(module_info, module=f"{module}_blk{k}", addr_width=bits, size=f"{1 << bits}B",
+                          base_addr=f"32'h{base_addr + base:x}", cfg_interface=block_bus)
+        block_regs = [rebase_register(reg, base) for reg in block]
+        block_file = os.path.join(os.path.dirname(output_file), f"{module}_blk{k}.v")
+        jobs_args.append((block_info, expand_registers(block_regs) if expand else block_regs, block_file,
+                          staged, dict(verilog_options, created=created)))
+
+    written = {}
+    if top or not os.path.exists(output_file):
+        with PROFILE.stage("top"):
+            written[output_file] = write_output_file(
+                write_partition_top, module_info, registers, output_file, staged=staged, created=created,
+                blocks=[(k, args[0]['module']) for (k, _), args in zip(blocks, jobs_args)], window_bits=bits,
+                rd_stages=verilog_options.get('rd_stages', 0), bus=bus)
+    else:
+        written[output_file] = False
+    todo = [args for (k, _), args in zip(blocks, jobs_args)
+            if windows is None or k in windows or not os.path.exists(args[2])]
+    results = {}
+    jobs = min(jobs or os.cpu_count() or 1, len(todo) or 1)
+    if jobs == 1 or PROFILE.enabled:
+        for args in todo:
+            results[args[2]] = _partition_job(*args)
+    else:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            for args, result in zip(todo, pool.map(_partition_job, *zip(*todo))):
+                results[args[2]] = result
+    for args in jobs_args:
+        written[args[2]] = results.get(args[2], False)
+    return written
+
+def write_partition_top(f, module_info, registers, filename, created=None, blocks=(), window_bits=0,
+                        rd_stages=0, bus=None):
+    """Write the top module of a partitioned map.
+
+    blocks are (window index, sub-module name). The top has the ports and bus
+    front-end of the flat module, selects a sub-module by
+    reg_addr[addr_width-1:window_bits] (rd_addr for reads with a split read
+    address) and gates its wr_en/rd_en; the rd_valid of the sub-modules is
+    not used.
+    The selection is delayed by the read latency
+    (rd_stages + 1) and picks the rd_data of the sub-module that was read; it
+    holds until the next read completes, like the flat rd_data. bus is the
+    bus_interface() of module_info if already known.
+    """
+    if created is None:
+        created = time.strftime(TIMESTAMP_FORMAT)
+    emit = VerilogWriter(f)
+    aw = int(module_info.get('addr_width', '12'))
+    bw = window_bits
+    nb = len(blocks)
+    latency = rd_stages + 1
+    bus = bus or bus_interface(module_info)
+    split_addr = bus in ("regbus_split", "axi4lite")
+    rd_sel_now = "rd_addr_sel" if split_addr else "sel"
+
+    emit(f"// Filename          : {header_filename(filename)}")
+    emit(f"// Author            : {module_info.get('owner', 'unknown')}")
+    emit(f"// Created           : {created}")
+    emit( "// Description       : This file is auto generated by gen_reg.py script. Not edit by hand")
+    emit(f"//                   : top of {nb} sub-modules, {1 << bw} byte windows")
+    emit(f"//                   : addr_width = {aw}")
+    emit(f"//                   : bus_type   = {module_info.get('cfg_interface', 'regbus')}")
+    emit(f"//                   : base_addr  = {module_info.get('base_addr', DEFAULT_BASE_ADDR)}\n")
+
+    emit(f"module {module_info['module']} (")
+    emit.extend(bus_port_declarations(bus, aw, rd_stages))
+    # The sub-modules drive the field outputs
+    emit.extend(line.replace("output reg ", "output     ") for line in field_port_declarations(registers))
+    emit.rstrip_last(',')
+    emit(");\n")
+
+    emit("//============================================================================")
+    emit("// reg and wire declaration")
+    emit("//============================================================================")
+    emit.extend(bus_signal_declarations(bus, aw, rd_stages))
+    emit(f"{f'wire [{nb-1}:0]':<15}sel;")
+    if split_addr:
+        emit(f"{f'wire [{nb-1}:0]':<15}rd_addr_sel;")
+    for stage in range(1, latency + 1):
+        emit(f"reg            rd_en_p{stage};")
+        emit(f"{f'reg  [{nb-1}:0]':<15}rd_sel_p{stage};")
+    emit(f"{f'reg  [{nb-1}:0]':<15}rd_sel_hold;")
+    emit(f"{f'wire [{nb-1}:0]':<15}rd_sel;")
+    for k, _ in blocks:
+        emit(f"wire [31:0]    rd_data_blk{k};")
+    emit("")
+    write_bus_frontend(emit, bus, aw, rd_stages)
+
+    emit("//============================================================================")
+    emit("// sub-module select")
+    emit("//============================================================================")
+    for n, (k, _) in enumerate(blocks):
+        emit(f"assign sel[{n}] = (reg_addr[{aw-1}:{bw}] == {aw-bw}'h{k:x});")
+    if split_addr:
+        for n, (k, _) in enumerate(blocks):
+            emit(f"assign rd_addr_sel[{n}] = (rd_addr[{aw-1}:{bw}] == {aw-bw}'h{k:x});")
+    emit("")
+
+    # Field ports per window, collected in one pass over the registers
+    window_ports = collections.defaultdict(list)
+    for reg in registers:
+        window_ports[reg.offset >> bw].extend(field_port_names((reg,)))
+    width = max([8] + [len(port) for ports in window_ports.values() for port in ports])
+    for n, (k, name) in enumerate(blocks):
+        emit("//============================================================================")
+        emit(f"// {name}: {aw}'h{k << bw:x} - {aw}'h{((k + 1) << bw) - 1:x}")
+        emit("//============================================================================")
+        emit(f"{name} u_{name} (")
+        connections = [("clk", "clk"), ("rst_n", "rst_n"), ("reg_addr", f"reg_addr[{bw-1}:0]")]
+        if split_addr:
+            connections.append(("rd_addr", f"rd_addr[{bw-1}:0]"))
+        connections += [("wr_en", f"wr_en & sel[{n}]"), ("rd_en", f"rd_en & {rd_sel_now}[{n}]"),
+                        ("wr_msk", "wr_msk"), ("wr_data", "wr_data"), ("rd_data", f"rd_data_blk{k}")]
+        connections += [(port, port) for port in window_ports[k]]
+        for port, signal in connections:
+            emit(f"    .{port:<{width}} ({signal}),")
+        emit.rstrip_last(',')
+        emit(");\n")
+
+    emit("//============================================================================")
+    emit(f"// read data select, latency {latency}")
+    emit("//============================================================================")
+    emit("always @(posedge clk or negedge rst_n) begin")
+    emit("    if (!rst_n) begin")
+    for stage in range(1, latency + 1):
+        emit(f"        rd_en_p{stage} <= 1'b0;")
+        emit(f"        rd_sel_p{stage} <= {nb}'h0;")
+    emit(f"        rd_sel_hold <= {nb}'h0;")
+    emit("    end")
+    emit("    else begin")
+    previous = ("rd_en", rd_sel_now)
+    for stage in range(1, latency + 1):
+        emit(f"        rd_en_p{stage} <= {previous[0]};")
+        emit(f"        rd_sel_p{stage} <= {previous[1]};")
+        previous = (f"rd_en_p{stage}", f"rd_sel_p{stage}")
+    emit(f"        if (rd_en_p{latency})")
+    emit(f"            rd_sel_hold <= rd_sel_p{latency};")
+    emit("    end")
+    emit("end\n")
+    emit(f"assign rd_sel = rd_en_p{latency} ? rd_sel_p{latency} : rd_sel_hold;\n")
+    emit("always @(*) begin")
+    emit("    rd_data[31:0] = " + "\n                  | ".join(
+        f"({{32{{rd_sel[{n}]}}}} & rd_data_blk{k})" for n, (k, _) in enumerate(blocks)) + ";")
+    if rd_stages:
+        emit(f"    rd_valid = rd_en_p{latency};")
+    emit("end\n")
+    emit("endmodule")
+    emit.close()
+
+def field_port_names(registers):
+    # Field port names in field_port_declarations order
+    for reg in registers:
+        for field in reg.fields:
+            if field.sw_access == "W1C":
+                yield f"{field.name}_hw_en"
+                yield f"{field.name}_hw_val"
+            yield field.name
+
+def _has_magic(pattern):
+    return any(c in pattern for c in '*?[')
+
+def collect_inputs(patterns, manifest=None, warn=True):
+    """Expand workbook paths, glob patterns and manifest entries into a file list.
+
+    A manifest holds one workbook path or glob per line. Blank lines and lines
+    starting with '#' are ignored, relative entries are resolved against the
+    directory of the manifest. Duplicates are dropped, order is kept.
+    """
+    entries = list(patterns)
+    if manifest:
+        manifest_dir = os.path.dirname(manifest)
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                entries.append(os.path.join(manifest_dir, line))
+
+    inputs = []
+    for entry in entries:
+        if _has_magic(entry):
+            import glob
+            matches = sorted(glob.glob(entry, recursive=True))
+            if not matches and warn:
+                print(f"Warning: Pattern '{entry}' does not match any file.")
+            inputs.extend(matches)
+        else:
+            inputs.append(entry)
+    return list(dict.fromkeys(inputs))
+
+def _batch_job(input_file, gen_options):
+    # Runs in a worker process, so errors are returned instead of raised. The
+    # batch pool is the only one, partitions and modules are rendered serially
+    start = time.perf_counter()
+    try:
+        output_files, status = gen_reg_file(input_file, jobs=1, **gen_options)
+        return input_file, output_files, status, None, time.perf_counter() - start
+    except Exception as e:
+        return input_file, None, None, f"{type(e).__name__}: {e}", time.perf_counter() - start
+
+def run_batch(inputs, jobs=None, **gen_options):
+    """Generate the outputs of every workbook on a process pool.
+
+    gen_options are passed on to gen_reg_file. Returns a list of
+    (input_file, output_files, status, error, seconds) tuples in input order;
+    error is None on success. A failing workbook never stops the others.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    jobs = min(jobs, len(inputs)) if inputs else 1
+
+    if jobs == 1:
+        return [_batch_job(f, gen_options) for f in inputs]
+
+    import concurrent.futures
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_batch_job, f, gen_options): f for f in inputs}
+        for future in concurrent.futures.as_completed(futures):
+            input_file = futures[future]
+            try:
+                results[input_file] = future.result()
+            except Exception as e:  # worker crashed (e.g. killed), not a parse error
+                results[input_file] = (input_file, None, None, f"{type(e).__name__}: {e}", 0.0)
+    return [results[f] for f in inputs]
+
+def print_batch_summary(results, elapsed):
+    failed = [r for r in results if r[3] is not None]
+    for input_file, output_files, status, error, seconds in results:
+        if error is None:
+            print(f"  OK    {input_file} -> {', '.join(output_files)} ({status}, {seconds:.2f}s)")
+        else:
+            print(f"  FAIL  {input_file}: {error}")
+    outputs = [o for r in results if r[3] is None for o in r[1]]
+    for output_file in sorted({o for o in outputs if outputs.count(o) > 1}):
+        print(f"Warning: {output_file} was generated by more than one workbook, the outputs overwrite each other.")
+    print(f"Batch summary: {len(results) - len(failed)} succeeded, {len(failed)} failed, "
+          f"{len(results)} total in {elapsed:.2f}s")
+    return len(failed) == 0
+
+def register_signatures(registers):
+    """Map every register name to a tuple of everything that shapes its code.
+
+    Takes the registers as parsed, arrays not expanded, so an array counts
+    as one register.
+    """
+    return {reg.reg_name: (reg.offset, reg.var, reg.var_step, reg.var_val, reg.wr,
+                           tuple((f.bits, f.bits_size, f.name, f.sw_access, f.default) for f in reg.fields))
+            for reg in registers}
+
+def top_signatures(signatures, window_bits):
+    # What the top module of a partitioned map takes from every register: its
+    # window and the field ports
+    return [(sig[0] >> window_bits, sig[3], tuple((f[1], f[2], f[3]) for f in sig[5])) for sig in signatures.values()]
+
+def diff_registers(old, new):
+    # (added, removed, changed) register names between two register_signatures
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    changed = [name for name in new if name in old and new[name] != old[name]]
+    return added, removed, changed
+
+class Watcher:
+    """Keep the interpreter warm and regenerate the Verilog of changed inputs.
+
+    The inputs (paths, glob patterns and a manifest, expanded again on every
+    poll) are
+    polled for a new mtime or size. A changed input is parsed and compared
+    with its previous map register by register; only an input whose map or
+    module information changed is written again, and of a partitioned
+    Verilog only the sub-modules of the changed registers, plus the top if
+    its ports changed. Outputs are staged, one whose content is the same
+    keeps its mtime. Commands are taken from
+    stdin and, with a port, from a local TCP socket, one per line:
+    'regen [file]' regenerates now, 'status' lists the inputs, 'quit' stops.
+    Socket replies end with a blank line.
+    """
+
+    def __init__(self, patterns, output_file=None, manifest=None, interval=0.5, port=None, parallel=False,
+                 read_only=True, out_dir=None, reproducible=False, backends=("verilog",), **verilog_options):
+        self.patterns = patterns
+        self.manifest = manifest
+        self.output_file = output_file
+        self.interval = interval
+        self.port = port
+        self.parallel = parallel
+        self.read_only = read_only
+        self.out_dir = out_dir
+        self.reproducible = reproducible
+        self.backends = backends
+        self.verilog_options = verilog_options
+        self.state = {}  # input -> (stats, module_info, signatures, output_files, partition plan)
+        import queue
+        self.commands = queue.Queue()
+        self.running = False
+
+    def _stats(self, input_file):
+        stats = []
+        for name in input_files(input_file):
+            st = os.stat(name)
+            stats.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(stats)
+
+    def regenerate(self, input_file, force=False):
+        """Parse input_file and write its outputs if its map changed, or always with force.
+
+        Returns a one line report with the regeneration latency.
+        """
+        start = time.perf_counter()
+        stats = self._stats(input_file)
+        module_info, registers = parse_input(input_file, read_only=self.read_only)
+        signatures = register_signatures(registers)
+        previous = self.state.get(input_file)
+        outputs = output_paths(module_info, self.backends, self.output_file, self.out_dir)
+        output_files = list(outputs.values())  # the partition sub-modules are added once written
+        plan = None  # (window bits, windows) of a partitioned Verilog
+        partition = self.verilog_options.get('partition')
+        if partition and "verilog" in outputs:
+            bits, blocks = plan_partition(registers, int(module_info.get('addr_width', '12')), *partition)
+            plan = (bits, [k for k, _ in blocks])
+        affected = {}  # windows and top to write of a partitioned Verilog, all by default
+        if previous is None or previous[2] is None:
+            changes = "new map"
+        elif previous[1] != module_info or not set(output_files) <= set(previous[3]):
+            changes = "module information changed"
+        else:
+            added, removed, changed = diff_registers(previous[2], signatures)
+            changes = ", ".join([f"+{n}" for n in added] + [f"-{n}" for n in removed] + [f"~{n}" for n in changed])
+            if not changes and list(previous[2]) != list(signatures):
+                changes = "register order changed"
+            if not changes and not force and all(os.path.exists(o) for o in previous[3]):
+                self.state[input_file] = (stats, module_info, signatures, previous[3], plan)
+                return f"{input_file}: register map unchanged ({(time.perf_counter() - start) * 1000:.0f} ms)"
+            count = len(added) + len(removed) + len(changed)
+            if count:
+                changes = f"{count} register(s) changed ({changes})"
+                if plan is not None and plan == previous[4] and not force:
+                    # Missing files are written anyway, see write_partitioned_verilog
+                    bits = plan[0]
+                    affected = dict(windows={previous[2][name][0] >> bits for name in removed + changed} |
+                                            {signatures[name][0] >> bits for name in added + changed},
+                                    top=top_signatures(previous[2], bits) != top_signatures(signatures, bits))
+            elif not changes:
+                changes = "forced" if force else "output missing"
+
+        created = None
+        if self.reproducible:
+            created = reproducible_stamp(":".join(file_digest(name) for name in input_files(input_file)))
+        if self.parallel:
+            registers = expand_registers(registers)
+        written = write_outputs(module_info, registers, outputs, staged=True, created=created,
+                                **affected, **self.verilog_options)
+        output_files = list(written)
+        self.state[input_file] = (stats, module_info, signatures, output_files, plan)
+        generated = [name for name, done in written.items() if done]
+        outcome = f"{', '.join(generated)} generated" if generated else "outputs unchanged"
+        return f"{input_file}: {changes} -> {outcome} in {(time.perf_counter() - start) * 1000:.0f} ms"
+
+    def _try(self, input_file, force=False):
+        try:
+            return self.regenerate(input_file, force=force)
+        except Exception as e:
+            # The workbook may be half saved; keep its stats so only the next save retries
+            with contextlib.suppress(OSError):
+                previous = self.state.get(input_file, (None, None, None, None, None))
+                self.state[input_file] = (self._stats(input_file),) + previous[1:]
+            return f"{input_file}: FAIL {type(e).__name__}: {e}"
+
+    def poll(self, warn=False):
+        """Regenerate every input whose files changed since the last poll."""
+        reports = []
+        for input_file in collect_inputs(self.patterns, self.manifest, warn=warn):
+            try:
+                stats = self._stats(input_file)
+            except OSError:
+                continue  # removed or being replaced, try again on the next poll
+            previous = self.state.get(input_file)
+            if previous is None or previous[0] != stats:
+                reports.append(self._try(input_file))
+        return reports
+
+    def command(self, line):
+        """Run one command line and return its reply."""
+        words = line.split()
+        if not words:
+            return ""
+        if words[0] == "regen":
+            inputs = words[1:] or collect_inputs(self.patterns, self.manifest, warn=False)
+            return "\n".join(self._try(input_file, force=True) for input_file in inputs)
+        if words[0] == "status":
+            return "\n".join(f"{input_file} -> {', '.join(entry[3]) if entry[3] else 'not generated'}"
+                             for input_file, entry in self.state.items())
+        if words[0] == "quit":
+            self.running = False
+            return "bye"
+        return f"unknown command '{words[0]}', use regen [file], status or quit"
+
+    def _read_stdin(self):
+        for line in sys.stdin:
+            self.commands.put((line, None))
+
+    def _serve(self, server):
+        import threading
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn):
+        import queue
+        with conn, conn.makefile('rw') as f:
+            for line in f:
+                reply = queue.Queue(maxsize=1)
+                self.commands.put((line, reply))
+                f.write(reply.get() + "\n\n")  # a blank line ends every reply
+                f.flush()
+                reply.task_done()
+                if not self.running:
+                    break
+
+    def run(self):
+        """Generate all inputs, then watch them until 'quit' or Ctrl-C."""
+        # The watcher's threads and socket are only loaded when it runs
+        import queue
+        import socket
+        import threading
+        self.running = True
+        for report in self.poll(warn=True):
+            print(report, flush=True)
+        threading.Thread(target=self._read_stdin, daemon=True).start()
+        if self.port is not None:
+            server = socket.create_server(("127.0.0.1", self.port))
+            threading.Thread(target=self._serve, args=(server,), daemon=True).start()
+            print(f"Listening on 127.0.0.1:{server.getsockname()[1]}", flush=True)
+        print(f"Watching {len(self.state)} input(s), polling every {self.interval}s", flush=True)
+        try:
+            # Polls on a deadline, a steady stream of commands must not hold them off
+            next_poll = time.monotonic() + self.interval
+            while self.running:
+                timeout = next_poll - time.monotonic()
+                if timeout <= 0:
+                    for report in self.poll():
+                        print(report, flush=True)
+                    next_poll = time.monotonic() + self.interval
+                    continue
+                try:
+                    line, reply = self.commands.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                answer = self.command(line)
+                if reply is not None:
+                    reply.put(answer)
+                    if not self.running:
+                        reply.join()  # let 'quit' reach the client before exiting
+                elif answer:
+                    print(answer, flush=True)
+        except KeyboardInterrupt:
+            pass
 
 # if __name__ == "__main__":
 #     module_info, registers = parse_excel("sys_reg.xlsx",parallel=False)
@@ -488,16 +2664,110 @@ def generate_verilog(module_info, registers, filename):
 #         f.write(verilog_code)
 
 if __name__ == "__main__":
+    import argparse
     parser = argparse.ArgumentParser(description='Generate Verilog registers from Excel')
-    parser.add_argument('input', help='Input Excel file')
+    parser.add_argument('input', nargs='*', help='Input Excel (.xlsx), CSV/TSV, JSON/YAML or compiled (.regc.json) file(s) or glob pattern(s). More than one input runs in batch mode')
     parser.add_argument('-o', '--output', help='Output Verilog file name. Default by module name')
     parser.add_argument('-p', '--parallel', action='store_true', help='Enable parrllel implement for loop. Default by array implement')
+    parser.add_argument('-i', '--index-decode', action='store_true', help='Decode array registers by range check and index extraction. Needs power of two steps')
+    parser.add_argument('--rd-stages', type=int, default=0, help='Pipeline the read mux with this many stages, read latency is stages + 1 and rd_valid is added. Default by 0 (flat mux)')
+    parser.add_argument('--rd-bank-size', type=int, default=32, help='Registers per read mux bank when --rd-stages is used. Default by 32')
+    parser.add_argument('--partition-regs', type=int, default=None, help='Split the Verilog into sub-modules of at most this many registers and a top module')
+    parser.add_argument('--partition-size', default=None, help='Split the Verilog into sub-modules of at most this address window, e.g. 1KB, 256B or hex bytes')
+    parser.add_argument('-b', '--backends', type=lambda text: text.split(','), default=['verilog'],
+                        help=f'Comma separated outputs to render from one parse: {", ".join(BACKENDS)}. Default by verilog')
+    parser.add_argument('--profile', action='store_true', help='Print wall time, peak memory and counts per stage')
+    parser.add_argument('--profile-json', help='Write the --profile results as JSON to this file')
+    parser.add_argument('--profile-memory', action='store_true', help='Profile the peak memory of every stage with tracemalloc. Slow')
+    parser.add_argument('--compile', metavar='REGC_FILE', help='Only parse the input and write it as a compiled .regc.json register map')
+    parser.add_argument('--lint', action='store_true', help='Only check the inputs and report every error with its sheet, row and column')
+    parser.add_argument('--lint-format', choices=['text', 'json'], default='text', help='Output format of --lint. Default by text')
+    parser.add_argument('--full-load', action='store_true', help='Load the whole workbook in edit mode. Default by read-only streaming')
+    parser.add_argument('-m', '--manifest', help='Batch mode: file listing one workbook path or glob per line')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes for the inputs of batch mode, or the modules/partitions of one input. Default by CPU count')
+    parser.add_argument('-d', '--out-dir', help='Directory for the generated Verilog files. Default by current directory')
+    parser.add_argument('--cache-dir', help='Enable the build cache in this directory. Unchanged workbooks skip parsing')
+    parser.add_argument('-r', '--reproducible', action='store_true', help='No time stamp in the header and only rewrite the output when it changes')
+    parser.add_argument('-w', '--watch', action='store_true', help='Keep running and regenerate an input when its register map changes')
+    parser.add_argument('--watch-interval', type=float, default=0.5, help='Watch mode: seconds between polls of the inputs. Default by 0.5')
+    parser.add_argument('--watch-port', type=int, default=None, help='Watch mode: also take commands on this local TCP port (0 picks a free one)')
     args = parser.parse_args()
 
-    module_info, registers = parse_excel(args.input, parallel=args.parallel)
-    output_file = args.output if args.output else f"{module_info['module']}.v"
-    
-    verilog_code = generate_verilog(module_info, registers, output_file)
-    with open(output_file, 'w') as f:
-        f.write(verilog_code)
-    print(f"Successfully generated {output_file}")
+    if not args.input and not args.manifest:
+        parser.error('no input workbook given')
+    if args.rd_stages < 0 or args.rd_bank_size < 1:
+        parser.error('--rd-stages must be at least 0 and --rd-bank-size at least 1')
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('-j/--jobs must be at least 1')
+    unknown = [name for name in args.backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"unknown backend(s) {', '.join(unknown)}, choose from {', '.join(BACKENDS)}")
+
+    gen_options = dict(parallel=args.parallel, read_only=not args.full_load, out_dir=args.out_dir,
+                       cache_dir=args.cache_dir, reproducible=args.reproducible,
+                       index_decode=args.index_decode, rd_stages=args.rd_stages,
+                       rd_bank_size=args.rd_bank_size, backends=tuple(dict.fromkeys(args.backends)))
+    if args.partition_regs is not None or args.partition_size is not None:
+        try:
+            size = parse_module_size(args.partition_size) if args.partition_size is not None else None
+        except ValueError:
+            parser.error(f"invalid --partition-size '{args.partition_size}'")
+        gen_options['partition'] = (args.partition_regs, size)
+    batch = args.manifest or len(args.input) > 1 or any(_has_magic(p) for p in args.input)
+    profiler = None
+    if args.profile or args.profile_json or args.profile_memory:
+        if batch:
+            parser.error('--profile is only supported for a single workbook')
+        profiler = enable_profiling(trace_memory=args.profile_memory)
+    if args.lint:
+        if args.watch or args.compile:
+            parser.error('--lint can not be combined with --watch or --compile')
+        items = []
+        for input_file in collect_inputs(args.input, args.manifest):
+            items += lint_input(input_file, read_only=not args.full_load).items
+        if args.lint_format == 'json':
+            print(json.dumps([item._asdict() for item in items], indent=2))
+        else:
+            for item in items:
+                print(format_diagnostic(item))
+            errors = sum(item.severity == "error" for item in items)
+            print(f"{errors} error(s), {len(items) - errors} warning(s)")
+        if any(item.severity == "error" for item in items):
+            sys.exit(1)
+    elif args.watch:
+        if profiler or args.compile or args.cache_dir:
+            parser.error('--watch can not be combined with --profile, --compile or --cache-dir')
+        if args.output and batch:
+            parser.error('-o/--output can not be used with more than one input, use -d/--out-dir')
+        if args.watch_interval <= 0:
+            parser.error('--watch-interval must be positive')
+        options = {k: v for k, v in gen_options.items() if k != 'cache_dir'}
+        Watcher(args.input, args.output, args.manifest, interval=args.watch_interval, port=args.watch_port, **options).run()
+    elif args.compile:
+        if batch:
+            parser.error('--compile is only supported for a single input')
+        module_info, registers = parse_input(args.input[0], read_only=not args.full_load)
+        save_compiled(args.compile, module_info, registers)
+        print(f"Successfully compiled {args.compile}")
+    elif not batch:
+        output_files, status = gen_reg_file(args.input[0], args.output, jobs=args.jobs, **gen_options)
+        output_files = ", ".join(output_files)
+        if status == 'generated':
+            print(f"Successfully generated {output_files}")
+        elif status == 'cached':
+            print(f"Successfully restored {output_files} from cache")
+        else:
+            print(f"{output_files} is up to date")
+        if args.profile or args.profile_memory:
+            print(profiler.format_table())
+        if args.profile_json:
+            with open(args.profile_json, 'w') as f:
+                json.dump(profiler.report(), f, indent=2)
+    else:
+        if args.output:
+            parser.error('-o/--output can not be used in batch mode, use -d/--out-dir')
+        inputs = collect_inputs(args.input, args.manifest)
+        start = time.perf_counter()
+        results = run_batch(inputs, jobs=args.jobs, **gen_options)
+        if not print_batch_summary(results, time.perf_counter() - start):
+            sys.exit(1)
@@ -0,0 +1,151 @@
+#########################################################################################
+# Description: Indexed register map for tools built on gen_reg.py. Looks up registers
+#              and fields by name and register instances by address without expanding
+#              the array registers, and saves/loads the compiled register map format.
+#########################################################################################
+
+import argparse
+import bisect
+import heapq
+
+import gen_reg
+
+class RegisterMap:
+    """Parsed register map with name and address indexes.
+
+    - register(name): the register, O(1).
+    - field(name): (register, field, msb, lsb), O(1).
+    - at(offset): the register instance decoding a byte offset, O(log n).
+      Plain registers are returned as they are, an array element as a
+      gen_reg.RegisterInstance (reg, index, offset and prefixed names).
+
+    Offsets are relative to the module like reg_addr, base_addr holds the
+    base address. Array registers are indexed as address progressions, so
+    the index size does not grow with the array ranges.
+    """
+
+    def __init__(self, module_info, registers):
+        self.module_info = module_info
+        self.base_addr = gen_reg.verilog_literal_value(module_info.get('base_addr', gen_reg.DEFAULT_BASE_ADDR)) or 0
+        # Distinct registers, -p views are indexed by their arrays as well
+        self.registers = list(gen_reg.map_registers(registers))
+        self._registers = {}
+        self._fields = {}
+        for reg in self.registers:
+            if reg.reg_name in self._registers:
+                raise ValueError(f"Duplicate register name found: {reg.reg_name}")
+            self._registers[reg.reg_name] = reg
+            for field in reg.fields:
+                if field.name in self._fields:
+                    raise ValueError(f"Duplicate field name found: {field.name}")
+                self._fields[field.name] = (reg, field) + gen_reg.bit_range(field.bits)
+        self._build_address_index()
+
+    def _build_address_index(self):
+        # Cut the address space at the first and one past the last address of
+        # every register; each segment lists the registers whose range covers
+        # it. Only interleaved arrays share a segment, at() checks the step.
+        intervals = sorted((reg.offset, reg.offset + (reg.count() - 1) * (reg.var_step or 0) + 1, n)
+                           for n, reg in enumerate(self.registers))
+        bounds = sorted({bound for first, end, _ in intervals for bound in (first, end)})
+        self._starts = []
+        self._covers = []
+        active = []  # (end, n) of the ranges open at the current bound
+        pos = 0
+        for bound in bounds:
+            while active and active[0][0] <= bound:
+                heapq.heappop(active)
+            while pos < len(intervals) and intervals[pos][0] == bound:
+                heapq.heappush(active, (intervals[pos][1], intervals[pos][2]))
+                pos += 1
+            self._starts.append(bound)
+            self._covers.append(tuple(self.registers[n] for _, n in sorted(active, key=lambda item: item[1])))
+
+    @classmethod
+    def from_file(cls, filename, read_only=True):
+        # Any input gen_reg.py reads
+        return cls(*gen_reg.parse_input(filename, read_only=read_only))
+
+    def save(self, filename):
+        """Write the map as a compiled register map (.regc.json)."""
+        gen_reg.save_compiled(filename, self.module_info, self.registers)
+
+    @classmethod
+    def load(cls, filename):
+        return cls(*gen_reg.load_compiled(filename))
+
+    def __len__(self):
+        return len(self.registers)
+
+    def __iter__(self):
+        return iter(self.registers)
+
+    def __contains__(self, reg_name):
+        return reg_name in self._registers
+
+    def register(self, reg_name):
+        try:
+            return self._registers[reg_name]
+        except KeyError:
+            raise KeyError(f"No register '{reg_name}' in module '{self.module_info.get('module')}'") from None
+
+    def field(self, name):
+        """Return (register, field, msb, lsb) of the field name."""
+        try:
+            return self._fields[name]
+        except KeyError:
+            raise KeyError(f"No field '{name}' in module '{self.module_info.get('module')}'") from None
+
+    def address(self, reg_name, index=0, absolute=False):
+        # Byte offset of element index, plus base_addr if absolute
+        reg = self.register(reg_name)
+        if not 0 <= index < reg.count():
+            raise IndexError(f"Register '{reg_name}' has {reg.count()} element(s), no index {index}")
+        return reg.offset + index * (reg.var_step or 0) + (self.base_addr if absolute else 0)
+
+    def at(self, offset):
+        """Return the register instance at the byte offset, None if unmapped."""
+        pos = bisect.bisect_right(self._starts, offset) - 1
+        if pos < 0:
+            return None
+        for reg in self._covers[pos]:
+            if reg.var is None:
+                return reg
+            index, rem = divmod(offset - reg.offset, reg.var_step)
+            if not rem:
+                return gen_reg.RegisterInstance(reg, index)
+        return None
+
+    def instances(self):
+        """Every register instance in address order, arrays expanded lazily."""
+        return iter(gen_reg.ExpandedRegisters(self.registers))
+
+def describe(instance):
+    # One line per register instance for the command line
+    reg = getattr(instance, 'reg', instance)
+    kind = f"element {instance.index} of {reg.reg_name}" if reg is not instance else "register"
+    return f"0x{instance.offset:x} {instance.reg_name} ({kind})"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Look up registers, fields and addresses in a register map')
+    parser.add_argument('input', help='Register map, any input gen_reg.py reads')
+    parser.add_argument('-a', '--addr', action='append', default=[], help='Byte offset to look up, e.g. 0x104. Repeatable')
+    parser.add_argument('-f', '--field', action='append', default=[], help='Field name to look up. Repeatable')
+    parser.add_argument('-g', '--reg', action='append', default=[], help='Register name to look up. Repeatable')
+    parser.add_argument('--save', help='Save the map as a compiled register map (.regc.json)')
+    args = parser.parse_args()
+
+    reg_map = RegisterMap.from_file(args.input)
+    for addr in args.addr:
+        instance = reg_map.at(int(addr, 0))
+        print(f"{addr}: {describe(instance) if instance is not None else 'unmapped'}")
+    for name in args.field:
+        reg, field, msb, lsb = reg_map.field(name)
+        print(f"{name}: {reg.reg_name}[{msb}:{lsb}] {field.sw_access} default {field.default}")
+    for name in args.reg:
+        reg = reg_map.register(name)
+        span = "" if reg.var is None else f" + {reg.var}*0x{reg.var_step:x}, {reg.var} = 0~{reg.var_val}"
+        print(f"{name}: 0x{reg.offset:x}{span}, fields {', '.join(field.name for field in reg.fields)}")
+    if args.save:
+        reg_map.save(args.save)
+        print(f"Register map saved to {args.save}")
@@ -0,0 +1,302 @@
+#########################################################################################
+# Description: Executable reference model of the register block gen_reg.py generates.
+#              Applies batches of bus transactions as NumPy arrays and exports the
+#              expected read data and transaction traces for RTL testbenches.
+#########################################################################################
+
+import argparse
+import time
+
+import numpy as np
+
+import gen_reg
+
+# wr_msk (4 bits) -> the 32 bit msk wire of the generated module
+BYTE_MASKS = np.array([sum(0xff << (8 * b) for b in range(4) if m >> b & 1) for m in range(16)], dtype=np.uint32)
+HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+class RegisterModel:
+    """Golden model of the register semantics encoded by write_verilog.
+
+    Every register instance (an array element counts as one) is a 32 bit
+    word of state, the field kinds are kept as per instance bit masks:
+
+    - RW: masked write, (value & ~msk) | (wr_data & msk).
+    - W1P: a write drives wr_data & msk for one cycle (the pulse) and the
+      field reads as 0. In array registers the generated code keeps the
+      written value and reads it back, the model does the same.
+    - W1C: the field's one <field>_hw_en input, the hw_en bit at the field's
+      lsb, loads the whole field from hw_val and wins over a write, which
+      clears the bits written with 1 (masked).
+    - RO: reads the hardware input; the hw_en bits of RO fields select the
+      input bits that take hw_val.
+
+    Fields start from their default. A transaction is one clock cycle on one
+    register: the read data is the value before the cycle's write (the
+    registered rd_data), RO inputs changed in the same cycle are already
+    visible. Addresses are byte addresses truncated to addr_width like
+    reg_addr; an unmapped address reads 0 and ignores writes.
+    """
+
+    def __init__(self, module_info, registers):
+        self.module_info = module_info
+        self.addr_width = int(module_info.get('addr_width', '12'))
+        # Expanded registers (gen_reg -p) are separate scalar registers
+        scalar_arrays = isinstance(registers, gen_reg.ExpandedRegisters)
+        names, bases, counts = [], [], []
+        total = 0
+        addrs, reset, rw, w1p_pulse, w1p_held, w1c, ro = [], [], [], [], [], [], []
+        w1c_fields = []  # per register the (lsb bit, mask) of its W1C fields
+        self.fields = {}  # field name -> (first instance, count, lsb, width, sw_access)
+        for reg in gen_reg.map_registers(registers):
+            count = reg.count()
+            masks = {"RW": 0, "W1P": 0, "W1C": 0, "RO": 0}
+            word = 0
+            for field in reg.fields:
+                msb, lsb = gen_reg.bit_range(field.bits)
+                mask = ((1 << (msb - lsb + 1)) - 1) << lsb
+                default = gen_reg.verilog_literal_value(field.default)
+                if default is None:
+                    raise ValueError(f"Default '{field.default}' of field '{field.name}' is not a number, can not model it")
+                masks[field.sw_access] |= mask
+                word |= (default << lsb) & mask
+                if field.sw_access == "W1C":
+                    w1c_fields.append((total, count, 1 << lsb, mask))
+                self.fields[field.name] = (total, count, lsb, msb - lsb + 1, field.sw_access)
+            held = reg.var is not None and not scalar_arrays
+            names.append(reg.reg_name)
+            bases.append(total)
+            counts.append(count)
+            total += count
+            step = reg.var_step or 0
+            addrs.append(reg.offset + step * np.arange(count, dtype=np.uint64))
+            for values, value in ((reset, word), (rw, masks["RW"]), (w1c, masks["W1C"]), (ro, masks["RO"]),
+                                  (w1p_pulse, 0 if held else masks["W1P"]), (w1p_held, masks["W1P"] if held else 0)):
+                values.append(np.full(count, value, dtype=np.uint32))
+        concat = (lambda arrays, dtype: np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype))
+        self.registers = dict(zip(names, zip(bases, counts)))
+        self.addr = concat(addrs, np.uint64)
+        self.reset_value = concat(reset, np.uint32)
+        self.rw = concat(rw, np.uint32)
+        self.w1p_pulse = concat(w1p_pulse, np.uint32)
+        self.w1p_held = concat(w1p_held, np.uint32)
+        self.w1c = concat(w1c, np.uint32)
+        self.ro = concat(ro, np.uint32)
+        # Bits that read back the stored value; RO bits read hw_input
+        self.stored = self.rw | self.w1p_held | self.w1c
+        # W1C fields as (instance, slot) columns of their enable bit and mask,
+        # slots a register does not use stay 0
+        slots = np.zeros(total, dtype=np.intp)
+        self.w1c_en = np.zeros(total, dtype=np.uint32)
+        en_bits, en_masks = [], []
+        for first, count, bit, mask in w1c_fields:
+            span = slice(first, first + count)
+            slot = int(slots[first])
+            if slot == len(en_bits):
+                en_bits.append(np.zeros(total, dtype=np.uint32))
+                en_masks.append(np.zeros(total, dtype=np.uint32))
+            en_bits[slot][span] = bit
+            en_masks[slot][span] = mask
+            slots[span] += 1
+            self.w1c_en[span] |= np.uint32(bit)
+        self._w1c_bits = np.stack(en_bits, axis=1) if en_bits else np.zeros((total, 0), dtype=np.uint32)
+        self._w1c_masks = np.stack(en_masks, axis=1) if en_masks else np.zeros((total, 0), dtype=np.uint32)
+        self._order = np.argsort(self.addr, kind='stable')
+        self._sorted_addr = self.addr[self._order]
+        self.reset()
+
+    @classmethod
+    def from_file(cls, filename, parallel=False):
+        # Any input gen_reg.py reads; parallel models the -p code
+        module_info, registers = gen_reg.parse_input(filename, parallel=parallel)
+        return cls(module_info, registers)
+
+    def reset(self):
+        """Apply rst_n: every field back to its default."""
+        self.state = self.reset_value & self.stored
+        self.hw_input = self.reset_value & self.ro
+
+    def __len__(self):
+        return len(self.addr)
+
+    def address(self, reg_name, index=0):
+        base, count = self.registers[reg_name]
+        if not 0 <= index < count:
+            raise IndexError(f"Register '{reg_name}' has {count} element(s), no index {index}")
+        return int(self.addr[base + index])
+
+    def instances(self, addr):
+        """Instance index of every address in addr, -1 where nothing is mapped."""
+        addr = np.asarray(addr, dtype=np.uint64) & np.uint64((1 << self.addr_width) - 1)
+        if not len(self._sorted_addr):
+            return np.full(addr.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_addr, addr), len(self._sorted_addr) - 1)
+        hit = self._sorted_addr[pos] == addr
+        return np.where(hit, self._order[pos], -1)
+
+    def field(self, name, index=0):
+        """Current value of a field, RO fields give their hardware input."""
+        first, count, lsb, width, sw_access = self.fields[name]
+        if not 0 <= index < count:
+            raise IndexError(f"Field '{name}' has {count} element(s), no index {index}")
+        word = self.hw_input if sw_access == "RO" else self.state
+        return int(word[first + index] >> np.uint32(lsb)) & ((1 << width) - 1)
+
+    def run(self, addr, write, wr_data=None, wr_msk=None, hw_en=None, hw_val=None):
+        """Apply a batch of transactions in order and return (rd_data, pulse).
+
+        All arguments are arrays of one entry per transaction (scalars are
+        broadcast): addr, write (bool, a read otherwise), wr_data, wr_msk
+        (4 bit byte mask, default 0xf), hw_en (default 0) and hw_val. hw_en
+        holds the enable of each W1C field at the field's lsb, loading the
+        whole field from hw_val, and the RO input bits that take hw_val, all
+        in the same cycle. rd_data is the
+        expected read data of the reads (0 for writes), pulse the W1P bits
+        driven by the writes.
+
+        Transactions to different registers are independent, so the batch is
+        applied in rounds: round k applies the k-th transaction of every
+        register at once. The number of rounds is the largest number of
+        transactions hitting one register.
+        """
+        addr = np.atleast_1d(np.asarray(addr, dtype=np.uint64))
+        n = len(addr)
+        write = np.broadcast_to(np.asarray(write, dtype=bool), (n,))
+        wr_data = np.broadcast_to(np.asarray(0 if wr_data is None else wr_data, dtype=np.uint32), (n,))
+        msk = BYTE_MASKS[np.broadcast_to(np.asarray(0xf if wr_msk is None else wr_msk, dtype=np.uint8) & 0xf, (n,))]
+        hw_en = np.broadcast_to(np.asarray(0 if hw_en is None else hw_en, dtype=np.uint32), (n,))
+        hw_val = np.broadcast_to(np.asarray(0 if hw_val is None else hw_val, dtype=np.uint32), (n,))
+        rd_data = np.zeros(n, dtype=np.uint32)
+        pulse = np.zeros(n, dtype=np.uint32)
+
+        inst = self.instances(addr)
+        order = np.argsort(inst, kind='stable')
+        order = order[inst[order] >= 0]
+        if not len(order):
+            return rd_data, pulse
+        # Rank of every transaction among the ones hitting the same register
+        grouped = inst[order]
+        starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        by_round = np.argsort(rank, kind='stable')
+        bounds = np.searchsorted(rank[by_round], np.arange(rank.max() + 2))
+
+        # W1C bits loaded by each transaction, its field enables expanded to the field masks
+        w1c_load = np.zeros(n, dtype=np.uint32)
+        hit = inst >= 0
+        for bits, masks in zip(self._w1c_bits.T, self._w1c_masks.T):
+            w1c_load[hit] |= np.where(hw_en[hit] & bits[inst[hit]], masks[inst[hit]], 0).astype(np.uint32)
+
+        state, hw_input = self.state, self.hw_input
+        for k in range(len(bounds) - 1):
+            t = order[by_round[bounds[k]:bounds[k + 1]]]
+            i = inst[t]
+            en, val = hw_en[t], hw_val[t]
+            # RO inputs are combinational, the read already sees them
+            ro = self.ro[i] & en
+            ro_in = (hw_input[i] & ~ro) | (val & ro)
+            hw_input[i] = ro_in
+            word = state[i]
+            rd_data[t] = np.where(write[t], 0, (word & self.stored[i]) | (ro_in & self.ro[i]))
+
+            data, m, w = wr_data[t] & msk[t], msk[t], write[t]
+            rw, held, w1c = self.rw[i] & m, self.w1p_held[i], self.w1c[i]
+            new = (word & ~rw) | (data & rw)
+            new = (new & ~held) | (data & held)
+            new &= ~(data & w1c)
+            new = np.where(w, new, word)
+            # hw_en has priority over the write on W1C fields
+            load = w1c_load[t]
+            state[i] = (new & ~load) | (val & load)
+            pulse[t] = np.where(w, data & self.w1p_pulse[i], 0)
+        return rd_data, pulse
+
+    def read(self, addr):
+        return int(self.run(addr, False)[0][0])
+
+    def write(self, addr, data, wr_msk=0xf):
+        return int(self.run(addr, True, data, wr_msk)[1][0])
+
+    def random_transactions(self, n, seed=None, write_ratio=0.5, hw_ratio=0.1, unmapped_ratio=0.01):
+        """n random transactions over the mapped addresses as a dict of arrays for run.
+
+        hw_en only sets bits the RTL has inputs for: the enable bit of each
+        W1C field and the RO bits of the addressed register.
+        """
+        rng = np.random.default_rng(seed)
+        target = rng.integers(0, len(self.addr), n) if len(self.addr) else np.zeros(n, dtype=np.intp)
+        addr = self.addr[target] if len(self.addr) else np.zeros(n, dtype=np.uint64)
+        stray = rng.random(n) < unmapped_ratio
+        addr = np.where(stray, rng.integers(0, 1 << self.addr_width, n, dtype=np.uint64), addr)
+        hw = rng.random(n) < hw_ratio
+        hw_bits = (self.w1c_en | self.ro)[target] if len(self.addr) else np.zeros(n, dtype=np.uint32)
+        return {
+            "addr": addr,
+            "write": rng.random(n) < write_ratio,
+            "wr_data": rng.integers(0, 1 << 32, n, dtype=np.uint32),
+            "wr_msk": rng.integers(0, 16, n, dtype=np.uint8),
+            "hw_en": np.where(hw, rng.integers(0, 1 << 32, n, dtype=np.uint32) & hw_bits, 0).astype(np.uint32),
+            "hw_val": rng.integers(0, 1 << 32, n, dtype=np.uint32),
+        }
+
+def _hex_column(values, digits):
+    # (n, digits) ASCII hex of values, vectorized
+    values = np.asarray(values, dtype=np.uint64)
+    shifts = np.arange(digits - 1, -1, -1, dtype=np.uint64) * np.uint64(4)
+    return HEX_DIGITS[((values[:, None] >> shifts) & np.uint64(0xf)).astype(np.intp)]
+
+def write_trace(filename, transactions, rd_data, pulse, addr_width=32):
+    """Write one line per transaction for a testbench to replay and check:
+
+        <R|W> <addr> <wr_data> <wr_msk> <hw_en> <hw_val> <rd_data> <pulse>
+
+    all fields in hex, the enable of a W1C field is the hw_en bit at its lsb.
+    Lines are formatted as NumPy byte arrays.
+    """
+    n = len(rd_data)
+    op = np.where(np.broadcast_to(transactions["write"], (n,)), ord('W'), ord('R')).astype(np.uint8)[:, None]
+    space = np.full((n, 1), ord(' '), dtype=np.uint8)
+    columns = [op]
+    for values, digits in ((transactions["addr"], -(-addr_width // 4)), (transactions.get("wr_data", 0), 8),
+                           (transactions.get("wr_msk", 0xf), 1), (transactions.get("hw_en", 0), 8),
+                           (transactions.get("hw_val", 0), 8), (rd_data, 8), (pulse, 8)):
+        columns += [space, _hex_column(np.broadcast_to(values, (n,)), digits)]
+    columns.append(np.full((n, 1), ord('\n'), dtype=np.uint8))
+    with open(filename, 'wb') as f:
+        f.write(b"// op addr wr_data wr_msk hw_en hw_val rd_data pulse\n")
+        np.concatenate(columns, axis=1).tofile(f)
+
+def write_expected(filename, transactions, rd_data):
+    # Expected read data of the reads only, one word per line for $readmemh
+    reads = ~np.broadcast_to(transactions["write"], (len(rd_data),))
+    lines = np.concatenate([_hex_column(rd_data[reads], 8),
+                            np.full((int(reads.sum()), 1), ord('\n'), dtype=np.uint8)], axis=1)
+    with open(filename, 'wb') as f:
+        lines.tofile(f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run random transactions through the reference model of a register map')
+    parser.add_argument('input', help='Register map, any input gen_reg.py reads')
+    parser.add_argument('-n', '--transactions', type=int, default=100000, help='Number of random transactions. Default by 100000')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable traces')
+    parser.add_argument('--write-ratio', type=float, default=0.5, help='Fraction of writes. Default by 0.5')
+    parser.add_argument('--hw-ratio', type=float, default=0.1, help='Fraction of transactions with a hardware update. Default by 0.1')
+    parser.add_argument('-p', '--parallel', action='store_true', help='Model the code of gen_reg.py -p')
+    parser.add_argument('--trace', help='Write the transaction trace to this file')
+    parser.add_argument('--expected', help='Write the expected read data ($readmemh) to this file')
+    args = parser.parse_args()
+
+    model = RegisterModel.from_file(args.input, parallel=args.parallel)
+    transactions = model.random_transactions(args.transactions, seed=args.seed, write_ratio=args.write_ratio,
+                                             hw_ratio=args.hw_ratio)
+    start = time.perf_counter()
+    rd_data, pulse = model.run(**transactions)
+    elapsed = time.perf_counter() - start
+    print(f"{args.transactions} transactions on {len(model)} register instance(s) in {elapsed:.3f}s "
+          f"({args.transactions / max(elapsed, 1e-9) / 1e6:.2f} M/s)")
+    if args.trace:
+        write_trace(args.trace, transactions, rd_data, pulse, model.addr_width)
+        print(f"Trace written to {args.trace}")
+    if args.expected:
+        write_expected(args.expected, transactions, rd_data)
+        print(f"Expected read data written to {args.expected}")
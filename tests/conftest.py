@@ -0,0 +1,54 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gen_reg  # noqa: E402
+
+def make_sheet_rows(module, registers, size="4KB", cfg_interface="regbus"):
+    """Rows of a register sheet as parse_excel_rows reads them.
+
+    registers is a list of (offset, reg_name, fields), fields a list of
+    (bits, field, sw_access, default).
+    """
+    rows = [["module", module], ["owner", "test"], ["size", size], ["cfg_interface", cfg_interface],
+            ["base_addr", "32'h0000"], ["addr_width", 12], ["data_width", "data_width"],
+            ["template_version", "v0p0"], ["tool_version", "v0p0"], list(gen_reg.REG_SHEET_HEADER)]
+    for offset, reg_name, fields in registers:
+        for n, (bits, field, sw_access, default) in enumerate(fields):
+            rows.append([offset if n == 0 else None, reg_name if n == 0 else None, bits, field,
+                         sw_access, "RO", default, None, None])
+    return rows
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+    return path
+
+def make_workbook(path, sheets):
+    """Save the sheets, a list of (title, rows), as an xlsx workbook."""
+    openpyxl = pytest.importorskip("openpyxl")
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for title, rows in sheets:
+        ws = wb.create_sheet(title)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+    return path
+
+@pytest.fixture
+def sheet_rows():
+    return make_sheet_rows
+
+@pytest.fixture
+def no_pool(monkeypatch):
+    """Fail the test if the code under test opens a process pool."""
+    import concurrent.futures
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("batch worker opened a process pool")
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_pool)
@@ -0,0 +1,471 @@
+"""Cycle based evaluator for the Verilog subset gen_reg.py writes.
+
+Enough to drive a generated register block from the tests without a
+simulator: continuous assigns, always @(*) and clocked always blocks with
+begin/if/case/for statements, and generate for loops. Vectors are Python
+ints, unpacked arrays lists of ints; there are no x/z values, reading an
+array out of its range raises IndexError. Module instances are not
+supported.
+"""
+
+import re
+
+TOKEN = re.compile(r"""\s*(?:
+        (?P<sized>(\d+)'[sS]?([bBoOdDhH])([0-9a-fA-F_]+))
+      | (?P<number>\d+)
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<op><=|>=|==|!=|&&|\|\||[-+*~!&|^(){}\[\]:;,=<>?@.\#])
+    )""", re.VERBOSE)
+RADIX = {'b': 2, 'o': 8, 'd': 10, 'h': 16}
+DECL_WORDS = {"input", "output", "inout", "reg", "wire", "integer", "genvar", "signed"}
+# Binary operators, lowest precedence first
+BINARY = [("||",), ("&&",), ("|",), ("^",), ("&",), ("==", "!="), ("<", "<=", ">", ">="), ("+", "-"), ("*",)]
+
+def tokenize(text):
+    text = re.sub(r"//[^\n]*", "", text)
+    tokens, pos = [], 0
+    while text[pos:].strip():
+        match = TOKEN.match(text, pos)
+        if not match:
+            raise SyntaxError(f"Unexpected text: {text[pos:pos + 40]!r}")
+        if match.group("sized"):
+            tokens.append(("num", int(match.group(4).replace('_', ''), RADIX[match.group(3).lower()]),
+                           int(match.group(2))))
+        elif match.group("number"):
+            tokens.append(("num", int(match.group("number")), 32))
+        elif match.group("name"):
+            tokens.append(("name", match.group("name")))
+        else:
+            tokens.append(("op", match.group("op")))
+        pos = match.end()
+    return tokens
+
+def mask(width):
+    return (1 << width) - 1
+
+class Rtl:
+    """One generated module, see tokenize for the subset.
+
+    Set inputs (and, to skip the write path, registers) with rtl[name] =
+    value, then clock() runs one rising clock edge and reset() the reset.
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.width = {}     # signal -> vector width
+        self.values = {}    # signal -> int, or list of int for an unpacked array
+        self.inputs = []
+        self.comb = []      # (kind, node, genvar env) evaluated until stable
+        self.seq = []       # statements of the clocked always blocks
+        self._module()
+        self.settle()
+
+    # Parser
+    def peek(self, offset=0):
+        pos = self.pos + offset
+        return self.tokens[pos][1] if pos < len(self.tokens) and self.tokens[pos][0] != "num" else None
+
+    def take(self, expected=None):
+        token = self.tokens[self.pos]
+        if expected is not None and token[1] != expected:
+            raise SyntaxError(f"Expected '{expected}', got {token}")
+        self.pos += 1
+        return token
+
+    def _module(self):
+        self.take("module")
+        self.take()
+        self.take("(")
+        while self.peek() != ")":
+            direction = self.peek()
+            self._declare(port=True)
+            if direction == "input":
+                self.inputs.append(self._last_declared)
+            if self.peek() == ",":
+                self.take(",")
+        self.take(")")
+        self.take(";")
+        self._elaborate(self._items({"endmodule"}), {})
+
+    def _range(self):
+        self.take("[")
+        msb = self._const()
+        self.take(":")
+        lsb = self._const()
+        self.take("]")
+        return msb, lsb
+
+    def _const(self):
+        return self.eval(self._expr(), {})
+
+    def _declare(self, port=False):
+        while self.peek() in DECL_WORDS:
+            width = 32 if self.take()[1] == "integer" else 1
+        if self.peek() == "[":
+            msb, lsb = self._range()
+            width = abs(msb - lsb) + 1
+        while True:
+            name = self.take()[1]
+            self.width[name] = width
+            self.values[name] = 0
+            if self.peek() == "[":
+                first, last = self._range()
+                self.values[name] = [0] * (max(first, last) + 1)
+            self._last_declared = name
+            if port or self.peek() != ",":
+                break
+            self.take(",")
+        if not port:
+            self.take(";")
+
+    def _items(self, end):
+        # Module items up to and including the end keyword
+        items = []
+        while self.peek() not in end:
+            word = self.peek()
+            if word in DECL_WORDS:
+                self._declare()
+            elif word == "assign":
+                self.take()
+                lhs = self._lvalue()
+                self.take("=")
+                items.append(("assign", lhs, self._expr()))
+                self.take(";")
+            elif word == "always":
+                self.take()
+                self.take("@")
+                self.take("(")
+                sensitivity = []
+                while self.peek() != ")":
+                    sensitivity.append(self.take()[1])
+                self.take(")")
+                items.append(("always", "posedge" in sensitivity, self._statement()))
+            elif word == "generate":
+                self.take()
+                items += self._items({"endgenerate"})
+            elif word == "for":
+                items.append(("genfor",) + self._for_header() + (self._generate_block(),))
+            else:
+                raise SyntaxError(f"Unsupported module item at {self.tokens[self.pos:self.pos + 5]}")
+        self.take()
+        return items
+
+    def _generate_block(self):
+        self.take("begin")
+        if self.peek() == ":":
+            self.take(":")
+            self.take()
+        return self._items({"end"})
+
+    def _for_header(self):
+        # for (var = init; cond; var = step), returns (var, init, cond, step)
+        self.take("for")
+        self.take("(")
+        var = self.take()[1]
+        self.take("=")
+        init = self._expr()
+        self.take(";")
+        cond = self._expr()
+        self.take(";")
+        self.take(var)
+        self.take("=")
+        step = self._expr()
+        self.take(")")
+        return var, init, cond, step
+
+    def _statement(self):
+        word = self.peek()
+        if word == "begin":
+            self.take()
+            if self.peek() == ":":
+                self.take(":")
+                self.take()
+            body = []
+            while self.peek() != "end":
+                body.append(self._statement())
+            self.take("end")
+            return ("block", body)
+        if word == "if":
+            self.take()
+            self.take("(")
+            cond = self._expr()
+            self.take(")")
+            then = self._statement()
+            otherwise = None
+            if self.peek() == "else":
+                self.take()
+                otherwise = self._statement()
+            return ("if", cond, then, otherwise)
+        if word == "case":
+            self.take()
+            self.take("(")
+            subject = self._expr()
+            self.take(")")
+            items, default = [], None
+            while self.peek() != "endcase":
+                if self.peek() == "default":
+                    self.take()
+                    if self.peek() == ":":
+                        self.take(":")
+                    default = self._statement()
+                    continue
+                labels = [self._expr()]
+                while self.peek() == ",":
+                    self.take(",")
+                    labels.append(self._expr())
+                self.take(":")
+                items.append((labels, self._statement()))
+            self.take("endcase")
+            return ("case", subject, items, default)
+        if word == "for":
+            return ("for",) + self._for_header() + (self._statement(),)
+        lhs = self._lvalue()
+        op = self.take()[1]
+        if op not in ("=", "<="):
+            raise SyntaxError(f"Expected an assignment to {lhs[0]}")
+        value = self._expr()
+        self.take(";")
+        return ("store", lhs, value, op == "<=")
+
+    def _lvalue(self):
+        name = self.take()[1]
+        selects = []
+        while self.peek() == "[":
+            selects.append(self._select())
+        return name, selects
+
+    def _select(self):
+        self.take("[")
+        first = self._expr()
+        if self.peek() == ":":
+            self.take(":")
+            last = self._expr()
+            self.take("]")
+            return ("range", first, last)
+        self.take("]")
+        return ("index", first)
+
+    def _expr(self):
+        cond = self._binary(0)
+        if self.peek() == "?":
+            self.take("?")
+            then = self._expr()
+            self.take(":")
+            return ("?", cond, then, self._expr())
+        return cond
+
+    def _binary(self, level):
+        if level == len(BINARY):
+            return self._unary()
+        node = self._binary(level + 1)
+        while self.peek() in BINARY[level]:
+            op = self.take()[1]
+            node = ("bin", op, node, self._binary(level + 1))
+        return node
+
+    def _unary(self):
+        if self.peek() in ("~", "!", "-"):
+            op = self.take()[1]
+            return ("un", op, self._unary())
+        return self._primary()
+
+    def _primary(self):
+        token = self.take()
+        if token[0] == "num":
+            return ("num", token[1], token[2])
+        if token[1] == "(":
+            node = self._expr()
+            self.take(")")
+            return node
+        if token[1] == "{":
+            first = self._expr()
+            if self.peek() == "{":
+                inner = self._primary()
+                self.take("}")
+                return ("repeat", first, inner)
+            parts = [first]
+            while self.peek() == ",":
+                self.take(",")
+                parts.append(self._expr())
+            self.take("}")
+            return ("concat", parts)
+        if token[0] == "name":
+            node = ("id", token[1])
+            while self.peek() == "[":
+                node = ("select", node, self._select())
+            return node
+        raise SyntaxError(f"Unexpected {token}")
+
+    def _elaborate(self, items, env):
+        # Unroll the generate loops, every item keeps its genvar values
+        for item in items:
+            if item[0] == "genfor":
+                _, var, init, cond, step, body = item
+                local = dict(env, **{var: self.eval(init, env)})
+                while self.eval(cond, local):
+                    self._elaborate(body, local)
+                    local = dict(local, **{var: self.eval(step, local)})
+            elif item[0] == "always" and item[1]:
+                self.seq.append((item[2], env))
+            else:
+                self.comb.append((item, env))
+
+    # Evaluation
+    def eval(self, node, env):
+        kind = node[0]
+        if kind == "num":
+            return node[1]
+        if kind == "id":
+            return env[node[1]] if node[1] in env else self.values[node[1]]
+        if kind == "select":
+            value = self.eval(node[1], env)
+            select = node[2]
+            if select[0] == "index":
+                index = self.eval(select[1], env)
+                if isinstance(value, list):
+                    return value[index]
+                return value >> index & 1
+            msb, lsb = self.eval(select[1], env), self.eval(select[2], env)
+            return value >> lsb & mask(msb - lsb + 1)
+        if kind == "un":
+            value = self.eval(node[2], env)
+            if node[1] == "~":
+                return ~value & mask(self.width_of(node[2], env))
+            return int(not value) if node[1] == "!" else -value
+        if kind == "bin":
+            a, b = self.eval(node[2], env), self.eval(node[3], env)
+            return BINARY_OPS[node[1]](a, b)
+        if kind == "?":
+            return self.eval(node[2] if self.eval(node[1], env) else node[3], env)
+        if kind == "concat":
+            value = 0
+            for part in node[1]:
+                value = value << self.width_of(part, env) | self.eval(part, env)
+            return value
+        if kind == "repeat":
+            width = self.width_of(node[2], env)
+            part = self.eval(node[2], env) & mask(width)
+            return sum(part << (width * n) for n in range(self.eval(node[1], env)))
+        raise ValueError(f"Unknown node {node}")
+
+    def width_of(self, node, env):
+        kind = node[0]
+        if kind == "num":
+            return node[2]
+        if kind == "id":
+            return 32 if node[1] in env else self.width[node[1]]
+        if kind == "select":
+            select = node[2]
+            if select[0] == "range":
+                return self.eval(select[1], env) - self.eval(select[2], env) + 1
+            return self.width_of(node[1], env) if isinstance(self.eval(node[1], env), list) else 1
+        if kind == "un":
+            return 1 if node[1] == "!" else self.width_of(node[2], env)
+        if kind == "bin":
+            if node[1] in ("==", "!=", "<", "<=", ">", ">=", "&&", "||"):
+                return 1
+            return max(self.width_of(node[2], env), self.width_of(node[3], env))
+        if kind == "?":
+            return max(self.width_of(node[2], env), self.width_of(node[3], env))
+        if kind == "concat":
+            return sum(self.width_of(part, env) for part in node[1])
+        if kind == "repeat":
+            return self.eval(node[1], env) * self.width_of(node[2], env)
+        raise ValueError(f"Unknown node {node}")
+
+    def _store(self, lhs, value, env, pending):
+        name, selects = lhs
+        indexes = [(select[0],) + tuple(self.eval(part, env) for part in select[1:]) for select in selects]
+        if pending is not None:
+            pending.append((name, indexes, value))
+        else:
+            self.values[name] = self._update(self.values[name], indexes, value, self.width[name])
+
+    def _update(self, current, indexes, value, width):
+        if not indexes:
+            return value & mask(width)
+        select = indexes[0]
+        if isinstance(current, list):
+            updated = list(current)
+            updated[select[1]] = self._update(current[select[1]], indexes[1:], value, width)
+            return updated
+        msb, lsb = (select[1], select[1]) if select[0] == "index" else select[1:]
+        bits = mask(msb - lsb + 1) << lsb
+        return (current & ~bits) | (value << lsb & bits)
+
+    def _run(self, statement, env, pending):
+        kind = statement[0]
+        if kind == "block":
+            for inner in statement[1]:
+                self._run(inner, env, pending)
+        elif kind == "if":
+            if self.eval(statement[1], env):
+                self._run(statement[2], env, pending)
+            elif statement[3] is not None:
+                self._run(statement[3], env, pending)
+        elif kind == "case":
+            subject = self.eval(statement[1], env)
+            for labels, body in statement[2]:
+                if any(self.eval(label, env) == subject for label in labels):
+                    self._run(body, env, pending)
+                    break
+            else:
+                if statement[3] is not None:
+                    self._run(statement[3], env, pending)
+        elif kind == "for":
+            _, var, init, cond, step, body = statement
+            local = dict(env, **{var: self.eval(init, env)})
+            while self.eval(cond, local):
+                self._run(body, local, pending)
+                local[var] = self.eval(step, local)
+        else:
+            _, lhs, value, nonblocking = statement
+            self._store(lhs, self.eval(value, env), env, pending if nonblocking else None)
+
+    # Simulation
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def __setitem__(self, name, value):
+        if name not in self.values:
+            raise KeyError(f"No signal '{name}'")
+        self.values[name] = value
+
+    def settle(self):
+        for _ in range(100):
+            before = dict(self.values)
+            for item, env in self.comb:
+                if item[0] == "assign":
+                    self._store(item[1], self.eval(item[2], env), env, None)
+                else:
+                    self._run(item[2], env, None)
+            if self.values == before:
+                return
+        raise RuntimeError("The combinational logic does not settle")
+
+    def clock(self, **inputs):
+        """Set inputs, then run one rising edge of clk."""
+        for name, value in inputs.items():
+            self[name] = value
+        self.settle()
+        pending = []
+        for statement, env in self.seq:
+            self._run(statement, env, pending)
+        for name, indexes, value in pending:
+            self.values[name] = self._update(self.values[name], indexes, value, self.width[name])
+        self.settle()
+
+    def reset(self):
+        self.clock(rst_n=0)
+        self["rst_n"] = 1
+        self.settle()
+
+BINARY_OPS = {
+    "||": lambda a, b: int(bool(a) or bool(b)), "&&": lambda a, b: int(bool(a) and bool(b)),
+    "|": lambda a, b: a | b, "^": lambda a, b: a ^ b, "&": lambda a, b: a & b,
+    "==": lambda a, b: int(a == b), "!=": lambda a, b: int(a != b),
+    "<": lambda a, b: int(a < b), "<=": lambda a, b: int(a <= b),
+    ">": lambda a, b: int(a > b), ">=": lambda a, b: int(a >= b),
+    "+": lambda a, b: a + b, "-": lambda a, b: a - b, "*": lambda a, b: a * b,
+}
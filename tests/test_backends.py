@@ -0,0 +1,109 @@
+import html.parser
+import io
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import gen_reg
+
+from conftest import make_sheet_rows
+
+BACKEND_MAP = [("0x0", "CTRL", [("31:16", "mode", "RW", "16'h1234"), ("0", "en", "RW", "1'b1")]),
+               ("0x4", "STS", [("7:0", "sts", "RO", "8'h5a")]),
+               ("0x8", "IRQ", [("3:0", "irq", "W1C", "4'h0"), ("8", "go", "W1P", "1'b0")]),
+               ("0x100+i*0x8", "ARR", [("15:0", "val", "RW", "16'habcd")])]
+
+# (register, field, lsb, width, access, reset) of BACKEND_MAP
+FIELDS = [("CTRL", "mode", 16, 16, "RW", 0x1234), ("CTRL", "en", 0, 1, "RW", 1), ("STS", "sts", 0, 8, "RO", 0x5a),
+          ("IRQ", "irq", 0, 4, "W1C", 0), ("IRQ", "go", 8, 1, "W1P", 0), ("ARR", "val", 0, 16, "RW", 0xabcd)]
+
+def render(backend):
+    module_info, registers = gen_reg.parse_excel_rows(make_sheet_rows("blk", BACKEND_MAP), {"i": 5}, "blk.xlsx")
+    suffix, writer = gen_reg.BACKENDS[backend]
+    f = io.StringIO()
+    writer(f, module_info, registers, "blk" + suffix, created="-")
+    return f.getvalue()
+
+def test_c_header_macros():
+    macros = dict(re.findall(r"^#define (\w+(?:\(i\))?) (.+)$", render("c"), re.M))
+    assert macros["BLK_BASE_ADDR"] == "0x00000000u"
+    assert macros["BLK_CTRL_OFFSET"] == "0x000u"
+    assert macros["BLK_STS_OFFSET"] == "0x004u"
+    assert macros["BLK_IRQ_OFFSET"] == "0x008u"
+    assert macros["BLK_ARR_COUNT"] == "6u"
+    assert macros["BLK_ARR_STRIDE"] == "0x8u"
+    assert macros["BLK_ARR_OFFSET(i)"] == "(0x100u + (i) * BLK_ARR_STRIDE)"
+    assert "BLK_ARR_OFFSET" not in macros
+    for reg, field, lsb, width, _, reset in FIELDS:
+        name = f"BLK_{reg}_{field.upper()}"
+        assert macros[f"{name}_SHIFT"] == str(lsb)
+        assert macros[f"{name}_WIDTH"] == str(width)
+        assert int(macros[f"{name}_MASK"].rstrip("u"), 16) == ((1 << width) - 1) << lsb
+        assert int(macros[f"{name}_RESET"].rstrip("u"), 16) == reset
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="needs a C compiler")
+def test_c_header_compiles(tmp_path):
+    (tmp_path / "blk.h").write_text(render("c"))
+    (tmp_path / "main.c").write_text(
+        '#include <stdio.h>\n#include "blk.h"\n#include "blk.h"\n'
+        'int main(void) {\n'
+        '    printf("%x %x %x %x\\n", BLK_IRQ_ADDR, BLK_ARR_ADDR(5), BLK_CTRL_MODE_MASK, BLK_IRQ_GO_MASK);\n'
+        '    return 0;\n}\n')
+    subprocess.run(["cc", "-Wall", "-Werror", "-o", str(tmp_path / "main"), str(tmp_path / "main.c")], check=True)
+    out = subprocess.run([str(tmp_path / "main")], capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["8", "128", "ffff0000", "100"]
+
+def test_uvm_ral_fields_and_map():
+    text = render("uvm")
+    configure = {m[0]: m[1:] for m in re.findall(
+        r'(\w+)\.configure\(this, (\d+), (\d+), "(\w+)", (\d), \'h(\w+), 1, (\d), 0\);', text)}
+    for _, field, lsb, width, access, reset in FIELDS:
+        size, shift, policy, volatile, value, is_rand = configure[field]
+        assert (int(size), int(shift), int(value, 16)) == (width, lsb, reset)
+        assert policy == gen_reg.UVM_ACCESS[access]
+        assert volatile == ("1" if access in ("RO", "W1C") else "0")
+        assert is_rand == ("1" if access == "RW" else "0")
+    assert re.findall(r"default_map\.add_reg\((.+)\);", text) == [
+        'ctrl, 12\'h0, "RW"', 'sts, 12\'h4, "RO"', 'irq, 12\'h8, "RW"', 'arr[i], 12\'h100 + i * 12\'h8, "RW"']
+    assert "rand blk_arr arr[6];" in text
+
+class TableParser(html.parser.HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.cell = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self.rows.append([])
+        elif tag in ("td", "th"):
+            self.rows[-1].append("")
+            self.cell = True
+
+    def handle_endtag(self, tag):
+        self.cell = self.cell and tag not in ("td", "th")
+
+    def handle_data(self, data):
+        if self.cell:
+            self.rows[-1][-1] += data
+
+DOC_TABLE = [list(gen_reg.DOC_COLUMNS),
+             ["0x000", "CTRL", "[31:16]", "mode", "RW", "16'h1234"],
+             ["", "", "[0]", "en", "RW", "1'b1"],
+             ["0x004", "STS", "[7:0]", "sts", "RO", "8'h5a"],
+             ["0x008", "IRQ", "[3:0]", "irq", "W1C", "4'h0"],
+             ["", "", "[8]", "go", "W1P", "1'b0"],
+             ["0x100 + i*0x8 (i = 0..5)", "ARR", "[15:0]", "val", "RW", "16'habcd"]]
+
+def test_markdown_table():
+    lines = [line for line in render("md").splitlines() if line.startswith("|")]
+    assert lines[1] == "|---|---|---|---|---|---|"
+    rows = [[cell.strip() for cell in line.strip("|").split(" | ")] for line in lines[:1] + lines[2:]]
+    assert rows == DOC_TABLE
+
+def test_html_table():
+    parser = TableParser()
+    parser.feed(render("html"))
+    assert parser.rows == DOC_TABLE
@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import bench_reg
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench_reg.py")
+SHAPE = ["--registers", "8", "--fields", "2", "--arrays", "1", "--var-range", "4", "--repeat", "1"]
+
+def run_bench(*args):
+    return subprocess.run([sys.executable, BENCH] + list(args), capture_output=True, text=True)
+
+def test_a_baseline_of_another_config_is_refused(tmp_path):
+    pytest.importorskip("openpyxl")
+    baseline = tmp_path / "baseline.json"
+    assert run_bench(*SHAPE, "-o", str(baseline)).returncode == 0
+    assert run_bench(*SHAPE, "--baseline", str(baseline), "--tolerance", "100").returncode == 0
+
+    result = run_bench(*SHAPE[:1], "16", *SHAPE[2:], "--baseline", str(baseline))
+    assert result.returncode == 2
+    assert "was measured with {'registers': 8," in result.stderr
+    assert "Traceback" not in result.stderr
+    assert "Built" not in result.stdout  # stopped before the benchmark
+
+    baseline.write_text("{")
+    result = run_bench(*SHAPE, "--baseline", str(baseline))
+    assert result.returncode == 2 and "can not read baseline" in result.stderr
+
+def test_compare_reports_the_stages_over_tolerance():
+    config = {"registers": 8}
+    baseline = {"config": config, "results": {"parse": {"seconds": 1.0, "peak_mib": 10.0},
+                                              "generate": {"seconds": 1.0, "peak_mib": 10.0}}}
+    current = {"config": config, "results": {"parse": {"seconds": 1.1, "peak_mib": 13.0},
+                                             "generate": {"seconds": 1.5, "peak_mib": 10.0}}}
+    assert bench_reg.compare(current, baseline, 0.2) == ["parse peak_mib: 13.0 > baseline 10.0 (+30%)",
+                                                         "generate seconds: 1.5 > baseline 1.0 (+50%)"]
+    with pytest.raises(ValueError, match="does not match"):
+        bench_reg.compare(dict(current, config={"registers": 16}), baseline, 0.2)
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import gen_reg
+
+from conftest import make_sheet_rows, write_csv
+
+REGISTERS = [("0x0", "CTRL", [("31:8", "ctrl", "RW", "24'h0"), ("7:0", "mode", "W1C", "8'h0")]),
+             ("0x100+i*0x4", "ARR", [("15:0", "arr", "RW", "16'h0")])]
+
+@pytest.fixture
+def source(tmp_path):
+    write_csv(tmp_path / "blk.var.csv", [("name", "range"), ("i", "0~3")])
+    return str(write_csv(tmp_path / "blk.csv", make_sheet_rows("blk", REGISTERS)))
+
+@pytest.fixture
+def parses(monkeypatch):
+    # Number of times an input was parsed, a cache hit parses nothing
+    calls = []
+    parse = gen_reg.parse_input_modules
+
+    def counting(*args, **kwargs):
+        calls.append(args[0])
+        return parse(*args, **kwargs)
+    monkeypatch.setattr(gen_reg, "parse_input_modules", counting)
+    return calls
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def test_cache_hit_restores_the_same_bytes(source, tmp_path, parses):
+    options = dict(out_dir=str(tmp_path / "out"), cache_dir=str(tmp_path / "cache"), backends=("verilog", "c"))
+    output_files, status = gen_reg.gen_reg_file(source, **options)
+    assert status == 'generated' and len(parses) == 1
+    generated = [read(name) for name in output_files]
+    for name in output_files:
+        os.remove(name)
+    assert gen_reg.gen_reg_file(source, **options) == (output_files, 'cached')
+    assert len(parses) == 1
+    assert [read(name) for name in output_files] == generated
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_reproducible_output_keeps_its_mtime(source, tmp_path, cache):
+    options = dict(out_dir=str(tmp_path / "out"), reproducible=True,
+                   cache_dir=str(tmp_path / "cache") if cache else None)
+    (output_file,), status = gen_reg.gen_reg_file(source, **options)
+    assert status == 'generated'
+    content = read(output_file)
+    os.utime(output_file, ns=(10**18, 10**18))
+    assert gen_reg.gen_reg_file(source, **options) == ([output_file], 'unchanged')
+    assert os.stat(output_file).st_mtime_ns == 10**18
+    assert read(output_file) == content
+    # The header names the source, not the time of the run
+    assert b"// Created           : source sha256 " in content
+
+@pytest.mark.parametrize("change", [dict(parallel=True), dict(backends=("verilog", "md")), dict(rd_stages=1),
+                                    dict(index_decode=True), dict(partition=(4, None))])
+def test_changed_options_miss_the_cache(source, tmp_path, parses, change):
+    options = dict(out_dir=str(tmp_path / "out"), cache_dir=str(tmp_path / "cache"), reproducible=True)
+    gen_reg.gen_reg_file(source, **options)
+    assert gen_reg.gen_reg_file(source, **options)[1] == 'unchanged'
+    assert len(parses) == 1
+    output_files, status = gen_reg.gen_reg_file(source, **dict(options, **change))
+    assert len(parses) == 2
+    # and hits once stored
+    assert gen_reg.gen_reg_file(source, **dict(options, **change)) == (output_files, 'unchanged')
+    assert len(parses) == 2
+
+def test_changed_source_misses_the_cache(source, tmp_path, parses):
+    options = dict(out_dir=str(tmp_path / "out"), cache_dir=str(tmp_path / "cache"))
+    (output_file,), _ = gen_reg.gen_reg_file(source, **options)
+    write_csv(source, make_sheet_rows("blk", REGISTERS + [("0x8", "NEW", [("0", "new", "RW", "1'b0")])]))
+    assert gen_reg.gen_reg_file(source, **options)[1] == 'generated'
+    assert len(parses) == 2
+    assert b"wr_en_NEW" in read(output_file)
@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+import gen_reg
+
+from conftest import make_workbook, write_csv
+
+def parse_rows(rows, var_ranges=None, filename="blk.xlsx", parallel=False):
+    module_info, registers = gen_reg.parse_excel_rows(rows, var_ranges or {}, filename)
+    return module_info, gen_reg.expand_registers(registers) if parallel else registers
+
+def test_header_filename_is_the_output_basename(sheet_rows):
+    module_info, registers = parse_rows(sheet_rows("blk", [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")])]))
+    for filename in ("blk", "blk.v", "out/part/blk.v"):
+        f = io.StringIO()
+        gen_reg.write_verilog(f, module_info, registers, filename, created="-")
+        assert "// Filename          : blk.v\n" in f.getvalue()
+
+def _array_map(sheet_rows, var_range):
+    rows = sheet_rows("blk", [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")]),
+                              ("0x10000+i*0x4", "ARR", [("31:16", "a_hi", "RW", "16'h0"),
+                                                        ("15:0", "a_lo", "W1C", "16'h0")])], size="128KB")
+    rows[5][1] = 17  # addr_width
+    return parse_rows(rows, {"i": var_range - 1}, parallel=True)
+
+def _generate_peak(module_info, registers):
+    tracemalloc.start()
+    try:
+        with open(os.devnull, 'w') as f:
+            gen_reg.write_verilog(f, module_info, registers, "blk", created="-")
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_parallel_generation_memory_does_not_grow_with_the_array_range(sheet_rows):
+    small = _generate_peak(*_array_map(sheet_rows, 256))
+    module_info, registers = _array_map(sheet_rows, 2048)
+    assert isinstance(registers, gen_reg.ExpandedRegisters)
+    large = _generate_peak(module_info, registers)
+    # Only the writer's chunk buffer is held, not the 2048 instances
+    assert large < 2 * 2**20
+    assert large < small + 2**20
+
+def test_lazy_view_generates_the_same_verilog_as_the_expanded_list(sheet_rows):
+    module_info, registers = _array_map(sheet_rows, 8)
+    lazy, expanded = io.StringIO(), io.StringIO()
+    gen_reg.write_verilog(lazy, module_info, registers, "blk", created="-")
+    gen_reg.write_verilog(expanded, module_info, list(registers), "blk", created="-")
+    assert lazy.getvalue() == expanded.getvalue()
+
+def test_batch_workers_do_not_open_nested_pools(sheet_rows, tmp_path, monkeypatch, no_pool):
+    registers = [(f"0x{n * 0x100:x}", f"R{n}", [("31:0", f"r{n}", "RW", "32'h0")]) for n in range(8)]
+    write_csv(tmp_path / "blk.csv", sheet_rows("blk", registers))
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    input_file, output_files, status, error, _ = gen_reg._batch_job(
+        str(tmp_path / "blk.csv"), dict(out_dir=str(tmp_path / "out"), partition=(2, None)))
+    assert error is None
+    assert len(output_files) == 5  # 4 sub-modules and the top
+
+def test_multi_module_workbook_in_a_batch_worker_is_serial(sheet_rows, tmp_path, monkeypatch, no_pool):
+    openpyxl = pytest.importorskip("openpyxl")
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for module in ("blk_a", "blk_b", "blk_c"):
+        ws = wb.create_sheet(module)
+        for row in sheet_rows(module, [("0x0", "CTRL", [("31:0", f"{module}_ctrl", "RW", "32'h0")])]):
+            ws.append(row)
+    wb.save(tmp_path / "sub.xlsx")
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    input_file, output_files, status, error, _ = gen_reg._batch_job(str(tmp_path / "sub.xlsx"),
+                                                                     dict(out_dir=str(tmp_path / "out")))
+    assert error is None
+    assert sorted(os.path.basename(name) for name in output_files) == ["blk_a.v", "blk_b.v", "blk_c.v"]
+
+@pytest.mark.parametrize("partition, message", [
+    ((4, None), "Array register 'ARR' has 6 elements, more than the partition register limit of 4"),
+    ((None, 16), "Array register 'ARR' crosses a 16 byte partition window")])
+def test_partition_that_can_not_hold_an_array(sheet_rows, partition, message):
+    regs = [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")]),
+            ("0x100+i*0x4", "ARR", [("31:0", "arr", "RW", "32'h0")])]
+    module_info, registers = gen_reg.parse_excel_rows(sheet_rows("blk", regs), {"i": 5}, "blk.xlsx")
+    with pytest.raises(ValueError, match=re.escape(message)):
+        gen_reg.plan_partition(registers, 12, *partition)
+    # A limit of the array's element count takes it in a window of its own
+    assert [len(block) for _, block in gen_reg.plan_partition(registers, 12, 6)[1]] == [1, 1]
+
+def test_unknown_cfg_interface_falls_back_to_regbus(sheet_rows, capsys):
+    regs = [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")])]
+    outputs = []
+    for bus in ("regbus", "ahb"):
+        module_info, registers = parse_rows(sheet_rows("blk", regs, cfg_interface=bus))
+        f = io.StringIO()
+        gen_reg.write_verilog(f, module_info, registers, "blk", created="-")
+        outputs.append(f.getvalue().replace(f"bus_type   = {bus}", "bus_type   = -"))
+    assert outputs[0] == outputs[1]
+    assert "Warning: Unknown cfg_interface 'ahb'" in capsys.readouterr().out
+
+def test_lint_reports_an_unknown_cfg_interface(sheet_rows, tmp_path):
+    regs = [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")])]
+    write_csv(tmp_path / "blk.csv", sheet_rows("blk", regs, cfg_interface="ahb"))
+    errors = gen_reg.lint_input(str(tmp_path / "blk.csv")).errors
+    assert [(item.row, item.column, item.message) for item in errors] == \
+        [(4, 'B', "Unknown cfg_interface 'ahb', expected regbus, apb or axi4lite")]
+
+@pytest.mark.parametrize("rd_stages", [0, 2])
+def test_axi4lite_ready_outputs_do_not_depend_on_inputs(sheet_rows, rd_stages):
+    regs = [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")])]
+    module_info, registers = parse_rows(sheet_rows("blk", regs, cfg_interface="axi4lite"))
+    f = io.StringIO()
+    gen_reg.write_verilog(f, module_info, registers, "blk", created="-", rd_stages=rd_stages)
+    assigns = dict(re.findall(r"^assign (\w+)\s*=(.*);$", f.getvalue(), re.M))
+    inputs = set(re.findall(r"^input\s+(?:\[[^]]*\]\s*)?(\w+),", f.getvalue(), re.M))
+    for output in ("arready", "rvalid", "awready", "wready"):
+        assert not set(re.findall(r"\w+", assigns[output])) & inputs, output
+
+def test_lint_reports_every_error_of_a_field_row(sheet_rows, tmp_path):
+    regs = [("0x0", "CTRL", [("31:8", "ctrl", "RW", "24'h0"), ("40:3", "mode", "XX", "1'b0"),
+                             ("2:0", "ctrl", "BAD", None)])]
+    write_csv(tmp_path / "blk.csv", sheet_rows("blk", regs))
+    errors = gen_reg.lint_input(str(tmp_path / "blk.csv")).errors
+    assert sorted((item.row, item.column, item.message) for item in errors) == [
+        (12, 'C', "Field 'mode' bits [40:3] exceed the 32 bit register 'CTRL'"),
+        (12, 'E', "Invalid sw_access value: XX"),
+        (13, 'D', "Duplicate field name found: ctrl"),
+        (13, 'E', "Invalid sw_access value: BAD"),
+        (13, 'G', "Required column(s) default missing in row 13"),
+    ]
+
+def test_first_field_error_still_raises_without_lint(sheet_rows):
+    regs = [("0x0", "CTRL", [("40:3", "mode", "XX", "1'b0")])]
+    with pytest.raises(ValueError, match="Invalid sw_access value: XX"):
+        parse_rows(sheet_rows("blk", regs))
+
+def test_profile_stages_add_up_to_the_parse(sheet_rows, tmp_path):
+    # In a fresh process, so that the openpyxl import is part of the run
+    path = make_workbook(tmp_path / "blk.xlsx", [("reglist", sheet_rows("blk", [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")])]))])
+    subprocess.run([sys.executable, gen_reg.__file__, str(path), "-d", str(tmp_path / "out"),
+                    "--profile-json", str(tmp_path / "profile.json")], check=True, stdout=subprocess.DEVNULL)
+    with open(tmp_path / "profile.json") as f:
+        report = json.load(f)
+    stages = {name: stage["seconds"] for name, stage in report["stages"].items()}
+    children = sum(seconds for name, seconds in stages.items() if name.count('.') == 1 and name.startswith("parse."))
+    assert stages["parse"] - children < 0.1 * stages["parse"]
+    assert report["memory"] == "process_peak_rss"
+
+# Runs gen_reg.py as a script and prints which of the heavy modules it imported
+IMPORTED = """
+import json, runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps(sorted(name for name in ("numpy", "openpyxl") if name in sys.modules)))
+"""
+
+def imported_modules(*args):
+    result = subprocess.run([sys.executable, "-c", IMPORTED, gen_reg.__file__, *args],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def test_help_and_cache_hit_do_not_import_openpyxl_or_numpy(sheet_rows, tmp_path):
+    assert imported_modules("--help") == []
+    regs = [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")])]
+    source = make_workbook(tmp_path / "blk.xlsx", [("blk", sheet_rows("blk", regs))])
+    args = [str(source), "-r", "-d", str(tmp_path / "out"), "--cache-dir", str(tmp_path / "cache")]
+    assert "openpyxl" in imported_modules(*args)  # the miss reads the workbook
+    assert imported_modules(*args) == []
+    assert os.path.exists(tmp_path / "out" / "blk.v")
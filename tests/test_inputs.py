@@ -0,0 +1,108 @@
+import io
+import json
+import re
+import zipfile
+
+import pytest
+
+import gen_reg
+
+from conftest import make_sheet_rows, make_workbook, write_csv
+
+def set_cached_values(path, values):
+    """Store the value Excel caches next to a formula, openpyxl saves none.
+
+    values maps (sheet file, cell) like ("sheet1", "A12") to the value.
+    """
+    with zipfile.ZipFile(path) as z:
+        items = {name: z.read(name) for name in z.namelist()}
+    for (sheet, ref), value in values.items():
+        name = f"xl/worksheets/{sheet}.xml"
+        kind = ' t="str"' if isinstance(value, str) else ''
+        xml, count = re.subn(rf'<c r="{ref}"([^>]*)><f>(.*?)</f><v ?/>',
+                             lambda m: f'<c r="{ref}"{m.group(1)}{kind}><f>{m.group(2)}</f><v>{value}</v>',
+                             items[name].decode())
+        assert count == 1, ref
+        items[name] = xml.encode()
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, data in items.items():
+            z.writestr(name, data)
+
+def test_streaming_and_full_load_parse_the_same_registers(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    rows = make_sheet_rows("blk", [("0x0", "CTRL", [("31:8", "ctrl", "RW", "24'h0"), ("7:0", "mode", "RW", "8'h3")]),
+                                   ("0x4", "STS", [("31:0", "sts", "RO", "32'h0")]),
+                                   ("0x100+i*0x4", "ARR", [("15:0", "arr", "W1C", "16'h0")])])
+    # Formula cells in the offset, default, description and variable range columns
+    rows[12][0] = '="0x"&"4"'
+    rows[11][6] = '="8\'h"&"5"'
+    rows[13][8] = '=CONCAT("array ", "ARR")'
+    path = make_workbook(tmp_path / "blk.xlsx", [("reglist", rows), ("varlist", [["name", "range"], ["i", '="0~"&7']])])
+    # Trailing empty rows, styled cells only, as an edited sheet keeps them
+    wb = openpyxl.load_workbook(path)
+    for ws, last in ((wb["reglist"], 40), (wb["varlist"], 20)):
+        for row in range(ws.max_row + 1, last + 1):
+            ws.cell(row, 1).font = openpyxl.styles.Font(bold=True)
+    wb.save(path)
+    set_cached_values(path, {("sheet1", "A13"): "0x4", ("sheet1", "G12"): "8'h5",
+                             ("sheet1", "I14"): "array ARR", ("sheet2", "B2"): "0~7"})
+
+    streamed = gen_reg.parse_excel(str(path), read_only=True)
+    loaded = gen_reg.parse_excel(str(path), read_only=False)
+    assert streamed[0] == loaded[0]
+    assert gen_reg.register_signatures(streamed[1]) == gen_reg.register_signatures(loaded[1])
+    # The cached values are used
+    assert [(reg.reg_name, reg.offset, reg.var_val) for reg in streamed[1]] == \
+        [("CTRL", 0x0, None), ("STS", 0x4, None), ("ARR", 0x100, 7)]
+    assert streamed[1][0].fields[1].default == "8'h5"
+    assert gen_reg.generate_verilog(*streamed, "blk", created="-") == \
+        gen_reg.generate_verilog(*loaded, "blk", created="-")
+
+# One map in every front-end, with number cells where a sheet or JSON/YAML may have them
+FRONTEND_MAP = [(0x0, "CTRL", [("31:1", "mode", "RW", "31'h0"), (0, "en0", "RW", "1'b1")]),
+                (0x4, "STS", [("31:16", "cnt", "RO", "16'h0"), (7, "err", "W1C", "1'b0"), (0, "done", "RO", "1'b0")]),
+                ("0x100+i*0x4", "ARR", [("15:0", "arr", "RW", "16'h5")]),
+                (0x1004, "OUT", [("31:0", "out", "RW", "32'h0")])]  # beyond the 4KB size, skipped
+
+def frontend_description(size):
+    return {"module": {"module": "blk", "owner": "test", "size": size, "cfg_interface": "regbus",
+                       "base_addr": "32'h0000", "addr_width": 12},
+            "variables": {"i": "0~3"},
+            "registers": [{"offset": offset, "reg_name": reg_name,
+                           "fields": [dict(zip(("bits", "field", "sw_access", "default"), field)) for field in fields]}
+                          for offset, reg_name, fields in FRONTEND_MAP]}
+
+def write_frontends(tmp_path):
+    rows = make_sheet_rows("blk", [(offset if isinstance(offset, str) else hex(offset), reg_name, fields)
+                                   for offset, reg_name, fields in FRONTEND_MAP])
+    paths = [make_workbook(tmp_path / "blk.xlsx", [("reglist", rows), ("varlist", [["name", "range"], ["i", "0~3"]])])]
+    write_csv(tmp_path / "blk.var.csv", [("name", "range"), ("i", "0~3")])
+    paths.append(write_csv(tmp_path / "blk.csv", rows))
+    (tmp_path / "blk.json").write_text(json.dumps(frontend_description(4096)))
+    paths.append(tmp_path / "blk.json")
+    yaml = pytest.importorskip("yaml")
+    (tmp_path / "blk.yaml").write_text(yaml.safe_dump(frontend_description("4KB")))
+    paths.append(tmp_path / "blk.yaml")
+    return [str(path) for path in paths]
+
+def test_every_frontend_generates_the_same_outputs(tmp_path, capsys):
+    outputs = {}
+    for path in write_frontends(tmp_path):
+        assert gen_reg.lint_input(path).errors == []
+        module_info, registers = gen_reg.parse_input(path)
+        assert [field.name for field in registers[0].fields] == ["mode", "en0"]
+        rendered = []
+        for name in ("verilog", "c", "md"):
+            f = io.StringIO()
+            gen_reg.BACKENDS[name][1](f, module_info, registers, "blk", created="-")
+            rendered.append(f.getvalue())
+        outputs[path] = rendered
+    xlsx, *others = outputs.values()
+    assert "en0 <= (en0 & ~msk[0]) | (wr_data[0] & msk[0]);" in xlsx[0]
+    for path, rendered in zip(list(outputs)[1:], others):
+        assert rendered == xlsx, path
+
+def test_number_size_of_a_description_is_bytes():
+    rows = gen_reg.description_rows(frontend_description(4096))
+    assert ("size", "4096B") in rows
+    assert gen_reg.parse_module_size("4096B") == 4096
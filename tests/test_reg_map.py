@@ -0,0 +1,65 @@
+import pytest
+
+import gen_reg
+import reg_map
+
+from conftest import make_sheet_rows
+
+# Scalar registers around two interleaved arrays and one with a gap between its elements
+MAP = [("0x0", "CTRL", [("31:16", "mode", "RW", "16'h1234"), ("0", "en", "RW", "1'b1")]),
+       ("0x4", "STS", [("7:0", "sts", "RO", "8'h0")]),
+       ("0x100+i*0x8", "EVEN", [("31:0", "even", "RW", "32'h0")]),
+       ("0x104+i*0x8", "ODD", [("15:0", "odd", "W1C", "16'h0")]),
+       ("0x200+j*0x10", "WIDE", [("31:8", "wide_hi", "RW", "24'h0"), ("7:0", "wide_lo", "RO", "8'h0")]),
+       ("0x300", "LAST", [("0", "last", "W1P", "1'b0")])]
+VAR_RANGES = {"i": 4, "j": 2}
+
+@pytest.fixture
+def parsed():
+    return gen_reg.parse_excel_rows(make_sheet_rows("blk", MAP), VAR_RANGES, "blk.xlsx")
+
+def register_tuple(reg):
+    return (reg.offset, reg.reg_name, reg.var, reg.var_step, reg.var_val, reg.wr,
+            [(f.bits, f.bits_size, f.name, f.sw_access, f.default) for f in reg.fields])
+
+def test_saved_map_loads_with_the_same_lookups(parsed, tmp_path):
+    module_info, registers = parsed
+    reg_map.RegisterMap(module_info, registers).save(tmp_path / "blk.regc.json")
+    loaded = reg_map.RegisterMap.load(tmp_path / "blk.regc.json")
+
+    assert loaded.module_info == module_info
+    assert [reg.reg_name for reg in loaded] == [reg.reg_name for reg in registers]
+    for reg in registers:
+        assert register_tuple(loaded.register(reg.reg_name)) == register_tuple(reg)
+        for field in reg.fields:
+            owner, loaded_field, msb, lsb = loaded.field(field.name)
+            assert (owner.reg_name, loaded_field.name, (msb, lsb)) == \
+                (reg.reg_name, field.name, gen_reg.bit_range(field.bits))
+
+    # Every word of the address space decodes to the instance the expanded map puts there
+    expected = {instance.offset: instance for instance in gen_reg.ExpandedRegisters(registers)}
+    assert len(expected) == 2 + 5 + 5 + 3 + 1
+    for offset in range(0, 0x308, 4):
+        instance = loaded.at(offset)
+        if offset not in expected:
+            assert instance is None, hex(offset)
+            continue
+        want = expected[offset]
+        assert (instance.offset, instance.reg_name) == (want.offset, want.reg_name), hex(offset)
+        assert [f.name for f in instance.fields] == [f.name for f in want.fields]
+        if isinstance(want, gen_reg.RegisterInstance):
+            assert (instance.reg.reg_name, instance.index) == (want.reg.reg_name, want.index)
+            assert loaded.address(want.reg.reg_name, want.index) == offset
+        else:
+            assert loaded.address(want.reg_name) == offset
+    assert [(i.offset, i.reg_name) for i in loaded.instances()] == [(i.offset, i.reg_name) for i in expected.values()]
+
+def test_lookup_errors(parsed):
+    lookup = reg_map.RegisterMap(*parsed)
+    with pytest.raises(KeyError, match="No register 'NONE' in module 'blk'"):
+        lookup.register("NONE")
+    with pytest.raises(KeyError, match="No field 'none' in module 'blk'"):
+        lookup.field("none")
+    with pytest.raises(IndexError, match="Register 'WIDE' has 3 element"):
+        lookup.address("WIDE", 3)
+    assert lookup.address("WIDE", 2, absolute=True) == 0x220
@@ -0,0 +1,125 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import gen_reg  # noqa: E402
+import reg_model  # noqa: E402
+
+from conftest import make_sheet_rows  # noqa: E402
+
+ACCESS = ("RW", "W1P", "W1C", "RO")
+
+def random_map(rng, parallel):
+    # A few scalar and array registers, each split into random fields of every kind
+    registers, var_ranges, n = [], {}, 0
+    for k in range(rng.randint(2, 5)):
+        array = rng.random() < 0.4
+        if array:
+            var = f"v{k}"
+            var_ranges[var] = rng.randint(0, 5)
+            offset = f"0x{0x100 + k * 0x40:x}+{var}*0x4"
+        else:
+            offset = f"0x{k * 4:x}"
+        fields, msb = [], 31
+        while msb >= 0:
+            width = rng.randint(1, min(12, msb + 1))
+            lsb = msb - width + 1
+            n += 1
+            bits = f"{msb}:{lsb}" if width > 1 else f"{msb}"
+            fields.append((bits, f"f{n}", rng.choice(ACCESS), f"{width}'h{rng.getrandbits(width):x}"))
+            msb = lsb - 1
+        registers.append((offset, f"R{k}", fields))
+    return gen_reg.parse_excel_rows(make_sheet_rows("blk", registers), var_ranges, "blk.xlsx"), parallel
+
+class ScalarModel:
+    """Per-transaction, per-field reference of the generated register block."""
+
+    def __init__(self, module_info, registers, parallel):
+        self.addr_mask = (1 << int(module_info['addr_width'])) - 1
+        self.instances = {}  # address -> [[lsb, width, sw_access, held, value], ...]
+        for reg in (gen_reg.expand_registers(registers) if parallel else registers):
+            # -p instances are plain registers, var is None
+            for index in range(1 if reg.var is None else reg.var_val + 1):
+                fields = []
+                for field in reg.fields:
+                    msb, lsb = gen_reg.bit_range(field.bits)
+                    held = field.sw_access == "W1P" and reg.var is not None
+                    default = gen_reg.verilog_literal_value(field.default)
+                    value = 0 if field.sw_access == "W1P" and not held else default
+                    fields.append([lsb, msb - lsb + 1, field.sw_access, held, value])
+                self.instances[reg.offset + index * (reg.var_step or 0)] = fields
+
+    def step(self, addr, write, wr_data, wr_msk, hw_en, hw_val):
+        fields = self.instances.get(addr & self.addr_mask)
+        if fields is None:
+            return 0, 0
+        msk = sum(0xff << (8 * b) for b in range(4) if wr_msk >> b & 1)
+        rd_data = pulse = 0
+        for field in fields:
+            lsb, width, access, held, value = field
+            ones = (1 << width) - 1
+            en, val = hw_en >> lsb & ones, hw_val >> lsb & ones
+            m, d = msk >> lsb & ones, wr_data >> lsb & ones
+            if access == "RO":
+                value = (value & ~en) | (val & en)
+            if not write and not (access == "W1P" and not held):
+                rd_data |= value << lsb
+            if write:
+                if access == "RW":
+                    value = (value & ~m) | (d & m)
+                elif access == "W1P" and held:
+                    value = d & m
+                elif access == "W1P":
+                    pulse |= (d & m) << lsb
+                elif access == "W1C":
+                    value &= ~(d & m)
+            # One enable per W1C field, the hw_en bit at its lsb
+            if access == "W1C" and en & 1:
+                value = val
+            field[4] = value
+        return rd_data, pulse
+
+@pytest.mark.parametrize("seed", range(20))
+def test_run_matches_the_scalar_reference(seed):
+    rng = random.Random(seed)
+    (module_info, registers), parallel = random_map(rng, parallel=seed % 2 == 1)
+    view = gen_reg.expand_registers(registers) if parallel else registers
+    model = reg_model.RegisterModel(module_info, view)
+    transactions = model.random_transactions(3000, seed=seed, hw_ratio=0.3, unmapped_ratio=0.05)
+    # Drive every hw_en bit, not only the ones the RTL has inputs for
+    noisy = np.random.default_rng(seed).integers(0, 1 << 32, 3000, dtype=np.uint32)
+    transactions["hw_en"] = np.where(transactions["hw_en"] != 0, noisy, 0).astype(np.uint32)
+    rd_data, pulse = model.run(**transactions)
+
+    reference = ScalarModel(module_info, registers, parallel)
+    for t in range(3000):
+        expected = reference.step(*(int(transactions[key][t]) for key in
+                                    ("addr", "write", "wr_data", "wr_msk", "hw_en", "hw_val")))
+        assert (int(rd_data[t]), int(pulse[t])) == expected, f"transaction {t}"
+
+def test_multi_bit_w1c_field_has_one_hw_enable():
+    rows = make_sheet_rows("blk", [("0x0", "STS", [("15:8", "err", "W1C", "8'h0"), ("7:0", "cnt", "RW", "8'h0")])])
+    model = reg_model.RegisterModel(*gen_reg.parse_excel_rows(rows, {}, "blk.xlsx"))
+    # hw_en bits above the field's lsb are not an enable, nothing is loaded
+    model.run(0x0, False, hw_en=0xfe00, hw_val=0xab00)
+    assert model.field("err") == 0
+    # the lsb bit loads the whole field
+    model.run(0x0, False, hw_en=0x0100, hw_val=0xab00)
+    assert model.field("err") == 0xab
+    assert model.read(0x0) == 0xab00
+    # write 1 to clear, the enable wins over the write in the same cycle
+    model.write(0x0, 0x0f00)
+    assert model.field("err") == 0xa0
+    model.run(0x0, True, wr_data=0xff00, hw_en=0x0100, hw_val=0x5500)
+    assert model.field("err") == 0x55
+
+def test_random_hw_enables_only_drive_rtl_inputs():
+    rows = make_sheet_rows("blk", [("0x0", "STS", [("15:8", "err", "W1C", "8'h0"), ("7:0", "cnt", "RW", "8'h0")]),
+                                   ("0x4", "IN", [("31:0", "din", "RO", "32'h0")])])
+    model = reg_model.RegisterModel(*gen_reg.parse_excel_rows(rows, {}, "blk.xlsx"))
+    transactions = model.random_transactions(2000, seed=3, hw_ratio=1.0, unmapped_ratio=0)
+    sts = transactions["addr"] == 0x0
+    assert not (transactions["hw_en"][sts] & ~np.uint32(0x100)).any()
+    assert (transactions["hw_en"][~sts] != 0).any()
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+import gen_reg
+
+from conftest import make_sheet_rows
+from rtl_sim import Rtl
+
+def build(registers, var_ranges, cfg_interface="regbus", **verilog_options):
+    module_info, registers = gen_reg.parse_excel_rows(make_sheet_rows("blk", registers, cfg_interface=cfg_interface),
+                                                      var_ranges, "blk.xlsx")
+    rtl = Rtl(gen_reg.generate_verilog(module_info, registers, "blk", created="-", **verilog_options))
+    rtl.reset()
+    return rtl
+
+def write(rtl, addr, data):
+    rtl.clock(reg_addr=addr, wr_en=1, wr_msk=0xf, wr_data=data)
+    rtl.clock(wr_en=0)
+
+def read(rtl, addr):
+    # rd_addr only exists with a split read address
+    rtl.clock(reg_addr=addr, rd_en=1, **({"rd_addr": addr} if "rd_addr" in rtl.inputs else {}))
+    rtl.clock(rd_en=0)
+    return rtl["rd_data"]
+
+# Six elements, the 3 bit index also decodes the missing elements 6 and 7
+ARRAY_MAP = [("0x0", "CTRL", [("31:0", "ctrl", "RW", "32'h0")]),
+             ("0x100+i*0x8", "ARR", [("31:16", "a_hi", "RW", "16'h0"), ("15:0", "a_lo", "RO", "16'h0")]),
+             ("0x200", "STS", [("7:0", "sts", "RO", "8'h0")])]
+
+@pytest.mark.parametrize("cfg_interface", ["regbus", "regbus_split"])
+@pytest.mark.parametrize("index_decode", [False, True])
+def test_array_decode_selects_every_element(index_decode, cfg_interface):
+    rtl = build(ARRAY_MAP, {"i": 5}, cfg_interface, index_decode=index_decode)
+    write(rtl, 0x0, 0x12345678)
+    for i in range(6):
+        write(rtl, 0x100 + 8 * i, (0x100 + i) << 16)
+    # Between two elements and past the last one nothing is written
+    for addr in (0x104, 0x12c, 0x130, 0x138):
+        write(rtl, addr, 0xffff0000)
+    rtl["a_lo"] = [0xa0 + i for i in range(6)]
+    rtl["sts"] = 0x5a
+
+    expected = {0x0: 0x12345678, 0x200: 0x5a}
+    expected.update({0x100 + 8 * i: (0x100 + i) << 16 | 0xa0 + i for i in range(6)})
+    for addr in list(range(0, 0x148, 4)) + [0x200, 0x204]:
+        assert read(rtl, addr) == expected.get(addr, 0), hex(addr)
+    assert rtl["a_hi"] == [0x100 + i for i in range(6)]
+
+def test_index_decode_refuses_a_step_that_is_not_a_power_of_two():
+    registers = [("0x100+i*0xc", "ARR", [("31:0", "arr", "RW", "32'h0")])]
+    module_info, registers = gen_reg.parse_excel_rows(make_sheet_rows("blk", registers), {"i": 3}, "blk.xlsx")
+    with pytest.raises(ValueError, match="step 0xc is not a power of two"):
+        gen_reg.generate_verilog(module_info, registers, "blk", index_decode=True)
+    # The comparator decode takes any step
+    gen_reg.generate_verilog(module_info, registers, "blk")
+
+def read_map():
+    # 10 scalar registers in 4 banks of 3 and two arrays
+    registers = [(f"0x{4 * n:x}", f"R{n}", [("31:8", f"r{n}_hi", "RO", "24'h0"), ("7:0", f"r{n}_lo", "RW", f"8'h{n:x}")])
+                 for n in range(10)]
+    registers += [("0x100+i*0x4", "A", [("31:0", "a", "RO", "32'h0")]),
+                  ("0x180+k*0x8", "B", [("15:0", "b", "RO", "16'h0")])]
+    return registers, {"i": 4, "k": 2}
+
+@pytest.mark.parametrize("index_decode", [False, True])
+@pytest.mark.parametrize("rd_stages", [1, 2, 3])
+def test_pipelined_read_mux_matches_the_flat_mux(rd_stages, index_decode):
+    registers, var_ranges = read_map()
+    flat = build(registers, var_ranges, index_decode=index_decode)
+    piped = build(registers, var_ranges, index_decode=index_decode, rd_stages=rd_stages, rd_bank_size=3)
+    for rtl in (flat, piped):
+        for n in range(10):
+            rtl[f"r{n}_hi"] = 0x100 * n + 0x11
+        rtl["a"] = [0xa000 + i for i in range(5)]
+        rtl["b"] = [0xb000 + k for k in range(3)]
+    assert piped["rd_valid"] == 0
+
+    rng = random.Random(rd_stages)
+    addresses = [4 * n for n in range(12)] + [0x100 + 4 * i for i in range(6)] + [0x180 + 4 * k for k in range(7)]
+    reads, flat_data, piped_out = [], [], []
+    for cycle in range(200):
+        # Back to back reads, single reads and idle cycles
+        rd_en = int(rng.random() < 0.7 or cycle % 17 == 3)
+        addr = rng.choice(addresses)
+        for rtl in (flat, piped):
+            rtl.clock(reg_addr=addr, rd_en=rd_en)
+        reads.append(rd_en)
+        flat_data.append(flat["rd_data"])
+        piped_out.append((piped["rd_valid"], piped["rd_data"]))
+
+    # rd_valid and the data of a read come rd_stages cycles after the flat rd_data
+    for cycle in range(200 - rd_stages):
+        valid, data = piped_out[cycle + rd_stages]
+        assert valid == reads[cycle], cycle
+        if valid:
+            assert data == flat_data[cycle], cycle
+    assert sum(reads) > 100 and any(flat_data)
@@ -0,0 +1,87 @@
+import random
+import re
+
+import gen_reg
+
+CONFLICT = re.compile(r"Address conflict at 0x([0-9a-f]+): '([^']+)' and '([^']+)'")
+
+def register(name, offset, step=None, count=1):
+    reg = gen_reg.Register()
+    reg.reg_name = name
+    reg.offset = offset
+    if step is not None:
+        reg.var, reg.var_step, reg.var_val = "i", step, count - 1
+    return reg
+
+def address_conflicts(registers):
+    # {(address, {element names})} of the reported address conflicts
+    found = set()
+    for message in gen_reg.validate_registers(registers):
+        match = CONFLICT.match(message)
+        assert match, message
+        found.add((int(match.group(1), 16), frozenset(match.group(2, 3))))
+    return found
+
+def brute_force_conflicts(registers):
+    # Expand every array and report the lowest common address of each pair
+    addresses = [{reg.offset + i * (reg.var_step or 0) for i in range(reg.count())} for reg in registers]
+    found = set()
+    for n, reg in enumerate(registers):
+        for m in range(n):
+            common = addresses[n] & addresses[m]
+            if common:
+                addr = min(common)
+                other = registers[m]
+                found.add((addr, frozenset((gen_reg._element_name(other, addr), gen_reg._element_name(reg, addr)))))
+    return found
+
+def test_overlapping_arrays():
+    regs = [register("A", 0x100, 0x4, 8), register("B", 0x110, 0x4, 4)]
+    assert address_conflicts(regs) == {(0x110, frozenset(("A[4]", "B[0]")))}
+
+def test_interleaved_arrays_do_not_conflict():
+    regs = [register("A", 0x100, 0x8, 8), register("B", 0x104, 0x8, 8)]
+    assert address_conflicts(regs) == set()
+
+def test_interleaved_arrays_with_a_shared_element():
+    # 0x100 + 8*i == 0x104 + 12*j first holds at 0x110 = A[2] = B[1]
+    regs = [register("A", 0x100, 0x8, 8), register("B", 0x104, 0xc, 4)]
+    assert address_conflicts(regs) == {(0x110, frozenset(("A[2]", "B[1]")))}
+
+def test_coprime_steps():
+    # 12*i == 8 + 20*j first holds at 0x30 = A[4] = B[2]
+    regs = [register("A", 0x0, 12, 16), register("B", 0x8, 20, 16)]
+    assert address_conflicts(regs) == {(0x30, frozenset(("A[4]", "B[2]")))}
+
+def test_coprime_steps_near_miss():
+    # The first common address 0x30 lies one element past the end of A
+    regs = [register("A", 0x0, 12, 4), register("B", 0x8, 20, 16)]
+    assert address_conflicts(regs) == set()
+    # and one element past the end of B
+    regs = [register("A", 0x0, 12, 16), register("B", 0x8, 20, 2)]
+    assert address_conflicts(regs) == set()
+
+def test_steps_without_common_residue():
+    # Every A address is 0 mod 8, every B address 4 mod 8
+    regs = [register("A", 0x0, 0x8, 64), register("B", 0x4, 0x10, 32)]
+    assert address_conflicts(regs) == set()
+
+def test_scalar_inside_an_array_range():
+    regs = [register("A", 0x100, 0x8, 8), register("X", 0x104), register("Y", 0x108)]
+    assert address_conflicts(regs) == {(0x108, frozenset(("A[1]", "Y")))}
+
+def test_scalar_just_past_an_array():
+    regs = [register("A", 0x100, 0x4, 8), register("X", 0x120), register("Y", 0xfc)]
+    assert address_conflicts(regs) == set()
+
+def test_matches_brute_force_on_random_maps():
+    rng = random.Random(7)
+    for _ in range(300):
+        regs = []
+        for n in range(rng.randint(2, 6)):
+            offset = rng.randrange(0, 0x100, 4)
+            if rng.random() < 0.7:
+                regs.append(register(f"R{n}", offset, rng.choice((4, 8, 12, 16, 20, 28, 36)), rng.randint(1, 12)))
+            else:
+                regs.append(register(f"R{n}", offset))
+        assert address_conflicts(regs) == brute_force_conflicts(regs)
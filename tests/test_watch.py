@@ -0,0 +1,84 @@
+import io
+import os
+import threading
+import time
+
+import pytest
+
+import gen_reg
+
+from conftest import make_sheet_rows, write_csv
+
+# Two registers in each of the 256 byte windows 0, 1 and 2
+WINDOWED_MAP = [(f"0x{window * 0x100 + 4 * n:x}", f"R{window}{n}", [("31:0", f"r{window}{n}", "RW", "32'h0")])
+                for window in range(3) for n in range(2)]
+
+def edit(path, registers):
+    write_csv(path, make_sheet_rows("blk", registers))
+    # A new mtime even on a coarse file system clock
+    os.utime(path, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+
+def touched(out_dir, action):
+    # The outputs action rewrote, every output gets an old mtime first
+    names = sorted(os.listdir(out_dir))
+    for name in names:
+        os.utime(out_dir / name, ns=(10**18, 10**18))
+    action()
+    return [name for name in names if os.stat(out_dir / name).st_mtime_ns != 10**18]
+
+@pytest.fixture
+def watcher(tmp_path):
+    source = tmp_path / "blk.csv"
+    edit(source, WINDOWED_MAP)
+    watcher = gen_reg.Watcher([str(source)], out_dir=str(tmp_path / "out"), partition=(None, 256))
+    assert len(watcher.poll()) == 1
+    assert sorted(os.listdir(tmp_path / "out")) == ["blk.v", "blk_blk0.v", "blk_blk1.v", "blk_blk2.v"]
+    return watcher, source, tmp_path / "out"
+
+def test_only_the_window_of_a_changed_register_is_written(watcher):
+    watcher, source, out_dir = watcher
+    registers = list(WINDOWED_MAP)
+    registers[2] = ("0x100", "R10", [("31:0", "r10", "RW", "32'h5")])  # new default, same ports
+    written = touched(out_dir, lambda: edit(source, registers) or watcher.poll())
+    assert written == ["blk_blk1.v"]
+    assert "r10[31:0] <= 32'h5;" in (out_dir / "blk_blk1.v").read_text()
+
+def test_the_top_is_written_when_its_ports_change(watcher):
+    watcher, source, out_dir = watcher
+    registers = list(WINDOWED_MAP)
+    registers[5] = ("0x204", "R21", [("31:1", "r21", "RW", "31'h0"), ("0", "r21_en", "RW", "1'b0")])
+    assert touched(out_dir, lambda: edit(source, registers) or watcher.poll()) == ["blk.v", "blk_blk2.v"]
+    # A register moving to another window changes both windows and the top
+    registers[0] = ("0x208", "R00", [("31:0", "r00", "RW", "32'h0")])
+    assert touched(out_dir, lambda: edit(source, registers) or watcher.poll()) == ["blk.v", "blk_blk0.v", "blk_blk2.v"]
+
+def test_unchanged_map_and_forced_regeneration(watcher):
+    watcher, source, out_dir = watcher
+    assert touched(out_dir, lambda: edit(source, WINDOWED_MAP) or watcher.poll()) == []
+    # regen writes a missing output even though the map is the same
+    os.remove(out_dir / "blk_blk1.v")
+    assert "blk_blk1.v generated" in watcher.command("regen")
+    assert os.path.exists(out_dir / "blk_blk1.v")
+
+def test_commands_do_not_hold_off_polling(watcher, monkeypatch):
+    watcher, source, out_dir = watcher
+    monkeypatch.setattr("sys.stdin", io.StringIO(""))
+    watcher.interval = 0.05
+    # A backlog of commands that takes far longer than the interval to drain
+    for _ in range(100000):
+        watcher.commands.put(("status", None))
+    runner = threading.Thread(target=watcher.run, daemon=True)
+    runner.start()
+    try:
+        while watcher.commands.qsize() == 100000:
+            time.sleep(0.001)  # past the first poll of run
+        stats = watcher.state[str(source)][0]
+        edit(source, WINDOWED_MAP[:-1])
+        deadline = time.monotonic() + 30
+        while watcher.state[str(source)][0] == stats and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert watcher.commands.qsize() > 0, "the changed input was polled only once the commands ran out"
+    finally:
+        watcher.commands.put(("quit", None))
+        runner.join(5)
+    assert not runner.is_alive()